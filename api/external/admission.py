@@ -0,0 +1,252 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from redis.exceptions import RedisError
+from api.utils.redis_client import get_redis_client
+from api.utils.metrics import (
+    LLM_ADMISSION_IN_FLIGHT, LLM_ADMISSION_WAIT, LLM_ADMISSION_REJECTIONS,
+    LLM_CIRCUIT_STATE, LLM_CIRCUIT_TRANSITIONS,
+)
+
+
+class LLMUnavailable(Exception):
+    """Raised when an LLM call is rejected by admission control or the circuit breaker"""
+
+
+# Add the caller only if fewer than `limit` leases are held. Runs atomically in Redis.
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore shared by every web and worker process through Redis.
+
+    Holders are members of a sorted set scored by acquisition time, so a
+    lease left behind by a crashed process expires after `lease_seconds`.
+    Callers wait for a free slot in a bounded queue (also a sorted set)
+    and give up after `wait_timeout` seconds.
+    """
+    holders_key = 'llm_admission:holders'
+    waiters_key = 'llm_admission:waiters'
+    poll_interval = 0.05
+
+    def __init__(self, limit=None, max_queue=None, wait_timeout=None, lease_seconds=None):
+        self.limit = limit or settings.LLM_MAX_CONCURRENCY
+        self.max_queue = max_queue if max_queue is not None else settings.LLM_MAX_QUEUE
+        self.wait_timeout = wait_timeout if wait_timeout is not None else settings.LLM_QUEUE_TIMEOUT_SECONDS
+        self.lease_seconds = lease_seconds or settings.LLM_LEASE_SECONDS
+        self.acquire_script = None
+
+    def try_acquire(self, client, token):
+        now = time.time()
+        if self.acquire_script is None:
+            self.acquire_script = client.register_script(ACQUIRE_SCRIPT)
+        return bool(self.acquire_script(
+            keys=[self.holders_key],
+            args=[now - self.lease_seconds, self.limit, now, token]
+        ))
+
+    def acquire(self):
+        """Wait for a slot, returns the lease token"""
+        client = get_redis_client()
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+
+        if self.try_acquire(client, token):
+            self.record_acquired(client, started)
+            return token
+
+        now = time.time()
+        # Waiters that vanished without cleaning up
+        client.zremrangebyscore(self.waiters_key, '-inf', now - self.wait_timeout - 1)
+        client.zadd(self.waiters_key, {token: now})
+        try:
+            if client.zcard(self.waiters_key) > self.max_queue:
+                LLM_ADMISSION_REJECTIONS.labels(reason='queue_full').inc()
+                raise LLMUnavailable("Too many requests are waiting for the AI service")
+
+            deadline = started + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval * random.uniform(0.5, 1.5))
+                if self.try_acquire(client, token):
+                    self.record_acquired(client, started)
+                    return token
+        finally:
+            client.zrem(self.waiters_key, token)
+
+        LLM_ADMISSION_WAIT.observe(time.monotonic() - started)
+        LLM_ADMISSION_REJECTIONS.labels(reason='timeout').inc()
+        raise LLMUnavailable("Timed out waiting for the AI service")
+
+    def record_acquired(self, client, started):
+        LLM_ADMISSION_WAIT.observe(time.monotonic() - started)
+        LLM_ADMISSION_IN_FLIGHT.set(client.zcard(self.holders_key))
+
+    def release(self, token):
+        client = get_redis_client()
+        client.zrem(self.holders_key, token)
+        LLM_ADMISSION_IN_FLIGHT.set(client.zcard(self.holders_key))
+
+    @contextmanager
+    def slot(self):
+        try:
+            token = self.acquire()
+        except RedisError as e:
+            # Don't take note creation down with Redis, run unlimited instead
+            print(f"Admission control unavailable: {e}")
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            try:
+                self.release(token)
+            except RedisError as e:
+                print(f"Failed to release LLM slot, it expires with its lease: {e}")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared through Redis.
+
+    Call outcomes are counted in fixed windows. Once a window has enough
+    calls and the share of failures or slow calls crosses its threshold,
+    the circuit opens and calls fail fast for `open_seconds`. After that a
+    single probe call is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    open_key = 'llm_breaker:open'
+    half_open_key = 'llm_breaker:half_open'
+    probe_key = 'llm_breaker:probe'
+    stats_prefix = 'llm_breaker:stats'
+
+    def __init__(self):
+        self.window_seconds = settings.LLM_BREAKER_WINDOW_SECONDS
+        self.min_calls = settings.LLM_BREAKER_MIN_CALLS
+        self.error_rate = settings.LLM_BREAKER_ERROR_RATE
+        self.slow_call_seconds = settings.LLM_BREAKER_SLOW_CALL_SECONDS
+        self.slow_call_rate = settings.LLM_BREAKER_SLOW_CALL_RATE
+        self.open_seconds = settings.LLM_BREAKER_OPEN_SECONDS
+
+    def stats_key(self):
+        return f"{self.stats_prefix}:{int(time.time() // self.window_seconds)}"
+
+    def allow(self):
+        """Whether a call may go through right now"""
+        try:
+            client = get_redis_client()
+            if client.exists(self.open_key):
+                LLM_CIRCUIT_STATE.set(self.OPEN)
+                return False
+            if client.exists(self.half_open_key):
+                LLM_CIRCUIT_STATE.set(self.HALF_OPEN)
+                # Only one probe at a time, it must finish within the request timeout
+                return bool(client.set(
+                    self.probe_key, 1, nx=True, ex=settings.LLM_REQUEST_TIMEOUT_SECONDS
+                ))
+            LLM_CIRCUIT_STATE.set(self.CLOSED)
+            return True
+        except RedisError as e:
+            print(f"Circuit breaker unavailable: {e}")
+            return True
+
+    def record(self, success, duration):
+        try:
+            client = get_redis_client()
+            if client.exists(self.open_key):
+                # Calls that started before the circuit opened don't count
+                return
+            if client.exists(self.half_open_key):
+                if success and duration < self.slow_call_seconds:
+                    client.delete(self.half_open_key, self.probe_key)
+                    self.transition(self.CLOSED)
+                else:
+                    self.trip(client)
+                return
+
+            key = self.stats_key()
+            pipe = client.pipeline()
+            pipe.hincrby(key, 'total', 1)
+            pipe.hincrby(key, 'failures', 0 if success else 1)
+            pipe.hincrby(key, 'slow', 1 if duration >= self.slow_call_seconds else 0)
+            pipe.expire(key, self.window_seconds * 2)
+            total, failures, slow, _ = pipe.execute()
+
+            if total >= self.min_calls and (
+                failures / total >= self.error_rate or slow / total >= self.slow_call_rate
+            ):
+                self.trip(client)
+        except RedisError as e:
+            print(f"Circuit breaker unavailable: {e}")
+
+    def trip(self, client):
+        pipe = client.pipeline()
+        pipe.set(self.open_key, 1, ex=self.open_seconds)
+        # Expires too, so a probe whose process died can't hold the circuit half-open for good
+        pipe.set(self.half_open_key, 1, ex=self.open_seconds + settings.LLM_LEASE_SECONDS)
+        pipe.delete(self.probe_key, self.stats_key())
+        pipe.execute()
+        self.transition(self.OPEN)
+
+    def transition(self, state):
+        LLM_CIRCUIT_STATE.set(state)
+        LLM_CIRCUIT_TRANSITIONS.labels(
+            state={self.CLOSED: 'closed', self.OPEN: 'open', self.HALF_OPEN: 'half_open'}[state]
+        ).inc()
+
+
+class LLMGuard:
+    """Runs backend calls through the circuit breaker and the concurrency limiter"""
+
+    def __init__(self):
+        self.enabled = settings.LLM_ADMISSION_ENABLED
+        self.limiter = ConcurrencyLimiter()
+        self.breaker = CircuitBreaker()
+
+    def check_circuit(self):
+        if not self.breaker.allow():
+            LLM_ADMISSION_REJECTIONS.labels(reason='circuit_open').inc()
+            raise LLMUnavailable("The AI service is temporarily unavailable")
+
+    def call(self, func, *args):
+        if not self.enabled:
+            return func(*args)
+
+        self.check_circuit()
+        with self.limiter.slot():
+            started = time.monotonic()
+            try:
+                result = func(*args)
+            except Exception:
+                self.breaker.record(False, time.monotonic() - started)
+                raise
+            self.breaker.record(True, time.monotonic() - started)
+            return result
+
+    def stream(self, func, *args):
+        """Like call(), for generators: the slot is held until the stream is exhausted"""
+        if not self.enabled:
+            yield from func(*args)
+            return
+
+        self.check_circuit()
+        with self.limiter.slot():
+            started = time.monotonic()
+            try:
+                yield from func(*args)
+            except Exception:
+                self.breaker.record(False, time.monotonic() - started)
+                raise
+            self.breaker.record(True, time.monotonic() - started)
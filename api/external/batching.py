@@ -0,0 +1,65 @@
+from django.conf import settings
+from redis.exceptions import RedisError
+from core.celery import app
+from api.utils.redis_client import get_redis_client
+from api.utils.metrics import LLM_BATCH_SIZE, LLM_BATCH_FILL_RATIO
+
+
+class NoteBatcher:
+    """
+    Groups async note jobs arriving within a short window so their
+    extraction runs as one multi-note LLM call.
+
+    Job ids are appended to a Redis list. The first job of a window schedules
+    a flush once the window closes; a job that fills the batch flushes it
+    straight away.
+    """
+    queue_key = 'llm_batch:pending'
+    flush_key = 'llm_batch:flush_scheduled'
+
+    @classmethod
+    def submit(cls, job_id):
+        """Queue a note job for extraction, batched when batching is enabled"""
+        if settings.LLM_BATCH_ENABLED:
+            try:
+                cls.enqueue(job_id)
+                return
+            except RedisError as e:
+                print(f"Batch queue unavailable, processing job {job_id} alone: {e}")
+
+        app.send_task('process_note_job', args=[job_id])
+
+    @classmethod
+    def enqueue(cls, job_id):
+        get_redis_client().rpush(cls.queue_key, job_id)
+        cls.schedule_flush()
+
+    @classmethod
+    def schedule_flush(cls):
+        """Flush now if a full batch is waiting, otherwise once the window closes"""
+        client = get_redis_client()
+        size = client.llen(cls.queue_key)
+
+        if size >= settings.LLM_BATCH_MAX_SIZE:
+            app.send_task('flush_note_batch')
+        elif size and client.set(cls.flush_key, 1, nx=True, ex=cls.flush_key_ttl()):
+            app.send_task('flush_note_batch', countdown=settings.LLM_BATCH_WINDOW_MS / 1000)
+
+    @classmethod
+    def take_batch(cls):
+        """Pop up to one batch worth of job ids"""
+        client = get_redis_client()
+        # Let the next arrival open a new window
+        client.delete(cls.flush_key)
+        job_ids = client.lpop(cls.queue_key, settings.LLM_BATCH_MAX_SIZE) or []
+        job_ids = [int(job_id) for job_id in job_ids]
+
+        if job_ids:
+            LLM_BATCH_SIZE.observe(len(job_ids))
+            LLM_BATCH_FILL_RATIO.observe(len(job_ids) / settings.LLM_BATCH_MAX_SIZE)
+        return job_ids
+
+    @staticmethod
+    def flush_key_ttl():
+        # Outlive the window so a slow broker can't schedule duplicate flushes
+        return max(1, int(settings.LLM_BATCH_WINDOW_MS / 1000) + 5)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from redis.exceptions import RedisError
+from api.utils.redis_client import get_redis_client
+from api.utils.metrics import LLM_CACHE_REQUESTS, LLM_CACHE_EVICTIONS
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of LLM extraction results.
+
+    Entries are keyed by a hash of the normalized note text and the prompt
+    version, so only the extraction result is stored, never the note itself.
+    A sorted set of last-access times keeps the cache bounded: once it grows
+    past `max_entries` the least recently used entries are evicted.
+    """
+    key_prefix = 'llm_extraction'
+
+    def __init__(self, prompt_version, ttl=None, max_entries=None):
+        self.prompt_version = prompt_version
+        self.ttl = ttl or settings.LLM_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.enabled = settings.LLM_CACHE_ENABLED
+        self.index_key = f"{self.key_prefix}:{self.prompt_version}:lru"
+
+    @staticmethod
+    def normalize(note_content: str) -> str:
+        """Collapse whitespace and case so trivially different copies share an entry"""
+        return ' '.join(note_content.split()).casefold()
+
+    def make_key(self, note_content: str) -> str:
+        digest = hashlib.sha256(
+            f"{self.prompt_version}:{self.normalize(note_content)}".encode()
+        ).hexdigest()
+        return f"{self.key_prefix}:{self.prompt_version}:{digest}"
+
+    def get(self, note_content: str):
+        """Return the cached extraction for the note, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        key = self.make_key(note_content)
+        try:
+            client = get_redis_client()
+            value = client.get(key)
+            if value is None:
+                LLM_CACHE_REQUESTS.labels(result='miss').inc()
+                return None
+            client.zadd(self.index_key, {key: time.time()})
+        except RedisError as e:
+            print(f"LLM cache unavailable: {e}")
+            LLM_CACHE_REQUESTS.labels(result='error').inc()
+            return None
+
+        LLM_CACHE_REQUESTS.labels(result='hit').inc()
+        return json.loads(value)
+
+    def set(self, note_content: str, result: dict):
+        """Store an extraction result and evict the least recently used entries"""
+        if not self.enabled:
+            return
+
+        key = self.make_key(note_content)
+        now = time.time()
+        try:
+            client = get_redis_client()
+            pipe = client.pipeline()
+            pipe.set(key, json.dumps(result), ex=self.ttl)
+            pipe.zadd(self.index_key, {key: now})
+            # Entries that already expired through their TTL
+            pipe.zremrangebyscore(self.index_key, '-inf', now - self.ttl)
+            pipe.zcard(self.index_key)
+            size = pipe.execute()[-1]
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = client.zrange(self.index_key, 0, overflow - 1)
+                if evicted:
+                    pipe = client.pipeline()
+                    pipe.delete(*evicted)
+                    pipe.zrem(self.index_key, *evicted)
+                    pipe.execute()
+                    LLM_CACHE_EVICTIONS.inc(len(evicted))
+        except RedisError as e:
+            print(f"LLM cache unavailable: {e}")
@@ -0,0 +1,214 @@
+import re
+from functools import lru_cache
+from django.conf import settings
+from apps.patient.models import ActionPlan
+from api.external.services import LLMService
+from api.external.admission import LLMUnavailable
+from api.utils.metrics import NOTE_EXTRACTIONS
+
+
+WORD_NUMBERS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'fourteen': 14,
+    'twenty': 20, 'thirty': 30,
+}
+UNIT_DAYS = {'day': 1, 'week': 7, 'month': 30}
+
+
+class RuleBasedExtractor:
+    """
+    Parses simple dosing instructions ("take X twice daily for 10 days")
+    with compiled patterns, returning the same structure as the LLM along
+    with a confidence score between 0 and 1.
+    """
+    # Periods followed by a digit are decimals ("2.5mg"), not sentence ends
+    SENTENCE_SPLIT = re.compile(r'[;!?\n]+|\.(?!\d)')
+
+    DURATION = re.compile(
+        r'\b(?:for|x)\s+(?:the\s+next\s+)?(\d+|' + '|'.join(WORD_NUMBERS) + r')\s+(day|week|month)s?\b',
+        re.IGNORECASE
+    )
+
+    # Checked in order, the most specific schedule wins
+    FREQUENCIES = [
+        (ActionPlan.Frequency.MONTHLY, re.compile(
+            r'\b(?:monthly|every\s+month|once\s+(?:a|per)\s+month)\b',
+            re.IGNORECASE
+        )),
+        (ActionPlan.Frequency.WEEKLY, re.compile(
+            r'\b(?:weekly|every\s+week|(?:once|twice|\d+\s+times)\s+(?:a|per)\s+week'
+            r'|every\s+(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday))\b',
+            re.IGNORECASE
+        )),
+        (ActionPlan.Frequency.DAILY, re.compile(
+            r'\b(?:daily|nightly|every\s+day|each\s+day|every\s+(?:morning|evening|night)'
+            r'|(?:once|twice|thrice|(?:two|three|four|\d+)\s+times)\s+(?:a|per)\s+day'
+            r'|every\s+\d+\s+hours|at\s+bedtime|bid|tid|qid|qd)\b',
+            re.IGNORECASE
+        )),
+    ]
+
+    # Schedules are only read from instructions starting with one of these verbs
+    SCHEDULED_ACTION = re.compile(
+        r'^(?:please\s+)?(?:take|use|apply|inhale|inject|swallow|chew|dissolve|spray|insert|instill'
+        r'|rinse|gargle|drink|give|place|continue|start|check|measure|monitor|record|walk|exercise)\b',
+        re.IGNORECASE
+    )
+
+    # Stop instructions and patient history mention schedules too, they are left to the LLM
+    NEGATION = re.compile(
+        r"\b(?:not|no|never|don't|doesn't|stop|stopped|discontinue|discontinued|avoid|hold|withhold"
+        r"|cease|quit)\b|n't\b",
+        re.IGNORECASE
+    )
+    HISTORY = re.compile(
+        r'\b(?:reports?|reported|reporting|history\s+of|hx\s+of|has\s+had|had|complains?|complained'
+        r'|denies|denied|presents?\s+with|presented\s+with|patient|pt)\b',
+        re.IGNORECASE
+    )
+
+    ONE_OFF_TASK = re.compile(
+        r'^(?:please\s+)?(?:schedule|book|buy|pick\s+up|get|arrange|complete|fill|bring'
+        r'|return|follow\s+up|visit|obtain|do\s+a|have\s+a)\b',
+        re.IGNORECASE
+    )
+
+    def extract(self, note_content):
+        """Returns (result, confidence), confidence is 0 when any sentence negates or reports"""
+        result = {'checklist_items': [], 'action_plans': []}
+        sentences = [
+            sentence.strip(' ,-*\t')
+            for sentence in self.SENTENCE_SPLIT.split(note_content or '')
+        ]
+        sentences = [sentence for sentence in sentences if sentence]
+        if not sentences:
+            return result, 0.0
+
+        score = 0.0
+        needs_llm = False
+        for sentence in sentences:
+            if self.NEGATION.search(sentence) or self.HISTORY.search(sentence):
+                needs_llm = True
+                continue
+
+            duration_match = self.DURATION.search(sentence)
+            schedule_text = self.DURATION.sub(' ', sentence)
+            frequencies = [
+                (frequency, len(pattern.findall(schedule_text)))
+                for frequency, pattern in self.FREQUENCIES
+            ]
+            matched = [frequency for frequency, count in frequencies if count]
+
+            if (
+                len(matched) == 1
+                and sum(count for _, count in frequencies) == 1
+                and self.SCHEDULED_ACTION.search(sentence)
+            ):
+                plan = {
+                    'action': sentence[:255],
+                    'frequency': matched[0].value,
+                    'duration_days': self.duration_days(duration_match) if duration_match else 7,
+                }
+                result['action_plans'].append(plan)
+                # Without an explicit duration we are only guessing the default
+                score += 1.0 if duration_match else 0.5
+            elif not matched and self.ONE_OFF_TASK.search(sentence):
+                result['checklist_items'].append({'task': sentence[:255]})
+                score += 0.9
+            # Anything else (several schedules in one sentence, other verbs) needs the LLM
+
+        # Items from the other sentences are still used when the LLM is unavailable
+        if needs_llm:
+            return result, 0.0
+        return result, score / len(sentences)
+
+    @staticmethod
+    def duration_days(match):
+        amount, unit = match.group(1).lower(), match.group(2).lower()
+        amount = int(amount) if amount.isdigit() else WORD_NUMBERS[amount]
+        return amount * UNIT_DAYS[unit]
+
+
+class NoteExtractor:
+    """
+    Tiered note extraction: the rule-based extractor answers simple notes
+    and the LLM (behind its cache) is only called when the rules aren't
+    confident enough.
+    """
+    def __init__(self, llm_service=None):
+        self.rules = RuleBasedExtractor()
+        self.llm_service = llm_service or LLMService()
+        self.min_confidence = settings.RULE_EXTRACTOR_MIN_CONFIDENCE
+
+    def degrade(self, note_content, error):
+        """Rule-based result regardless of confidence, used when the LLM can't be reached"""
+        if not settings.LLM_DEGRADE_TO_RULES:
+            raise error
+        NOTE_EXTRACTIONS.labels(tier='degraded').inc()
+        result, _ = self.rules.extract(note_content)
+        return LLMService.stamp_dates(result)
+
+    def extract_with_rules(self, note_content):
+        """The rule-based result when it is confident enough, otherwise None"""
+        if not settings.RULE_EXTRACTOR_ENABLED:
+            return None
+        result, confidence = self.rules.extract(note_content)
+        if confidence < self.min_confidence:
+            return None
+        return LLMService.stamp_dates(result)
+
+    def process_doctor_note(self, note_content):
+        result = self.extract_with_rules(note_content)
+        if result is not None:
+            NOTE_EXTRACTIONS.labels(tier='rules').inc()
+            return result
+
+        try:
+            result = self.llm_service.process_doctor_note(note_content)
+        except LLMUnavailable as e:
+            return self.degrade(note_content, e)
+        NOTE_EXTRACTIONS.labels(tier='llm').inc()
+        return result
+
+    def stream_doctor_note(self, note_content):
+        """Yield (section, item) pairs, all at once when the rules answer the note"""
+        result = self.extract_with_rules(note_content)
+        if result is not None:
+            NOTE_EXTRACTIONS.labels(tier='rules').inc()
+            for section in ('checklist_items', 'action_plans'):
+                for item in result[section]:
+                    yield section, item
+            return
+
+        try:
+            # Admission is decided before the first item, nothing has been sent if it fails
+            yield from self.llm_service.stream_doctor_note(note_content)
+        except LLMUnavailable as e:
+            result = self.degrade(note_content, e)
+            for section in ('checklist_items', 'action_plans'):
+                for item in result[section]:
+                    yield section, item
+            return
+        NOTE_EXTRACTIONS.labels(tier='llm').inc()
+
+    def process_doctor_notes(self, note_contents):
+        results = [self.extract_with_rules(content) for content in note_contents]
+        pending = [index for index, result in enumerate(results) if result is None]
+
+        NOTE_EXTRACTIONS.labels(tier='rules').inc(len(note_contents) - len(pending))
+        if pending:
+            try:
+                llm_results = self.llm_service.process_doctor_notes([note_contents[index] for index in pending])
+            except LLMUnavailable as e:
+                llm_results = [self.degrade(note_contents[index], e) for index in pending]
+            else:
+                NOTE_EXTRACTIONS.labels(tier='llm').inc(len(pending))
+            for index, result in zip(pending, llm_results):
+                results[index] = result
+        return results
+
+
+@lru_cache(maxsize=None)
+def get_note_extractor():
+    """Shared extractor, built on first use so importing views doesn't set up an LLM backend"""
+    return NoteExtractor()
@@ -0,0 +1,141 @@
+import time
+import google.generativeai as genai
+import requests
+from django.conf import settings
+from api.utils.metrics import (
+    LLM_REQUESTS, LLM_REQUEST_LATENCY, LLM_TIME_TO_FIRST_CHUNK, LLM_TOKENS, LLM_REQUEST_COST
+)
+
+
+class LLMBackend:
+    """
+    Text generation backend used by LLMService.
+
+    Subclasses implement `_generate` returning `(text, usage)` and `_stream`
+    yielding `(text_chunk, usage)`, where usage is a `(prompt_tokens,
+    response_tokens)` tuple or None when unknown. The public methods time
+    every call and record token usage and cost per model.
+    """
+    model_name = None
+
+    def generate(self, prompt: str) -> str:
+        """Return the full response text for the prompt"""
+        started = time.monotonic()
+        try:
+            text, usage = self._generate(prompt)
+        except Exception:
+            self.observe('generate', 'error', started)
+            raise
+        self.observe('generate', 'success', started, usage)
+        return text
+
+    def stream(self, prompt: str):
+        """Yield the response text in chunks as it is generated"""
+        started = time.monotonic()
+        usage = None
+        first_chunk = True
+        try:
+            for text, chunk_usage in self._stream(prompt):
+                if first_chunk:
+                    LLM_TIME_TO_FIRST_CHUNK.labels(model=self.model_name).observe(time.monotonic() - started)
+                    first_chunk = False
+                # Usage is reported cumulatively, the last chunk has the totals
+                usage = chunk_usage or usage
+                yield text
+        except Exception:
+            self.observe('stream', 'error', started)
+            raise
+        self.observe('stream', 'success', started, usage)
+
+    def observe(self, operation, outcome, started, usage=None):
+        LLM_REQUESTS.labels(model=self.model_name, operation=operation, outcome=outcome).inc()
+        LLM_REQUEST_LATENCY.labels(model=self.model_name, operation=operation).observe(time.monotonic() - started)
+        if not usage:
+            return
+
+        prompt_tokens, response_tokens = usage
+        LLM_TOKENS.labels(model=self.model_name, kind='prompt').observe(prompt_tokens)
+        LLM_TOKENS.labels(model=self.model_name, kind='response').observe(response_tokens)
+        LLM_REQUEST_COST.labels(model=self.model_name).observe(
+            prompt_tokens * settings.LLM_INPUT_COST_PER_MILLION_TOKENS / 1_000_000
+            + response_tokens * settings.LLM_OUTPUT_COST_PER_MILLION_TOKENS / 1_000_000
+        )
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    def _stream(self, prompt):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model_name=None):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.model_name = model_name or settings.GEMINI_MODEL
+        self.model = genai.GenerativeModel(self.model_name)
+
+    @staticmethod
+    def usage(response):
+        metadata = getattr(response, 'usage_metadata', None)
+        if not metadata or not metadata.prompt_token_count:
+            return None
+        return metadata.prompt_token_count, metadata.candidates_token_count
+
+    def _generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        return response.text, self.usage(response)
+
+    def _stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text, self.usage(chunk)
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Talks to the local stand-in started with `manage.py run_fake_llm_server`,
+    so note creation can be load tested without reaching Gemini.
+    """
+    model_name = 'fake'
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or settings.LLM_FAKE_SERVER_URL).rstrip('/')
+        self.timeout = timeout or settings.LLM_REQUEST_TIMEOUT_SECONDS
+        self.session = requests.Session()
+
+    def _generate(self, prompt):
+        response = self.session.post(
+            f"{self.base_url}/generate",
+            json={'prompt': prompt},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        payload = response.json()
+        usage = payload.get('usage')
+        return payload['text'], (usage['prompt_tokens'], usage['response_tokens']) if usage else None
+
+    def _stream(self, prompt):
+        with self.session.post(
+            f"{self.base_url}/stream",
+            json={'prompt': prompt},
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    yield chunk, None
+
+
+LLM_BACKENDS = {
+    'gemini': GeminiBackend,
+    'fake': FakeLLMBackend,
+}
+
+
+def get_llm_backend(name=None):
+    """Build the backend selected by the LLM_BACKEND setting"""
+    name = name or settings.LLM_BACKEND
+    try:
+        return LLM_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of {', '.join(LLM_BACKENDS)}")
@@ -1,22 +1,59 @@
-import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+import time
 from django.conf import settings
 import json
 from django.utils import timezone
-from apps.user.tasks import send_reminder_email
+from django.db import transaction
 from celery.exceptions import OperationalError
 from core.celery import app 
 from apps.patient.models import Reminder, ActionPlan
+from apps.doctor.models import ChecklistItem, DoctorNote
+from apps.user.models import EncryptionKeyPair, KeyRotation
+from api.utils.encryption import NoteEncryption, key_cache
+from django.db.models import F, Q, Max
+from api.external.cache import ExtractionCache
+from api.external.streaming import IncrementalExtractionParser
+from api.external.llm_backends import get_llm_backend
+from api.external.admission import LLMGuard
+from api.utils.metrics import LLM_PARSE_FAILURES
 import traceback
 
 
 class LLMService:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+    # Bump whenever the prompt changes so cached extractions from the old prompt are ignored
+    prompt_version = 'v1'
 
-    def process_doctor_note(self, note_content):
-        prompt = f"""
+    def __init__(self, backend=None):
+        self.backend = backend or get_llm_backend()
+        self.guard = LLMGuard()
+        self.cache = ExtractionCache(self.prompt_version)
+
+    @staticmethod
+    def stamp_plan(plan):
+        """Set start/end dates of an action plan relative to today"""
+        today = datetime.now().date()
+        # Ensure duration_days is an integer (default to 7 if None)
+        duration = plan.get('duration_days', 7)
+        if duration is None or not isinstance(duration, int):
+            duration = 7  # Default duration
+        
+        # plan.pop('duration_days', None)  # Remove from final response
+        plan['start_date'] = today.isoformat()
+        plan['end_date'] = (today + timedelta(days=duration)).isoformat()
+        return plan
+
+    @classmethod
+    def stamp_dates(cls, parsed):
+        """Set start/end dates of each action plan relative to today"""
+        for plan in parsed.get('action_plans', []):
+            cls.stamp_plan(plan)
+        return parsed
+
+    @staticmethod
+    def build_prompt(note_content):
+        return f"""
         Based on the following doctor's note, extract two types of information:
         1. Immediate one-time tasks (checklist items)
         2. Scheduled actions with timing (action plan)
@@ -39,117 +76,293 @@ class LLMService:
         }}
         """
 
-        response = self.model.generate_content(prompt)
+    def process_doctor_note(self, note_content):
+        cached = self.cache.get(note_content)
+        if cached is not None:
+            return self.stamp_dates(cached)
+
+        response_text = self.guard.call(self.backend.generate, self.build_prompt(note_content))
         try:
-            result = response.text
-            start_idx = result.find('{')
-            end_idx = result.rfind('}') + 1
-            json_str = result[start_idx:end_idx]
-            
-            parsed = json.loads(json_str)
-                        
-            today = datetime.now().date()
-            for plan in parsed.get('action_plans', []):
-                # Ensure duration_days is an integer (default to 7 if None)
-                duration = plan.get('duration_days', 7)
-                if duration is None or not isinstance(duration, int):
-                    duration = 7  # Default duration
-                
-                # plan.pop('duration_days', None)  # Remove from final response
-                plan['start_date'] = today.isoformat()
-                plan['end_date'] = (today + timedelta(days=duration)).isoformat()
-                
-            return parsed
+            parsed = self.extract_json(response_text)
+
+            # Cache before stamping, dates are re-derived on every hit
+            self.cache.set(note_content, parsed)
+            return self.stamp_dates(parsed)
         except Exception as e:
+            LLM_PARSE_FAILURES.labels(model=self.backend.model_name, operation='generate').inc()
             print(f"Error processing LLM response: {e}")
             return {
                 'checklist_items': [],
                 'action_plans': []
             } 
 
+    def stream_doctor_note(self, note_content):
+        """Yield (section, item) pairs as soon as each item is complete in the streamed response"""
+        cached = self.cache.get(note_content)
+        if cached is not None:
+            for item in cached.get('checklist_items', []):
+                yield 'checklist_items', item
+            for plan in cached.get('action_plans', []):
+                yield 'action_plans', self.stamp_plan(plan)
+            return
+
+        parser = IncrementalExtractionParser()
+        extracted = {'checklist_items': [], 'action_plans': []}
+        for chunk in self.guard.stream(self.backend.stream, self.build_prompt(note_content)):
+            for section, item in parser.feed(chunk):
+                if section not in extracted:
+                    continue
+                # Keep an unstamped copy for the cache
+                extracted[section].append(dict(item))
+                if section == 'action_plans':
+                    self.stamp_plan(item)
+                yield section, item
+
+        if parser.complete:
+            self.cache.set(note_content, extracted)
+        else:
+            LLM_PARSE_FAILURES.labels(model=self.backend.model_name, operation='stream').inc()
+            print("Streamed LLM response ended before the JSON document was complete")
+
+    def process_doctor_notes(self, note_contents):
+        """Extract several notes with a single LLM call, results keep the input order"""
+        results = [self.cache.get(content) for content in note_contents]
+        pending = [index for index, result in enumerate(results) if result is None]
+
+        if len(pending) == 1:
+            results[pending[0]] = self.process_doctor_note(note_contents[pending[0]])
+            pending = []
+
+        if pending:
+            notes_block = "\n".join(
+                f"<note id=\"{index}\">\n{note_contents[index]}\n</note>"
+                for index in pending
+            )
+            prompt = f"""
+        Below are {len(pending)} separate doctor's notes, each wrapped in a <note> tag with an id.
+        For EACH note independently, extract two types of information:
+        1. Immediate one-time tasks (checklist items)
+        2. Scheduled actions with timing (action plan)
+
+        Doctor's Notes:
+        {notes_block}
+
+        Please format your response in JSON with the following structure, one entry per note id:
+        {{
+            "notes": [
+                {{
+                    "id": note_id,
+                    "checklist_items": [
+                        {{"task": "task description"}}
+                    ],
+                    "action_plans": [
+                        {{
+                            "action": "action description",
+                            "frequency": "DAILY/WEEKLY/MONTHLY",
+                            "duration_days": number_of_days
+                        }}
+                    ]
+                }}
+            ]
+        }}
+        """
+
+            response_text = self.guard.call(self.backend.generate, prompt)
+            try:
+                parsed = self.extract_json(response_text)
+                for entry in parsed.get('notes', []):
+                    # Models sometimes quote the id
+                    try:
+                        index = int(entry.get('id'))
+                    except (TypeError, ValueError):
+                        continue
+                    if index in pending and results[index] is None:
+                        extraction = {
+                            'checklist_items': entry.get('checklist_items', []),
+                            'action_plans': entry.get('action_plans', []),
+                        }
+                        self.cache.set(note_contents[index], extraction)
+                        results[index] = extraction
+            except Exception as e:
+                LLM_PARSE_FAILURES.labels(model=self.backend.model_name, operation='batch').inc()
+                print(f"Error processing batched LLM response: {e}")
+
+        for index, result in enumerate(results):
+            if result is None:
+                # Missing from the batched response, extract this note on its own
+                results[index] = self.process_doctor_note(note_contents[index])
+            else:
+                self.stamp_dates(result)
+        return results
+
+    @staticmethod
+    def extract_json(text):
+        """Parse the JSON object embedded in an LLM response"""
+        start_idx = text.find('{')
+        end_idx = text.rfind('}') + 1
+        return json.loads(text[start_idx:end_idx])
+
 
 class ReminderService:
     @staticmethod
-    def create_schedule_plan_reminders(action_plan):
+    def build_schedule(action_plan, start, stop):
+        """Unsaved reminders for the occurrences with indexes in [start, stop)"""
+        # bulk_create skips Reminder.save, copy the denormalized columns here
+        return [
+            Reminder(
+                action_plan=action_plan,
+                patient_id=action_plan.patient_id,
+                doctor_patient_id=action_plan.doctor_patient_id,
+                doctor_id=action_plan.doctor_id,
+                title=action_plan.action,
+                scheduled_for=action_plan.occurrence_at(index),
+                description=action_plan.action,
+                is_active=True,
+                sequence_number=index + 1
+            )
+            for index in range(start, stop)
+        ]
+
+    @classmethod
+    def extend_schedule(cls, action_plan, now=None):
+        """
+        Create the reminders of the plan's occurrences that fall within the
+        next REMINDER_WINDOW_OCCURRENCES intervals and don't exist yet.
+        """
+        if (
+            not action_plan.is_active
+            or not action_plan.is_scheduled_lazily
+            or action_plan.materialized_count >= action_plan.duration_days
+        ):
+            return []
+
+        until = (now or timezone.now()) + action_plan.interval * settings.REMINDER_WINDOW_OCCURRENCES
+        if action_plan.occurrences_before(until) <= action_plan.materialized_count:
+            return []
+
+        with transaction.atomic():
+            # Check-ins and the periodic task may extend the same plan
+            locked = ActionPlan.objects.select_for_update().get(pk=action_plan.pk)
+            if not locked.is_active:
+                # Cancelled by a newer note in the meantime
+                return []
+            stop = locked.occurrences_before(until)
+            created_reminders = Reminder.objects.bulk_create(
+                cls.build_schedule(locked, locked.materialized_count, stop)
+            )
+            if created_reminders:
+                ActionPlan.objects.filter(pk=locked.pk).update(materialized_count=stop)
+                locked.materialized_count = stop
+
+        action_plan.materialized_count = locked.materialized_count
+        action_plan.duration_days = locked.duration_days
+        action_plan.schedule_shift = locked.schedule_shift
+        return created_reminders
+
+    @classmethod
+    def create_schedule_plan_reminders(cls, action_plan):
         print(f"Creating schedule reminder for action plan: {action_plan}")
-        
-        try:
+
+        with transaction.atomic():
             """New patient notes cancel any previously scheduled actionable steps."""
-            # Cancel existing active reminders & action plans for the patient
-            patient = action_plan.note.doctor_patient.patient
-            patient.reminders.filter(completed=False).update(is_active=False)
-            patient.action_plans.filter(is_active=True).update(is_active=False)
-            
-            start_date = timezone.make_aware(datetime.combine(datetime.strptime(action_plan.start_date, '%Y-%m-%d').date(), timezone.now().time()))
-            
-            if action_plan.frequency == ActionPlan.Frequency.DAILY:
-                delta = timedelta(days=1)
-            elif action_plan.frequency == ActionPlan.Frequency.WEEKLY:
-                delta = timedelta(weeks=1)
-            elif action_plan.frequency == ActionPlan.Frequency.MONTHLY:
-                delta = timedelta(days=30)
-            elif action_plan.frequency == ActionPlan.Frequency.CUSTOM and action_plan.custom_schedule:
-                return
-                        
-            current_date = start_date
-            sequence = 1
+            # Plans of the same note are scheduled one after the other, leave them alone
+            Reminder.objects.filter(patient_id=action_plan.patient_id, completed=False).exclude(
+                action_plan__note_id=action_plan.note_id
+            ).update(is_active=False)
+            ActionPlan.objects.filter(patient_id=action_plan.patient_id, is_active=True).exclude(
+                note_id=action_plan.note_id
+            ).update(is_active=False)
+
             created_reminders = []
-            
-            for _ in range(action_plan.duration_days):
-                reminder = Reminder.objects.create(
-                    action_plan=action_plan,
-                    patient=patient,
-                    title=action_plan.action,
-                    scheduled_for=current_date,
-                    description=action_plan.action,
-                    is_active=True,
-                    sequence_number=sequence
+            if action_plan.interval is not None:
+                start_date = action_plan.start_date
+                if isinstance(start_date, str):
+                    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+
+                # Only the start of the schedule is stored as reminders, the rest is created as it comes up
+                action_plan.first_occurrence_at = timezone.make_aware(
+                    datetime.combine(start_date, timezone.now().time())
                 )
-                created_reminders.append(reminder)
-                current_date += delta
-                sequence += 1
-            
-            # set the current action plan to be active
-            action_plan.is_active = True
-            action_plan.save()
-            
-            # Schedule first reminder
-            first_reminder = action_plan.reminders.first()
-            print(f"Attempting to schedule first reminder: {first_reminder}")
-            
-            if first_reminder:
-                try:                   
-                    # Print task info for debugging
-                    print(f"Task registered: {send_reminder_email.name}")
-            
-                    # Schedule the reminder
-                    # result = send_reminder_email.apply_async(
-                    #     args=[first_reminder.id],
-                    #     eta=first_reminder.scheduled_for
-                    # )
-                    
-                    result = app.send_task(
-                        'send_reminder_email',
-                        args=[first_reminder.id],
-                        eta=first_reminder.scheduled_for
-                    )
-                    print(f"Successfully scheduled reminder: {result}")
-                    
-                except (OperationalError, ConnectionRefusedError) as e:
-                    print(f"Celery/Redis connection error: {e}")
-                    print(f"Detailed error: {traceback.format_exc()}")
-                    print("Please ensure Redis is running and Celery worker is started")
-                else:
-                    print("No reminders were created!")
-                
-            return created_reminders
-                    
-        except Exception as e:
-            print(f"Error creating reminders: {e}")
-            raise
+                ActionPlan.objects.filter(pk=action_plan.pk).update(first_occurrence_at=action_plan.first_occurrence_at)
+                created_reminders = cls.extend_schedule(action_plan)
+
+            if created_reminders:
+                # Only once the reminders are committed, the worker has to be able to read them
+                first_reminder = created_reminders[0]
+                transaction.on_commit(lambda: cls.schedule_reminder(first_reminder))
+            else:
+                print("No reminders were created!")
+
+        return created_reminders
+
+    @classmethod
+    def create_schedule_note_reminders(cls, action_plans):
+        """
+        Schedule the plans just created for one note in a constant number of
+        queries, nothing else can see them before the note's transaction commits.
+        """
+        if not action_plans:
+            return []
+
+        with transaction.atomic():
+            note_id = action_plans[0].note_id
+            patient_id = action_plans[0].patient_id
+            Reminder.objects.filter(patient_id=patient_id, completed=False).exclude(
+                action_plan__note_id=note_id
+            ).update(is_active=False)
+            ActionPlan.objects.filter(patient_id=patient_id, is_active=True).exclude(
+                note_id=note_id
+            ).update(is_active=False)
+
+            now = timezone.now()
+            scheduled_plans = []
+            schedules = []
+            for action_plan in action_plans:
+                if action_plan.interval is None:
+                    continue
+                start_date = action_plan.start_date
+                if isinstance(start_date, str):
+                    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+                action_plan.first_occurrence_at = timezone.make_aware(datetime.combine(start_date, now.time()))
+                # Same window as extend_schedule
+                until = now + action_plan.interval * settings.REMINDER_WINDOW_OCCURRENCES
+                action_plan.materialized_count = action_plan.occurrences_before(until)
+                scheduled_plans.append(action_plan)
+                schedules.append(cls.build_schedule(action_plan, 0, action_plan.materialized_count))
+
+            if scheduled_plans:
+                ActionPlan.objects.bulk_update(scheduled_plans, ['first_occurrence_at', 'materialized_count'])
+            created_reminders = Reminder.objects.bulk_create(
+                [reminder for schedule in schedules for reminder in schedule]
+            )
+
+            first_reminders = [schedule[0] for schedule in schedules if schedule]
+            if first_reminders:
+                # Only once the reminders are committed, the worker has to be able to read them
+                transaction.on_commit(lambda: [cls.schedule_reminder(reminder) for reminder in first_reminders])
+            else:
+                print("No reminders were created!")
+
+        return created_reminders
 
     @staticmethod
-    def handle_checkin(reminder):
+    def schedule_reminder(reminder):
+        """Queue the reminder email for its scheduled time"""
+        print(f"Attempting to schedule reminder: {reminder}")
+        try:
+            result = app.send_task(
+                'send_reminder_email',
+                args=[reminder.id],
+                eta=reminder.scheduled_for
+            )
+            print(f"Successfully scheduled reminder: {result}")
+        except (OperationalError, ConnectionRefusedError) as e:
+            print(f"Celery/Redis connection error: {e}")
+            print(f"Detailed error: {traceback.format_exc()}")
+            print("Please ensure Redis is running and Celery worker is started")
+
+    @classmethod
+    def handle_checkin(cls, reminder):
         if reminder.completed and reminder.is_active:
             return False
 
@@ -160,11 +373,19 @@ class ReminderService:
         reminder.completed = True
         reminder.completed_at = current_time
         reminder.save()
+
+        # Plans cancelled by a newer note record the check-in, but their schedule stays as it is
+        if not reminder.is_active or not action_plan.is_active:
+            return True
         
         """if the patient has to take a drug, a day, for 7 days and misses one day only (doesn't check-in once), 
         this means the reminder runs for 8 days."""
         # If checked in after scheduled date, create a new day at the end
-        if current_time.date() > reminder.scheduled_for.date():
+        if current_time.date() > reminder.scheduled_for.date() and action_plan.is_scheduled_lazily:
+            # One more occurrence at the end of the rule, created with the rest of the window
+            ActionPlan.objects.filter(pk=action_plan.pk).update(duration_days=F('duration_days') + 1)
+            action_plan.duration_days += 1
+        elif current_time.date() > reminder.scheduled_for.date():
             # Get the last reminder in sequence
             last_reminder = Reminder.objects.filter(
                 action_plan=action_plan
@@ -182,6 +403,9 @@ class ReminderService:
                 is_active=True
             )
 
+        # The window moves on with every check-in
+        cls.extend_schedule(action_plan, current_time)
+
         # Find the next uncompleted reminder in sequence
         next_reminder = Reminder.objects.filter(
             action_plan=action_plan,
@@ -213,10 +437,12 @@ class ReminderService:
                     is_active=True
                 )
                 
-                # Shift all remaining reminders
-                for subsequent in subsequent_reminders:
-                    subsequent.scheduled_for += time_difference
-                    subsequent.save()
+                # Shift all remaining reminders, and the occurrences not created yet
+                subsequent_reminders.update(scheduled_for=F('scheduled_for') + time_difference)
+                if action_plan.is_scheduled_lazily:
+                    ActionPlan.objects.filter(pk=action_plan.pk).update(
+                        schedule_shift=F('schedule_shift') + time_difference
+                    )
                     
             try:
                 app.send_task(
@@ -228,4 +454,206 @@ class ReminderService:
             except Exception as e:
                 print(f"Error scheduling next reminder: {e}")
 
-        return True 
\ No newline at end of file
+        return True 
+
+
+class NoteService:
+    CHECKLIST_ITEM_FIELDS = ('task',)
+    ACTION_PLAN_FIELDS = ('action', 'frequency', 'start_date', 'end_date', 'duration_days', 'custom_schedule')
+
+    @staticmethod
+    def pick(item, fields):
+        """Keep only model fields, the LLM may add keys of its own"""
+        return {field: item[field] for field in fields if field in item}
+
+    @classmethod
+    @transaction.atomic
+    def create_note(cls, doctor_patient, raw_content, llm_response=None):
+        """Encrypt and save a note, with its extracted items when given, as a single unit"""
+        note = DoctorNote(doctor_patient=doctor_patient)
+        note.encrypt_note(raw_content, save=False)
+        note.save()
+
+        if llm_response is not None:
+            cls.apply_extraction(note, llm_response)
+        return note
+
+    @classmethod
+    @transaction.atomic
+    def apply_extraction(cls, note, llm_response):
+        """Create checklist items, action plans and reminders from an LLM extraction"""
+        doctor_patient = note.doctor_patient
+
+        # Create checklist items
+        checklist_items = ChecklistItem.objects.bulk_create([
+            ChecklistItem(note=note, **cls.pick(item, cls.CHECKLIST_ITEM_FIELDS))
+            for item in llm_response.get('checklist_items', [])
+        ])
+
+        # Create action plans and schedule reminders
+        action_plans = ActionPlan.objects.bulk_create([
+            ActionPlan(
+                note=note,
+                patient=doctor_patient.patient,
+                doctor_patient=doctor_patient,
+                doctor_id=doctor_patient.doctor_id,
+                is_active=True,
+                **cls.pick(plan, cls.ACTION_PLAN_FIELDS)
+            )
+            for plan in llm_response.get('action_plans', [])
+        ])
+
+        # Schedule reminders, in the same number of queries however many plans there are
+        ReminderService.create_schedule_note_reminders(action_plans)
+
+        return checklist_items, action_plans
+
+
+@lru_cache(maxsize=None)
+def get_decryption_executor():
+    """Thread pool shared by every request, sized by NOTE_DECRYPTION_WORKERS"""
+    return ThreadPoolExecutor(
+        max_workers=settings.NOTE_DECRYPTION_WORKERS,
+        thread_name_prefix='note-decryption'
+    )
+
+
+class NoteDecryptionService:
+    """
+    Decrypts lists of notes on a bounded thread pool. The RSA and AES work
+    in `cryptography` releases the GIL, so notes are decrypted in parallel.
+    """
+
+    @staticmethod
+    def decrypt(note, user):
+        try:
+            return note.decrypt_note(user)
+        except Exception as e:
+            print(f"Decryption error for note {note.id}: {str(e)}")
+            return None
+
+    @classmethod
+    def decrypt_notes(cls, notes, user):
+        """Decrypted content of each note in the given order, None for notes that failed"""
+        notes = list(notes)
+        # Load everything decryption may need here, worker threads must not open database connections
+        user.retired_private_keys()
+        for note in notes:
+            doctor_patient = note.doctor_patient
+            doctor_patient.doctor, doctor_patient.patient
+
+        if len(notes) < 2 or settings.NOTE_DECRYPTION_WORKERS < 2:
+            return [cls.decrypt(note, user) for note in notes]
+        return list(get_decryption_executor().map(lambda note: cls.decrypt(note, user), notes))
+
+
+class KeyRotationService:
+    """
+    Replaces a user's key pair and re-wraps the data key of every note they
+    can read. Notes are streamed in primary key order and re-wrapped in
+    batches, each committed together with the checkpoint, so a stopped
+    rotation resumes after the last committed batch.
+    """
+
+    @staticmethod
+    @transaction.atomic
+    def start(user):
+        """Give the user a new key pair, the old one is kept on the rotation until its notes are re-wrapped"""
+        user = type(user).objects.select_for_update().get(pk=user.pk)
+        notes = DoctorNote.objects.filter(Q(doctor_patient__doctor=user) | Q(doctor_patient__patient=user))
+
+        rotation = KeyRotation.objects.create(
+            user=user,
+            old_public_key=user.public_key,
+            old_private_key=user.private_key,
+            until_note_id=notes.aggregate(last=Max('id'))['last'] or 0,
+        )
+
+        user.private_key, user.public_key = EncryptionKeyPair.claim() or NoteEncryption.generate_key_pair()
+        user.save(update_fields=['private_key', 'public_key'])
+        key_cache.invalidate(user.id)
+        return rotation
+
+    @classmethod
+    def run(cls, rotation, batch_size=None, notes_per_second=None, progress=None):
+        """Re-wrap the remaining notes of the rotation, calls `progress(rotation)` after every batch"""
+        batch_size = batch_size or settings.KEY_ROTATION_BATCH_SIZE
+        notes_per_second = notes_per_second or settings.KEY_ROTATION_NOTES_PER_SECOND
+
+        user = rotation.user
+        if rotation.old_private_key is None:
+            # Nothing was encrypted for the old key (the user had none yet)
+            cls.finish(rotation)
+            return rotation
+        old_private_key = bytes(rotation.old_private_key)
+
+        rotation.status = KeyRotation.Status.RUNNING
+        rotation.save(update_fields=['status', 'updated_at'])
+
+        notes = DoctorNote.objects.filter(
+            Q(doctor_patient__doctor=user) | Q(doctor_patient__patient=user),
+            id__gt=rotation.last_note_id,
+            id__lte=rotation.until_note_id
+        ).select_related('doctor_patient__doctor', 'doctor_patient__patient').order_by('id')
+
+        try:
+            batch = []
+            # Stream the notes, a patient may have tens of thousands of them
+            for note in notes.iterator(chunk_size=batch_size):
+                batch.append(note)
+                if len(batch) >= batch_size:
+                    cls.rewrap_batch(rotation, batch, old_private_key, notes_per_second)
+                    batch = []
+                    if progress:
+                        progress(rotation)
+            if batch:
+                cls.rewrap_batch(rotation, batch, old_private_key, notes_per_second)
+                if progress:
+                    progress(rotation)
+        except Exception as e:
+            rotation.status = KeyRotation.Status.FAILED
+            rotation.error = str(e)
+            rotation.save(update_fields=['status', 'error', 'updated_at'])
+            raise
+
+        cls.finish(rotation)
+        return rotation
+
+    @staticmethod
+    def rewrap_batch(rotation, notes, old_private_key, notes_per_second):
+        started = time.monotonic()
+        user = rotation.user
+
+        with transaction.atomic():
+            for note in notes:
+                # Use the rotated user instance so re-encryption picks up the new public key
+                if note.doctor_patient.doctor_id == user.id:
+                    note.doctor_patient.doctor = user
+                else:
+                    note.doctor_patient.patient = user
+                try:
+                    # A failed write would otherwise abort the whole batch transaction
+                    with transaction.atomic():
+                        note.rewrap_key(user, old_private_key)
+                    rotation.rewrapped += 1
+                except Exception as e:
+                    rotation.failed += 1
+                    print(f"Failed to re-wrap note {note.id} for user {user.id}: {e}")
+
+            rotation.last_note_id = notes[-1].id
+            rotation.save(update_fields=['last_note_id', 'rewrapped', 'failed', 'updated_at'])
+
+        # Stay within the database load budget
+        time.sleep(max(0.0, len(notes) / notes_per_second - (time.monotonic() - started)))
+
+    @staticmethod
+    def finish(rotation):
+        rotation.status = KeyRotation.Status.COMPLETED
+        rotation.completed_at = timezone.now()
+        update_fields = ['status', 'completed_at', 'updated_at']
+        if not rotation.failed:
+            # Every note is readable with the new key, the old one can go
+            rotation.old_private_key = None
+            rotation.old_public_key = None
+            update_fields += ['old_private_key', 'old_public_key']
+        rotation.save(update_fields=update_fields)
@@ -0,0 +1,75 @@
+import json
+
+
+class IncrementalExtractionParser:
+    """
+    Incremental parser for a streamed extraction response.
+
+    Text chunks are fed as they arrive and every object inside the
+    top-level arrays ("checklist_items", "action_plans") is emitted as
+    `(section, item)` as soon as its closing brace is seen, without
+    waiting for the rest of the document. Anything before the first `{`
+    (such as a markdown code fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_key = None
+        self.section = None
+        self.item_start = None
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk):
+        """Consume a chunk of text, returns the items completed by it"""
+        items = []
+        self.buffer += chunk
+
+        while self.position < len(self.buffer) and not self.complete:
+            char = self.buffer[self.position]
+
+            if not self.started:
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        # Strings directly in the root object are keys (or scalar values)
+                        self.last_key = json.loads(self.buffer[self.string_start:self.position + 1])
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.position
+            elif char in '{[':
+                if self.depth == 1 and char == '[':
+                    self.section = self.last_key
+                elif self.depth == 2 and char == '{':
+                    self.item_start = self.position
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 2 and char == '}' and self.item_start is not None:
+                    raw_item = self.buffer[self.item_start:self.position + 1]
+                    self.item_start = None
+                    try:
+                        items.append((self.section, json.loads(raw_item)))
+                    except ValueError as e:
+                        print(f"Skipping malformed streamed item: {e}")
+                elif self.depth == 1:
+                    self.section = None
+                elif self.depth == 0:
+                    self.complete = True
+
+            self.position += 1
+
+        return items
@@ -1,5 +1,20 @@
+import base64
+import hashlib
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from redis.exceptions import RedisError
+from api.utils.redis_client import get_redis_client
+from api.utils.metrics import PAGINATION_COUNTS
+from drf_spectacular.utils import OpenApiParameter
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(pagination.PageNumberPagination):
@@ -9,7 +24,104 @@ class CustomPagination(pagination.PageNumberPagination):
     max_page_size = 50
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids full COUNT(*) queries on large tables.
+
+    Up to PAGINATION_EXACT_COUNT_THRESHOLD rows the count is exact (a
+    COUNT over a LIMIT, so it stops at the threshold). Past it the count
+    comes from Redis, cached for PAGINATION_COUNT_CACHE_SECONDS, and on a
+    miss from the PostgreSQL planner estimate, or an exact count on other
+    databases. Such counts are flagged approximate, and pages past the
+    estimated last one can still be requested.
+    """
+    count_cache_prefix = 'pagination_count'
+    count_is_approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            # Plain lists are counted as usual
+            return len(queryset)
+
+        threshold = settings.PAGINATION_EXACT_COUNT_THRESHOLD
+        queryset = queryset.order_by()
+        bounded = queryset[:threshold + 1].count()
+        if bounded <= threshold:
+            PAGINATION_COUNTS.labels(strategy='exact').inc()
+            return bounded
+
+        self.count_is_approximate = True
+        cache_key = self.cache_key(queryset)
+        try:
+            cached = get_redis_client().get(cache_key)
+            if cached is not None:
+                PAGINATION_COUNTS.labels(strategy='cached').inc()
+                return int(cached)
+        except RedisError as e:
+            print(f"Pagination count cache unavailable: {e}")
+
+        estimate = self.planner_estimate(queryset)
+        if estimate is None:
+            PAGINATION_COUNTS.labels(strategy='full').inc()
+            count = queryset.count()
+        else:
+            PAGINATION_COUNTS.labels(strategy='estimate').inc()
+            # The planner can guess low, there are more rows than the threshold
+            count = max(estimate, threshold + 1)
+
+        try:
+            get_redis_client().set(cache_key, count, ex=settings.PAGINATION_COUNT_CACHE_SECONDS)
+        except RedisError as e:
+            print(f"Pagination count cache unavailable: {e}")
+        return count
+
+    def cache_key(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.sha256(f"{sql}:{params}".encode()).hexdigest()
+        return f"{self.count_cache_prefix}:{digest}"
+
+    @staticmethod
+    def planner_estimate(queryset):
+        """Row estimate from EXPLAIN on PostgreSQL, None elsewhere"""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def validate_number(self, number):
+        # Counting decides whether the count is approximate
+        if not self.count or not self.count_is_approximate:
+            return super().validate_number(number)
+
+        # The estimate may be low, so pages past the estimated last one are allowed
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if not self.count_is_approximate and top + self.orphans >= self.count:
+            top = self.count
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+
 class BasicPagination(CustomPagination):
+    django_paginator_class = EstimatedCountPaginator
+
     def get_paginated_response(self, data):
         current_page = self.page.number
         total_pages = self.page.paginator.num_pages
@@ -19,8 +131,151 @@ class BasicPagination(CustomPagination):
                 'current_page': current_page,
                 'total_pages': total_pages,
                 'total_records': self.page.paginator.count,
+                'count_is_approximate': self.page.paginator.count_is_approximate,
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+        )
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination over an indexed ordering such as (created_at, id).
+
+    Pages are fetched with a WHERE on the last row seen instead of OFFSET,
+    and no COUNT is run, so every page costs the same however deep it is.
+    Cursors are opaque base64 strings. Clients opt in with
+    `?pagination=cursor` and then follow the `next`/`previous` links.
+    """
+    page_size = CustomPagination.page_size
+    page_size_query_param = CustomPagination.page_size_query_param
+    max_page_size = CustomPagination.max_page_size
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering):
+        # Must end with a unique field so the position of every row is distinct
+        self.ordering = ordering
+
+    @classmethod
+    def requested(cls, request):
+        return (
+            request.query_params.get(cls.mode_query_param) == 'cursor'
+            or cls.cursor_query_param in request.query_params
+        )
+
+    @classmethod
+    def for_request(cls, request, default_class, ordering):
+        """Keyset pagination when the client asked for it, otherwise the view's usual paginator"""
+        if cls.requested(request):
+            return cls(ordering)
+        return default_class()
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, row, reverse):
+        position = [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in (self.row_value(row, field.lstrip('-')) for field in self.ordering)
+        ]
+        payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def row_value(row, name):
+        # Rows are model instances, or dicts for values() querysets
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError("cursor does not match the ordering")
+            # Convert back to field types, e.g. ISO strings to datetimes
+            position = [
+                queryset.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound("Invalid cursor")
+
+    def rows_after(self, position, reverse):
+        """Q matching rows that come after the position in the ordering (before it when reversed)"""
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            earlier_equal = {
+                other.lstrip('-'): value
+                for other, value in zip(self.ordering[:index], position[:index])
+            }
+            condition |= Q(**earlier_equal, **{f"{name}__{'lt' if descending else 'gt'}": position[index]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        position, reverse = self.decode_cursor(queryset, cursor) if cursor else (None, False)
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f"-{field}" for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.rows_after(position, reverse))
+
+        # One extra row tells whether there is another page
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.rows = rows
+        return rows
+
+    def get_link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.mode_query_param, 'cursor')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.get_link(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        return self.get_link(self.rows[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
                 'next': self.get_next_link(),
                 'previous': self.get_previous_link(),
                 'results': data,
             }
-        )
\ No newline at end of file
+        )
+
+
+# Query parameters documented on views that support KeysetPagination
+CURSOR_PAGINATION_PARAMETERS = [
+    OpenApiParameter(
+        'pagination', str, enum=['cursor'],
+        description='Set to `cursor` for cursor pagination: no counts, constant cost per page'
+    ),
+    OpenApiParameter('cursor', str, description='Opaque cursor from the `next` or `previous` link'),
+]
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from apps.user.models import User
-from apps.doctor.models import DoctorPatient, DoctorNote, ChecklistItem
+from apps.doctor.models import DoctorPatient, DoctorNote, ChecklistItem, NoteJob
 from api.serilizers.patient import PatientSerializer, ActionPlanSerializer
 
 
@@ -57,4 +57,25 @@ class DoctorNoteSerializer(serializers.ModelSerializer):
 class NoteResponseSerializer(serializers.Serializer):
     note = DoctorNoteSerializer()
     checklist_items = ChecklistItemSerializer(many=True)
-    action_plans = ActionPlanSerializer(many=True) 
\ No newline at end of file
+    action_plans = ActionPlanSerializer(many=True)
+
+
+class NoteJobSerializer(serializers.ModelSerializer):
+    checklist_items = serializers.SerializerMethodField()
+    action_plans = serializers.SerializerMethodField()
+
+    class Meta:
+        model = NoteJob
+        fields = ['id', 'note', 'status', 'progress', 'error', 'created_at', 'updated_at',
+                  'completed_at', 'checklist_items', 'action_plans']
+        read_only_fields = fields
+
+    def get_checklist_items(self, obj):
+        if obj.status != NoteJob.Status.COMPLETED:
+            return []
+        return ChecklistItemSerializer(obj.note.checklist_items.all(), many=True).data
+
+    def get_action_plans(self, obj):
+        if obj.status != NoteJob.Status.COMPLETED:
+            return []
+        return ActionPlanSerializer(obj.note.action_plans.all(), many=True).data
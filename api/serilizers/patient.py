@@ -1,4 +1,5 @@
 from apps.patient.models import ActionPlan, Reminder
+from django.conf import settings
 from rest_framework import serializers
 from apps.user.models import User
 
@@ -15,10 +16,65 @@ class ActionPlanSerializer(serializers.ModelSerializer):
                  'custom_schedule', 'is_active', 'created_at']
         read_only_fields = ['created_at']   
 
+class ActionPlanScheduleSerializer(ActionPlanSerializer):
+    """Action plan with its next occurrences that aren't stored as reminders yet"""
+    upcoming_reminders = serializers.SerializerMethodField()
+
+    class Meta(ActionPlanSerializer.Meta):
+        fields = ActionPlanSerializer.Meta.fields + ['duration_days', 'upcoming_reminders']
+
+    def get_upcoming_reminders(self, action_plan):
+        # Cancelled plans have nothing coming up
+        if not action_plan.is_active:
+            return []
+        return [
+            {'sequence_number': sequence_number, 'scheduled_for': scheduled_for}
+            for sequence_number, scheduled_for in action_plan.upcoming_occurrences(settings.REMINDER_WINDOW_OCCURRENCES)
+        ]
+
 class ReminderSerializer(serializers.ModelSerializer):
     patient = PatientSerializer(read_only=True)
     action_plan = ActionPlanSerializer(read_only=True)
     class Meta:
         model = Reminder
-        fields = "__all__"
-        depth = 1
\ No newline at end of file
+        # The denormalized doctor columns would nest whole users at depth 1
+        exclude = ['doctor_patient', 'doctor']
+        depth = 1
+
+class FlatReminderSerializer(serializers.Serializer):
+    """
+    Read-only reminder listing over plain rows, see `select`. The action
+    plan and patient come from the same query as the reminder, so a page
+    costs one query whatever its size.
+    """
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    description = serializers.CharField()
+    scheduled_for = serializers.DateTimeField()
+    completed = serializers.BooleanField()
+    completed_at = serializers.DateTimeField(allow_null=True)
+    is_active = serializers.BooleanField()
+    sequence_number = serializers.IntegerField()
+    action_plan_id = serializers.IntegerField()
+    action = serializers.CharField(source='action_plan__action')
+    frequency = serializers.CharField(source='action_plan__frequency')
+    patient_id = serializers.IntegerField()
+    patient_name = serializers.SerializerMethodField()
+
+    values_fields = (
+        'id', 'title', 'description', 'scheduled_for', 'completed', 'completed_at',
+        'is_active', 'sequence_number', 'action_plan_id', 'action_plan__action',
+        'action_plan__frequency', 'patient_id', 'patient__first_name',
+        'patient__last_name', 'patient__email', 'patient__username',
+    )
+
+    @classmethod
+    def select(cls, queryset):
+        """Rows with exactly the columns the serializer reads"""
+        return queryset.values(*cls.values_fields)
+
+    def get_patient_name(self, row):
+        return User.format_full_name(
+            row['patient__first_name'], row['patient__last_name'],
+            row['patient__email'], row['patient__username']
+        )
@@ -1,7 +1,7 @@
 from django.urls import path
 from api.views.doctor import (
     DoctorListView, MyPatientsView,
-    CreateNoteView, PatientNotesView, ListPatientNotesView,
+    CreateNoteView, CreateNoteStreamView, NoteJobStatusView, PatientNotesView, ListPatientNotesView,
     ActionPlanView, ActionPlanDetailView, ReminderView,
 )
 from api.views.patient import (
@@ -41,6 +41,8 @@ urlpatterns = [
 
     # Doctor Notes endpoints
     path('notes/create/', CreateNoteView.as_view(), name='create-note'),
+    path('notes/create/stream/', CreateNoteStreamView.as_view(), name='create-note-stream'),
+    path('notes/jobs/<int:job_id>/', NoteJobStatusView.as_view(), name='note-job-status'),
     path('notes/patient/<int:patient_id>/', PatientNotesView.as_view(), name='patient-note'),
     path('patient-notes/', ListPatientNotesView.as_view(), name='patient-notes'),
 
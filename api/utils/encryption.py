@@ -1,18 +1,113 @@
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, x25519
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from collections import OrderedDict
+from django.conf import settings
+from api.utils.metrics import NOTE_KEY_CACHE_REQUESTS
 import base64
+import hashlib
 import os
+import struct
+import threading
+import zlib
+
+
+class KeyCache:
+    """
+    Bounded LRU of loaded key objects, so PEM parsing happens once per key
+    instead of once per note.
+
+    Entries are keyed by user id, key kind and a fingerprint of the PEM,
+    so a rotated key is never served from a stale entry even in processes
+    that missed the invalidation.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or settings.NOTE_KEY_CACHE_SIZE
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(key_pem):
+        return hashlib.sha256(bytes(key_pem)).hexdigest()
+
+    def get_or_load(self, user_id, kind, key_pem, loader):
+        cache_key = (user_id, kind, self.fingerprint(key_pem))
+        with self.lock:
+            key = self.entries.get(cache_key)
+            if key is not None:
+                self.entries.move_to_end(cache_key)
+                NOTE_KEY_CACHE_REQUESTS.labels(kind=kind, result='hit').inc()
+                return key
+
+        NOTE_KEY_CACHE_REQUESTS.labels(kind=kind, result='miss').inc()
+        key = loader(bytes(key_pem))
+        with self.lock:
+            self.entries[cache_key] = key
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return key
+
+    def invalidate(self, user_id):
+        """Drop every cached key of the user"""
+        with self.lock:
+            for cache_key in [cache_key for cache_key in self.entries if cache_key[0] == user_id]:
+                del self.entries[cache_key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+key_cache = KeyCache()
+
+# Notes without a version are the legacy format, encrypted separately for doctor and patient
+ENVELOPE_VERSION = 2
+
+# Binary note format:
+#   version (1 byte) | flags (1 byte) | reader count (2 bytes)
+#   per reader: user id (8 bytes) | suite (1 byte) | wrapped key length (2 bytes) | wrapped key
+#   nonce (12 bytes) | AES-256-GCM ciphertext and tag
+# The version and flags bytes are authenticated along with the content.
+# Version 3 has no suite byte, its keys are all RSA wrapped.
+BINARY_VERSION = 4
+BINARY_HEADER = struct.Struct('>BBH')
+BINARY_READERS = {
+    3: struct.Struct('>QH'),
+    4: struct.Struct('>QBH'),
+}
+NONCE_SIZE = 12
+# Flag bits
+FLAG_COMPRESSED = 0x01
+
+# Key wrapping suites
+SUITE_RSA_OAEP = 1
+# Ephemeral X25519 agreement, HKDF-SHA256 and ChaCha20-Poly1305. The wrapped
+# key is the ephemeral public key followed by the sealed data key.
+SUITE_X25519_CHACHA20 = 2
+KEY_SUITES = {
+    'rsa': SUITE_RSA_OAEP,
+    'x25519': SUITE_X25519_CHACHA20,
+}
+X25519_KEY_SIZE = 32
+
 
 class NoteEncryption:
     @staticmethod
-    def generate_key_pair():
-        """Generate a new RSA key pair"""
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048
-        )
+    def generate_key_pair(suite=None):
+        """Generate a new key pair for the NOTE_KEY_SUITE suite (RSA or X25519)"""
+        suite = KEY_SUITES[suite or settings.NOTE_KEY_SUITE]
+        if suite == SUITE_X25519_CHACHA20:
+            private_key = x25519.X25519PrivateKey.generate()
+        else:
+            private_key = rsa.generate_private_key(
+                public_exponent=65537,
+                key_size=2048
+            )
         public_key = private_key.public_key()
         
         # Serialize keys for storage
@@ -30,20 +125,50 @@ class NoteEncryption:
         return private_pem, public_pem
 
     @staticmethod
-    def encrypt_note(content: str, public_key_pem: bytes) -> dict:
-        """Encrypt note content using hybrid encryption"""
-        # Generate a random symmetric key
-        symmetric_key = Fernet.generate_key()
-        fernet = Fernet(symmetric_key)
-        
-        # Encrypt the content with symmetric key
-        encrypted_content = fernet.encrypt(content.encode())
-        
-        # Load the public key
-        public_key = serialization.load_pem_public_key(public_key_pem)
-        
-        # Encrypt the symmetric key with the public key
-        encrypted_key = public_key.encrypt(
+    def key_suite(key):
+        """Suite id of a loaded public or private key"""
+        if isinstance(key, (x25519.X25519PublicKey, x25519.X25519PrivateKey)):
+            return SUITE_X25519_CHACHA20
+        return SUITE_RSA_OAEP
+
+    @staticmethod
+    def load_public_key(public_key_pem: bytes, user_id=None):
+        """Loaded public key, cached when the owner is known"""
+        if user_id is None:
+            return serialization.load_pem_public_key(bytes(public_key_pem))
+        return key_cache.get_or_load(user_id, 'public', public_key_pem, serialization.load_pem_public_key)
+
+    @staticmethod
+    def load_private_key(private_key_pem: bytes, user_id=None):
+        """Loaded private key, cached when the owner is known"""
+        loader = lambda pem: serialization.load_pem_private_key(pem, password=None)
+        if user_id is None:
+            return loader(bytes(private_key_pem))
+        return key_cache.get_or_load(user_id, 'private', private_key_pem, loader)
+
+    @staticmethod
+    def wrap_key(symmetric_key: bytes, public_key_pem: bytes, user_id=None) -> bytes:
+        """Encrypt a symmetric key with the reader's public key"""
+        return NoteEncryption.wrap_key_with_suite(symmetric_key, public_key_pem, user_id)[1]
+
+    @staticmethod
+    def wrap_key_with_suite(symmetric_key: bytes, public_key_pem: bytes, user_id=None):
+        """Like wrap_key, returns (suite, wrapped_key)"""
+        public_key = NoteEncryption.load_public_key(public_key_pem, user_id)
+        if NoteEncryption.key_suite(public_key) == SUITE_X25519_CHACHA20:
+            ephemeral_key = x25519.X25519PrivateKey.generate()
+            ephemeral_public = ephemeral_key.public_key().public_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PublicFormat.Raw
+            )
+            wrapping_key = NoteEncryption.derive_wrapping_key(
+                ephemeral_key.exchange(public_key), ephemeral_public, public_key
+            )
+            # The wrapping key is new for every wrap, so a fixed nonce is safe
+            sealed_key = ChaCha20Poly1305(wrapping_key).encrypt(bytes(NONCE_SIZE), symmetric_key, None)
+            return SUITE_X25519_CHACHA20, ephemeral_public + sealed_key
+
+        return SUITE_RSA_OAEP, public_key.encrypt(
             symmetric_key,
             padding.OAEP(
                 mgf=padding.MGF1(algorithm=hashes.SHA256()),
@@ -51,40 +176,213 @@ class NoteEncryption:
                 label=None
             )
         )
+
+    @staticmethod
+    def unwrap_key(wrapped_key: bytes, private_key_pem: bytes, user_id=None, suite=None) -> bytes:
+        """Decrypt a wrapped symmetric key with the reader's private key"""
+        private_key = NoteEncryption.load_private_key(private_key_pem, user_id)
+        key_suite = NoteEncryption.key_suite(private_key)
+        if suite is not None and suite != key_suite:
+            raise ValueError(f"Key was wrapped with suite {suite} but the reader holds a suite {key_suite} key")
+
+        if key_suite == SUITE_X25519_CHACHA20:
+            ephemeral_public = wrapped_key[:X25519_KEY_SIZE]
+            wrapping_key = NoteEncryption.derive_wrapping_key(
+                private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public)),
+                ephemeral_public,
+                private_key.public_key()
+            )
+            return ChaCha20Poly1305(wrapping_key).decrypt(bytes(NONCE_SIZE), wrapped_key[X25519_KEY_SIZE:], None)
+
+        return private_key.decrypt(
+            wrapped_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+
+    @staticmethod
+    def derive_wrapping_key(shared_secret: bytes, ephemeral_public: bytes, public_key) -> bytes:
+        # Bind the key to both public keys of the exchange
+        recipient_public = public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'caresync note key wrap' + ephemeral_public + recipient_public
+        ).derive(shared_secret)
+
+    @staticmethod
+    def encrypt_note(content: str, public_key_pem: bytes, user_id=None) -> dict:
+        """Encrypt note content using hybrid encryption"""
+        # Generate a random symmetric key
+        symmetric_key = Fernet.generate_key()
+        fernet = Fernet(symmetric_key)
+        
+        # Encrypt the content with symmetric key
+        encrypted_content = fernet.encrypt(content.encode())
         
         return {
             'encrypted_content': base64.b64encode(encrypted_content).decode('utf-8'),
-            'encrypted_key': base64.b64encode(encrypted_key).decode('utf-8')
+            'encrypted_key': base64.b64encode(
+                NoteEncryption.wrap_key(symmetric_key, public_key_pem, user_id)
+            ).decode('utf-8')
         }
 
     @staticmethod
-    def decrypt_note(encrypted_data: dict, private_key_pem: bytes) -> str:
+    def decrypt_note(encrypted_data: dict, private_key_pem: bytes, user_id=None) -> str:
         """Decrypt note content using private key"""
         try:
-            # Load the private key
-            private_key = serialization.load_pem_private_key(
-                private_key_pem,
-                password=None
-            )
-            
-            # Decode the encrypted data
-            encrypted_content = base64.b64decode(encrypted_data['encrypted_content'])
-            encrypted_key = base64.b64decode(encrypted_data['encrypted_key'])
-            
             # Decrypt the symmetric key
-            symmetric_key = private_key.decrypt(
-                encrypted_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
+            symmetric_key = NoteEncryption.unwrap_key(
+                base64.b64decode(encrypted_data['encrypted_key']), private_key_pem, user_id
             )
             
             # Decrypt the content
             fernet = Fernet(symmetric_key)
-            decrypted_content = fernet.decrypt(encrypted_content)
+            decrypted_content = fernet.decrypt(base64.b64decode(encrypted_data['encrypted_content']))
             
             return decrypted_content.decode()
         except Exception as e:
-            raise ValueError(f"Decryption failed: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Decryption failed: {str(e)}")
+
+    @staticmethod
+    def encrypt_envelope(content: str, readers: dict) -> dict:
+        """
+        Encrypt the content once with a fresh data key and wrap that key for
+        every reader. `readers` maps user id to public key PEM.
+        """
+        data_key = Fernet.generate_key()
+        encrypted_content = Fernet(data_key).encrypt(content.encode())
+
+        return {
+            'version': ENVELOPE_VERSION,
+            'encrypted_content': base64.b64encode(encrypted_content).decode('utf-8'),
+            'keys': {
+                str(user_id): base64.b64encode(
+                    NoteEncryption.wrap_key(data_key, public_key_pem, user_id)
+                ).decode('utf-8')
+                for user_id, public_key_pem in readers.items()
+            }
+        }
+
+    @staticmethod
+    def decrypt_envelope(envelope: dict, user_id, private_key_pem: bytes) -> str:
+        """Decrypt a versioned envelope with the reader's wrapped data key"""
+        wrapped_key = envelope['keys'].get(str(user_id))
+        if not wrapped_key:
+            raise ValueError(f"No wrapped key found for user {user_id}")
+
+        try:
+            data_key = NoteEncryption.unwrap_key(base64.b64decode(wrapped_key), private_key_pem, user_id)
+            return Fernet(data_key).decrypt(base64.b64decode(envelope['encrypted_content'])).decode()
+        except Exception as e:
+            raise ValueError(f"Decryption failed: {str(e)}")
+
+    @staticmethod
+    def encrypt_binary(content: str, readers: dict) -> bytes:
+        """
+        Encrypt the content once with a fresh AES-GCM data key into the
+        binary format, wrapping the key for every reader. `readers` maps
+        user id to public key PEM.
+        """
+        data_key = AESGCM.generate_key(bit_length=256)
+        plaintext, flags = NoteEncryption.compress(content.encode())
+        wrapped_keys = {
+            int(user_id): NoteEncryption.wrap_key_with_suite(data_key, public_key_pem, user_id)
+            for user_id, public_key_pem in readers.items()
+        }
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = AESGCM(data_key).encrypt(nonce, plaintext, bytes([BINARY_VERSION, flags]))
+        return NoteEncryption.pack_binary(BINARY_VERSION, flags, wrapped_keys, nonce, ciphertext)
+
+    @staticmethod
+    def compress(plaintext: bytes):
+        """Compress plaintext past the size threshold, returns (plaintext, flags)"""
+        if not settings.NOTE_COMPRESSION_ENABLED or len(plaintext) < settings.NOTE_COMPRESSION_MIN_BYTES:
+            return plaintext, 0
+        compressed = zlib.compress(plaintext, settings.NOTE_COMPRESSION_LEVEL)
+        if len(compressed) >= len(plaintext):
+            return plaintext, 0
+        return compressed, FLAG_COMPRESSED
+
+    @staticmethod
+    def pack_binary(version, flags, wrapped_keys: dict, nonce: bytes, ciphertext: bytes) -> bytes:
+        """Inverse of parse_binary, `wrapped_keys` maps user id to (suite, wrapped_key)"""
+        reader = BINARY_READERS[version]
+        parts = [BINARY_HEADER.pack(version, flags, len(wrapped_keys))]
+        for user_id, (suite, wrapped_key) in wrapped_keys.items():
+            if version == 3:
+                if suite != SUITE_RSA_OAEP:
+                    raise ValueError("Version 3 notes can only hold RSA wrapped keys")
+                parts.append(reader.pack(user_id, len(wrapped_key)))
+            else:
+                parts.append(reader.pack(user_id, suite, len(wrapped_key)))
+            parts.append(wrapped_key)
+        parts.append(nonce)
+        parts.append(ciphertext)
+        return b''.join(parts)
+
+    @staticmethod
+    def parse_binary(blob: bytes):
+        """Split a binary note into (version, flags, {user_id: (suite, wrapped_key)}, nonce, ciphertext)"""
+        blob = bytes(blob)
+        version, flags, reader_count = BINARY_HEADER.unpack_from(blob)
+        reader = BINARY_READERS.get(version)
+        if reader is None:
+            raise ValueError(f"Unsupported note format version {version}")
+
+        offset = BINARY_HEADER.size
+        wrapped_keys = {}
+        for _ in range(reader_count):
+            if version == 3:
+                user_id, key_length = reader.unpack_from(blob, offset)
+                suite = SUITE_RSA_OAEP
+            else:
+                user_id, suite, key_length = reader.unpack_from(blob, offset)
+            offset += reader.size
+            wrapped_keys[user_id] = (suite, blob[offset:offset + key_length])
+            offset += key_length
+
+        nonce = blob[offset:offset + NONCE_SIZE]
+        return version, flags, wrapped_keys, nonce, blob[offset + NONCE_SIZE:]
+
+    @staticmethod
+    def decrypt_binary(blob: bytes, user_id, private_key_pem: bytes) -> str:
+        """Decrypt a binary note with the reader's wrapped data key"""
+        try:
+            version, flags, wrapped_keys, nonce, ciphertext = NoteEncryption.parse_binary(blob)
+            if int(user_id) not in wrapped_keys:
+                raise ValueError(f"No wrapped key found for user {user_id}")
+
+            suite, wrapped_key = wrapped_keys[int(user_id)]
+            data_key = NoteEncryption.unwrap_key(wrapped_key, private_key_pem, user_id, suite)
+            plaintext = AESGCM(data_key).decrypt(nonce, ciphertext, bytes([version, flags]))
+            if flags & FLAG_COMPRESSED:
+                plaintext = zlib.decompress(plaintext)
+            return plaintext.decode()
+        except Exception as e:
+            raise ValueError(f"Decryption failed: {str(e)}")
+
+    @staticmethod
+    def add_reader(blob: bytes, user_id, private_key_pem: bytes, reader_id, reader_public_key_pem: bytes) -> bytes:
+        """Give another user access by wrapping the data key for them, the content is left as is"""
+        version, flags, wrapped_keys, nonce, ciphertext = NoteEncryption.parse_binary(blob)
+        suite, wrapped_key = wrapped_keys[int(user_id)]
+        data_key = NoteEncryption.unwrap_key(wrapped_key, private_key_pem, user_id, suite)
+        wrapped_keys[int(reader_id)] = NoteEncryption.wrap_key_with_suite(data_key, reader_public_key_pem, reader_id)
+        return NoteEncryption.pack_binary(version, flags, wrapped_keys, nonce, ciphertext)
+
+    @staticmethod
+    def rewrap_binary(blob: bytes, user_id, old_private_key_pem: bytes, new_public_key_pem: bytes) -> bytes:
+        """Re-wrap the user's data key for their new key pair, the content is left as is"""
+        version, flags, wrapped_keys, nonce, ciphertext = NoteEncryption.parse_binary(blob)
+        suite, wrapped_key = wrapped_keys[int(user_id)]
+        data_key = NoteEncryption.unwrap_key(wrapped_key, old_private_key_pem, user_id, suite)
+        wrapped_keys[int(user_id)] = NoteEncryption.wrap_key_with_suite(data_key, new_public_key_pem, user_id)
+        return NoteEncryption.pack_binary(version, flags, wrapped_keys, nonce, ciphertext)
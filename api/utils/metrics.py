@@ -0,0 +1,177 @@
+import base64
+import binascii
+import hmac
+import ipaddress
+import os
+from django.conf import settings
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# LLM extraction cache
+LLM_CACHE_REQUESTS = Counter(
+    'caresync_llm_cache_requests',
+    'LLM extraction cache lookups by result',
+    ['result']
+)
+LLM_CACHE_EVICTIONS = Counter(
+    'caresync_llm_cache_evictions',
+    'LLM extraction cache entries evicted to stay under the size bound'
+)
+
+# Tiered note extraction, share of notes answered without the LLM is rules / total
+NOTE_EXTRACTIONS = Counter(
+    'caresync_note_extractions',
+    'Notes extracted by tier',
+    ['tier']
+)
+
+# LLM micro-batching
+LLM_BATCH_SIZE = Histogram(
+    'caresync_llm_batch_size',
+    'Notes sent to the LLM per batched extraction',
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+LLM_BATCH_FILL_RATIO = Histogram(
+    'caresync_llm_batch_fill_ratio',
+    'Batch size as a fraction of the configured maximum batch size',
+    buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+)
+
+# LLM calls
+LLM_REQUESTS = Counter(
+    'caresync_llm_requests',
+    'LLM backend calls by outcome',
+    ['model', 'operation', 'outcome']
+)
+LLM_REQUEST_LATENCY = Histogram(
+    'caresync_llm_request_latency_seconds',
+    'Duration of LLM backend calls, streams are timed until the last chunk',
+    ['model', 'operation'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+)
+LLM_TIME_TO_FIRST_CHUNK = Histogram(
+    'caresync_llm_time_to_first_chunk_seconds',
+    'Time until the first chunk of a streamed LLM response',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+)
+LLM_TOKENS = Histogram(
+    'caresync_llm_tokens',
+    'Tokens per LLM call',
+    ['model', 'kind'],
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+LLM_REQUEST_COST = Histogram(
+    'caresync_llm_request_cost_usd',
+    'Estimated cost of each LLM call from token usage',
+    ['model'],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+)
+LLM_PARSE_FAILURES = Counter(
+    'caresync_llm_parse_failures',
+    'LLM responses that could not be parsed into an extraction',
+    ['model', 'operation']
+)
+NOTE_CREATION_LATENCY = Histogram(
+    'caresync_note_creation_latency_seconds',
+    'End to end duration of note creation requests',
+    ['mode'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+)
+
+# LLM admission control and circuit breaker
+LLM_ADMISSION_IN_FLIGHT = Gauge(
+    'caresync_llm_admission_in_flight',
+    'LLM calls currently holding a concurrency slot across all processes',
+    multiprocess_mode='livemostrecent'
+)
+LLM_ADMISSION_WAIT = Histogram(
+    'caresync_llm_admission_wait_seconds',
+    'Time spent waiting for an LLM concurrency slot',
+    buckets=(0.005, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+LLM_ADMISSION_REJECTIONS = Counter(
+    'caresync_llm_admission_rejections',
+    'LLM calls rejected before reaching the backend',
+    ['reason']
+)
+LLM_CIRCUIT_STATE = Gauge(
+    'caresync_llm_circuit_state',
+    'LLM circuit breaker state (0 closed, 1 open, 2 half-open)',
+    multiprocess_mode='livemostrecent'
+)
+LLM_CIRCUIT_TRANSITIONS = Counter(
+    'caresync_llm_circuit_transitions',
+    'LLM circuit breaker state changes',
+    ['state']
+)
+
+# Note encryption
+NOTE_KEY_CACHE_REQUESTS = Counter(
+    'caresync_note_key_cache_requests',
+    'Loaded encryption key cache lookups, hit rate is hit / total',
+    ['kind', 'result']
+)
+
+KEY_POOL_DEPTH = Gauge(
+    'caresync_key_pool_depth',
+    'Pre-generated key pairs waiting in the pool',
+    multiprocess_mode='livemostrecent'
+)
+KEY_POOL_CLAIMS = Counter(
+    'caresync_key_pool_claims',
+    'Key pair claims, empty means the keys were generated inline',
+    ['result']
+)
+
+# Pagination
+PAGINATION_COUNTS = Counter(
+    'caresync_pagination_counts',
+    'How paginated list totals were counted',
+    ['strategy']
+)
+
+
+def metrics_allowed(request):
+    """Scrapes come from METRICS_ALLOWED_IPS or carry the metrics basic auth credentials"""
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        address = None
+    if address is not None and any(
+        address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS
+    ):
+        return True
+
+    if not settings.METRICS_BASIC_AUTH_USER or not settings.METRICS_BASIC_AUTH_PASSWORD:
+        return False
+    scheme, _, encoded = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return False
+    try:
+        username, _, password = base64.b64decode(encoded).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return False
+    return (
+        hmac.compare_digest(username, settings.METRICS_BASIC_AUTH_USER)
+        & hmac.compare_digest(password, settings.METRICS_BASIC_AUTH_PASSWORD)
+    )
+
+
+def metrics_view(request):
+    """Expose metrics in the Prometheus text format"""
+    if not metrics_allowed(request):
+        response = HttpResponse('Forbidden', status=401 if settings.METRICS_BASIC_AUTH_USER else 403)
+        if settings.METRICS_BASIC_AUTH_USER:
+            response['WWW-Authenticate'] = 'Basic realm="metrics"'
+        return response
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Web and worker processes each write their own files, aggregate them here
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
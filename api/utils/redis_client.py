@@ -0,0 +1,9 @@
+import redis
+from functools import lru_cache
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_redis_client():
+    """Shared Redis connection for data structures the Django cache API doesn't expose"""
+    return redis.Redis.from_url(settings.CACHES['default']['LOCATION'])
@@ -1,4 +1,6 @@
-from rest_framework.renderers import JSONRenderer
+import json
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 
 
 class CustomResponseRenderer(JSONRenderer):
@@ -55,3 +57,23 @@ class LoginRenderer(JSONRenderer):
 
 class UserResponseRenderer(CustomResponseRenderer):
     res = 'user'
+
+
+def format_event(event, data):
+    """Encode a single server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    '''
+    Lets streaming views accept `text/event-stream`. Regular responses
+    (such as permission errors) are sent as a single `error` event.
+    '''
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return format_event('error', data).encode(self.charset)
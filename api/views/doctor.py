@@ -1,23 +1,31 @@
+import time
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from apps.user.models import User
 from api.serilizers.doctor import DoctorListSerializer
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import status
+from rest_framework.exceptions import NotFound
 from apps.doctor.models import DoctorPatient
 from api.serilizers.doctor import DoctorPatientSerializer
 from drf_spectacular.utils import OpenApiResponse
 from django.shortcuts import get_object_or_404
-from apps.doctor.models import DoctorNote, ChecklistItem
-from api.serilizers.doctor import DoctorNoteSerializer, NoteResponseSerializer, ChecklistItemSerializer
-from api.external.services import LLMService
-from api.serilizers.patient import ActionPlanSerializer, ReminderSerializer
+from apps.doctor.models import DoctorNote, NoteJob
+from api.serilizers.doctor import DoctorNoteSerializer, NoteResponseSerializer, ChecklistItemSerializer, NoteJobSerializer
+from api.external.extractors import get_note_extractor
+from api.external.admission import LLMUnavailable
+from api.serilizers.patient import ActionPlanSerializer, ActionPlanScheduleSerializer, ReminderSerializer, FlatReminderSerializer
 from apps.patient.models import Reminder, ActionPlan
-from api.external.services import ReminderService
+from api.external.services import ReminderService, NoteService, NoteDecryptionService
 from api.utils.permissions import IsDoctor, DoctorPatientPermission, IsEmailVerified
-from api.pagination import BasicPagination
+from api.pagination import BasicPagination, KeysetPagination, CURSOR_PAGINATION_PARAMETERS
 from rest_framework import generics
 from api.utils.permissions import IsAuthenticated
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from api.external.batching import NoteBatcher
+from api.utils.renderers import CustomResponseRenderer, EventStreamRenderer, format_event
+from api.utils.metrics import NOTE_CREATION_LATENCY
 
 class DoctorListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated, IsEmailVerified]
@@ -26,12 +34,13 @@ class DoctorListView(generics.ListAPIView):
     @extend_schema(
         tags=['Doctor-Patient'],
         description='List all available doctors',
+        parameters=CURSOR_PAGINATION_PARAMETERS,
         responses={200: DoctorListSerializer(many=True)}
     )
     def get(self, request, *args, **kwargs):
         doctors = User.objects.filter(user_type=User.UserType.DOCTOR)
           # Get paginator instance
-        paginator = self.pagination_class()
+        paginator = KeysetPagination.for_request(request, self.pagination_class, ('id',))
         
         # Paginate the queryset
         paginated_doctors = paginator.paginate_queryset(doctors, request)
@@ -49,12 +58,13 @@ class MyPatientsView(APIView):
     @extend_schema(
         tags=['Doctor-Patient'],
         description='List all patients assigned to the current doctor',
+        parameters=CURSOR_PAGINATION_PARAMETERS,
         responses={200: DoctorPatientSerializer(many=True)}
     )
     def get(self, request, *args, **kwargs):
         doctor_patients = DoctorPatient.objects.filter(doctor=request.user)
         # Get paginator instance
-        paginator = self.pagination_class()
+        paginator = KeysetPagination.for_request(request, self.pagination_class, ('-created_at', '-id'))
         
         # Paginate the queryset
         paginated_doctor_patients = paginator.paginate_queryset(doctor_patients, request)
@@ -66,7 +76,6 @@ class MyPatientsView(APIView):
 
 class CreateNoteView(APIView):
     permission_classes = [IsAuthenticated, IsDoctor, IsEmailVerified]
-    llm_service = LLMService()
 
     @extend_schema(
         tags=['Doctor Notes'],
@@ -82,12 +91,19 @@ class CreateNoteView(APIView):
                     'content': {
                         'type': 'string',
                         'description': 'Content of the note'
+                    },
+                    'async_processing': {
+                        'type': 'boolean',
+                        'description': 'Queue the AI extraction and return a job to poll instead of waiting for it'
                     }
                 },
                 'required': ['doctor_patient_id', 'content']
             }
         },
-        responses={201: NoteResponseSerializer}
+        responses={
+            201: NoteResponseSerializer,
+            202: NoteJobSerializer
+        }
     )
     def post(self, request):
         if request.user.user_type != User.UserType.DOCTOR:
@@ -123,41 +139,130 @@ class CreateNoteView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
                 
-            # Process with LLM before encryption
-            llm_response = self.llm_service.process_doctor_note(raw_content)
+            if str(request.data.get('async_processing', '')).lower() in ('true', '1'):
+                # Store the encrypted note now and let the worker run the extraction
+                with transaction.atomic():
+                    note = NoteService.create_note(doctor_patient, raw_content)
+                    job = NoteJob.objects.create(note=note)
+                    transaction.on_commit(lambda: NoteBatcher.submit(job.id))
 
-            # Create and encrypt the note
-            note = DoctorNote.objects.create(doctor_patient=doctor_patient)
-            note.encrypt_note(raw_content)
+                return Response(
+                    {'job': NoteJobSerializer(job).data},
+                    status=status.HTTP_202_ACCEPTED
+                )
 
-            # Create checklist items
-            checklist_items = [
-                ChecklistItem.objects.create(note=note, **item)
-                for item in llm_response.get('checklist_items', [])
-            ]
+            with NOTE_CREATION_LATENCY.labels(mode='sync').time():
+                # Extract actionable items (rules first, then LLM) before encryption
+                llm_response = get_note_extractor().process_doctor_note(raw_content)
 
-            # Create action plans and schedule reminders
-            action_plans = [
-                ActionPlan.objects.create(note=note, patient=doctor_patient.patient, is_active=True, **plan)
-                for plan in llm_response.get('action_plans', [])
-            ]
-            
-            # Schedule reminders    
-            for action_plan in action_plans:
-                ReminderService.create_schedule_plan_reminders(action_plan)
+                # Create and encrypt the note with its checklist items, action plans and reminders
+                note = NoteService.create_note(doctor_patient, raw_content, llm_response)
             
             response_data = {
                 'note': DoctorNoteSerializer(note).data,
             }
 
             return Response(response_data, status=status.HTTP_201_CREATED)
-        
+
+        except LLMUnavailable as e:
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         except Exception as e:
             return Response(
                 {"detail": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class CreateNoteStreamView(APIView):
+    permission_classes = [IsAuthenticated, IsDoctor, IsEmailVerified]
+    renderer_classes = [CustomResponseRenderer, EventStreamRenderer]
+
+    @extend_schema(
+        tags=['Doctor Notes'],
+        description=(
+            'Create an encrypted note and stream the AI-generated items as server-sent events. '
+            'Emits `checklist_item` and `action_plan` events as soon as each item is extracted, '
+            'then a `note` event once the note is saved and a final `done` event.'
+        ),
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {
+                    'doctor_patient_id': {
+                        'type': 'integer',
+                        'description': 'ID of the doctor-patient relationship'
+                    },
+                    'content': {
+                        'type': 'string',
+                        'description': 'Content of the note'
+                    }
+                },
+                'required': ['doctor_patient_id', 'content']
+            }
+        },
+        responses={200: OpenApiResponse(description='text/event-stream of extracted items')}
+    )
+    def post(self, request):
+        doctor_patient = get_object_or_404(
+            DoctorPatient, 
+            id=request.data.get('doctor_patient_id'),
+            doctor=request.user
+        )
+
+        raw_content = request.data.get('content')
+        if not raw_content:
+            return Response(
+                {"detail": "Content is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            self.stream_events(doctor_patient, raw_content),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream_events(self, doctor_patient, raw_content):
+        extracted = {'checklist_items': [], 'action_plans': []}
+        started = time.monotonic()
+        try:
+            for section, item in get_note_extractor().stream_doctor_note(raw_content):
+                extracted[section].append(item)
+                event = 'checklist_item' if section == 'checklist_items' else 'action_plan'
+                yield format_event(event, item)
+
+            # Create and encrypt the note once every item is known
+            note = NoteService.create_note(doctor_patient, raw_content, extracted)
+            NOTE_CREATION_LATENCY.labels(mode='stream').observe(time.monotonic() - started)
+
+            yield format_event('note', DoctorNoteSerializer(note).data)
+        except Exception as e:
+            print(f"Error streaming note extraction: {e}")
+            yield format_event('error', {'detail': str(e)})
+
+        yield format_event('done', {})
+
+class NoteJobStatusView(APIView):
+    permission_classes = [IsAuthenticated, IsDoctor, IsEmailVerified]
+
+    @extend_schema(
+        tags=['Doctor Notes'],
+        description='Progress and results of a note queued with async processing',
+        responses={200: NoteJobSerializer}
+    )
+    def get(self, request, job_id):
+        job = get_object_or_404(
+            NoteJob.objects.select_related('note'),
+            id=job_id,
+            note__doctor_patient__doctor=request.user
+        )
+        return Response({'job': NoteJobSerializer(job).data}, status=status.HTTP_200_OK)
+
 class PatientNotesView(APIView):
     permission_classes = [IsAuthenticated, IsDoctor, DoctorPatientPermission, IsEmailVerified]
     
@@ -168,23 +273,21 @@ class PatientNotesView(APIView):
     )
     def get(self, request, patient_id):
         try:
-            notes = DoctorNote.objects.filter(
+            notes = list(DoctorNote.objects.filter(
                 doctor_patient__doctor=request.user,
                 doctor_patient__patient_id=patient_id
-            )
-            decrypted_notes = []
-            for note in notes:
-                try:
-                    decrypted_content = note.decrypt_note(request.user)
-                    note_data = {
-                        'id': note.id,
-                        'content': decrypted_content,
-                        'created_at': note.created_at,
-                    }
-                    decrypted_notes.append(note_data)
-                except Exception as e:
-                    print(f"Decryption error: {str(e)}")
-                    continue
+            ).select_related('doctor_patient__doctor', 'doctor_patient__patient'))
+            contents = NoteDecryptionService.decrypt_notes(notes, request.user)
+
+            decrypted_notes = [
+                {
+                    'id': note.id,
+                    'content': content,
+                    'created_at': note.created_at,
+                }
+                for note, content in zip(notes, contents)
+                if content is not None
+            ]
             return Response({"notes": decrypted_notes}, status=status.HTTP_200_OK)
         
         except Exception as e:
@@ -201,6 +304,7 @@ class ListPatientNotesView(APIView):
     @extend_schema(
         tags=['Doctor Notes'],
         description='List all notes for a specific patient',
+        parameters=CURSOR_PAGINATION_PARAMETERS,
         responses={200: DoctorNoteSerializer(many=True)}
     )
     def get(self, request):
@@ -214,27 +318,27 @@ class ListPatientNotesView(APIView):
                     doctor_patient__patient=request.user
                 ).select_related('doctor_patient__doctor', 'doctor_patient__patient')
 
-            decrypted_notes = []
-            for note in notes:
-                try:
-                    decrypted_content = note.decrypt_note(request.user)
-                    note_data = {
-                        'id': note.id,
-                        'content': decrypted_content,
-                        'created_at': note.created_at,
-                        'doctor': note.doctor_patient.doctor.full_name,
-                        'patient': note.doctor_patient.patient.full_name
-                    }
-                    decrypted_notes.append(note_data)
-                except Exception as e:
-                    print(f"Decryption error for note {note.id}: {str(e)}")
-                    continue
+            # Paginate in the database and only decrypt the requested page
+            paginator = KeysetPagination.for_request(request, self.pagination_class, ('-created_at', '-id'))
+            notes = paginator.paginate_queryset(notes, request)
+            contents = NoteDecryptionService.decrypt_notes(notes, request.user)
 
-            paginator = self.pagination_class()
-            paginated_notes = paginator.paginate_queryset(decrypted_notes, request)
+            decrypted_notes = [
+                {
+                    'id': note.id,
+                    'content': content,
+                    'created_at': note.created_at,
+                    'doctor': note.doctor_patient.doctor.full_name,
+                    'patient': note.doctor_patient.patient.full_name
+                }
+                for note, content in zip(notes, contents)
+                if content is not None
+            ]
             
-            return paginator.get_paginated_response(paginated_notes)
+            return paginator.get_paginated_response(decrypted_notes)
 
+        except NotFound:
+            raise
         except Exception as e:
             return Response(
                 {"success": False, "error": str(e)},
@@ -262,18 +366,19 @@ class ActionPlanView(APIView):
     @extend_schema(
         tags=['Action Plans'], 
         description='List action plans',
-        responses={200: ActionPlanSerializer(many=True)}
+        parameters=CURSOR_PAGINATION_PARAMETERS,
+        responses={200: ActionPlanScheduleSerializer(many=True)}
     )
     def get(self, request):
         action_plans = ActionPlan.objects.all()
         # Get paginator instance
-        paginator = self.pagination_class()
+        paginator = KeysetPagination.for_request(request, self.pagination_class, ('created_at', 'id'))
         
         # Paginate the queryset
         paginated_action_plans = paginator.paginate_queryset(action_plans, request)
         
         # Serialize the paginated data
-        serializer = ActionPlanSerializer(paginated_action_plans, many=True)
+        serializer = ActionPlanScheduleSerializer(paginated_action_plans, many=True)
         return paginator.get_paginated_response(serializer.data)
 
 class ActionPlanDetailView(APIView):
@@ -287,11 +392,11 @@ class ActionPlanDetailView(APIView):
                 'description': 'ID of the action plan to get details for'
             }
         }}},
-        responses={200: ActionPlanSerializer}
+        responses={200: ActionPlanScheduleSerializer}
     )   
     def get(self, request, pk):
         action_plan = get_object_or_404(ActionPlan, id=pk)
-        serializer = ActionPlanSerializer(action_plan)
+        serializer = ActionPlanScheduleSerializer(action_plan)
         return Response(serializer.data, status=status.HTTP_200_OK  )
 
 class ReminderView(APIView):
@@ -300,21 +405,32 @@ class ReminderView(APIView):
     
     @extend_schema(
         tags=['Reminders'],
-        description='List reminders',
+        description='List reminders. `view=flat` returns flat rows with the action and patient name '
+                    'instead of the nested action plan and patient, read in a single query.',
+        parameters=CURSOR_PAGINATION_PARAMETERS + [
+            OpenApiParameter('view', str, enum=['flat'], description='Set to `flat` for the flat representation')
+        ],
         responses={200: ReminderSerializer(many=True)}
     )
     def get(self, request):
         user = request.user
         if user.user_type == User.UserType.DOCTOR:
-            reminders = Reminder.objects.filter(action_plan__note__doctor_patient__doctor=user)
+            reminders = Reminder.objects.filter(doctor=user)
         else:
             reminders = Reminder.objects.filter(patient=user)
+
+        flat = request.query_params.get('view') == 'flat'
+        if flat:
+            reminders = FlatReminderSerializer.select(reminders)
+        else:
+            reminders = reminders.select_related('action_plan', 'patient')
             
         # Get paginator instance
-        paginator = self.pagination_class()
+        paginator = KeysetPagination.for_request(request, self.pagination_class, ('scheduled_for', 'id'))
         
         # Paginate the queryset
         paginated_reminders = paginator.paginate_queryset(reminders, request)
         
-        serializer = ReminderSerializer(paginated_reminders, many=True)
+        serializer_class = FlatReminderSerializer if flat else ReminderSerializer
+        serializer = serializer_class(paginated_reminders, many=True)
         return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
@@ -95,6 +95,9 @@ class UserRegistrationView(APIView):
             user.is_active = True
             user.save()
 
+            # Hand out note encryption keys now, from the pre-generated pool when possible
+            user.generate_encryption_keys()
+
             interval = settings.EMAIL_TOKEN_EXPIRATION_MINUTES
             
             # Queue Verification Mail
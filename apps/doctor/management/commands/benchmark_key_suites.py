@@ -0,0 +1,48 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from api.utils.encryption import NoteEncryption, KEY_SUITES
+
+
+class Command(BaseCommand):
+    help = 'Compare key generation, wrap and unwrap throughput of the note key suites'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Operations timed per measurement')
+        parser.add_argument('--keygen-iterations', type=int, default=20, help='Key pairs generated per suite')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        data_key = os.urandom(32)
+
+        self.stdout.write(f"{'suite':<8} {'keygen/s':>10} {'wrap/s':>10} {'unwrap/s':>10} {'wrapped bytes':>14}")
+        for name in KEY_SUITES:
+            keygen_rate = self.rate(
+                lambda: NoteEncryption.generate_key_pair(name), options['keygen_iterations']
+            )
+
+            private_pem, public_pem = NoteEncryption.generate_key_pair(name)
+            # Loaded keys are cached in production, leave PEM parsing out of the numbers
+            public_key = NoteEncryption.load_public_key(public_pem, user_id=f'benchmark-{name}')
+            NoteEncryption.load_private_key(private_pem, user_id=f'benchmark-{name}')
+
+            wrapped_key = NoteEncryption.wrap_key(data_key, public_pem, f'benchmark-{name}')
+            wrap_rate = self.rate(
+                lambda: NoteEncryption.wrap_key(data_key, public_pem, f'benchmark-{name}'), iterations
+            )
+            unwrap_rate = self.rate(
+                lambda: NoteEncryption.unwrap_key(wrapped_key, private_pem, f'benchmark-{name}'), iterations
+            )
+            assert NoteEncryption.unwrap_key(wrapped_key, private_pem, f'benchmark-{name}') == data_key
+            assert NoteEncryption.key_suite(public_key) == KEY_SUITES[name]
+
+            self.stdout.write(
+                f"{name:<8} {keygen_rate:>10.1f} {wrap_rate:>10.1f} {unwrap_rate:>10.1f} {len(wrapped_key):>14}"
+            )
+
+    @staticmethod
+    def rate(operation, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        return iterations / (time.perf_counter() - started)
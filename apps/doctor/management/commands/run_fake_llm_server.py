@@ -0,0 +1,170 @@
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+
+
+DEFAULT_FIXTURE = {
+    'checklist_items': [
+        {'task': 'Pick up prescription from the pharmacy'}
+    ],
+    'action_plans': [
+        {'action': 'Take amoxicillin 500mg', 'frequency': 'DAILY', 'duration_days': 7}
+    ]
+}
+
+NOTE_ID = re.compile(r'<note id="(\d+)">')
+
+
+class LatencyModel:
+    """
+    Parses latency specs given in milliseconds:
+        constant:300
+        uniform:100:800
+        normal:400:100          (mean, standard deviation)
+        lognormal:400:0.5       (median, sigma)
+    """
+
+    def __init__(self, spec):
+        kind, *params = spec.split(':')
+        try:
+            params = [float(param) for param in params]
+        except ValueError:
+            raise CommandError(f"Invalid latency spec '{spec}'")
+
+        samplers = {
+            ('constant', 1): lambda: params[0],
+            ('uniform', 2): lambda: random.uniform(params[0], params[1]),
+            ('normal', 2): lambda: random.gauss(params[0], params[1]),
+            ('lognormal', 2): lambda: params[0] * random.lognormvariate(0, params[1]),
+        }
+        self.sampler = samplers.get((kind, len(params)))
+        if self.sampler is None:
+            raise CommandError(f"Invalid latency spec '{spec}'")
+
+    def sample_seconds(self):
+        return max(0.0, self.sampler()) / 1000
+
+
+class Command(BaseCommand):
+    help = 'Run a local HTTP stand-in for the LLM (LLM_BACKEND=fake) to load test note creation offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--latency', default='lognormal:800:0.4',
+            help='Full response latency in ms, e.g. constant:300, uniform:100:800, normal:400:100, lognormal:800:0.4'
+        )
+        parser.add_argument(
+            '--first-chunk-latency', default=None,
+            help='Time to first streamed chunk, same format as --latency (defaults to a fifth of it)'
+        )
+        parser.add_argument(
+            '--fixtures', default=None,
+            help='Directory of JSON extraction fixtures, served round-robin'
+        )
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with HTTP 503')
+        parser.add_argument('--chunk-size', type=int, default=40, help='Characters per streamed chunk')
+
+    def handle(self, *args, **options):
+        fixtures = self.load_fixtures(options['fixtures'])
+        latency = LatencyModel(options['latency'])
+        first_chunk_latency = LatencyModel(options['first_chunk_latency']) if options['first_chunk_latency'] else None
+        fixture_cycle = itertools.cycle(fixtures)
+        fixture_lock = threading.Lock()
+
+        def next_fixture():
+            with fixture_lock:
+                return next(fixture_cycle)
+
+        def build_response(prompt):
+            note_ids = NOTE_ID.findall(prompt)
+            if note_ids:
+                # Batched extraction prompt, answer every note
+                return json.dumps({
+                    'notes': [{'id': int(note_id), **next_fixture()} for note_id in note_ids]
+                })
+            return json.dumps(next_fixture())
+
+        error_rate = options['error_rate']
+        chunk_size = options['chunk_size']
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                prompt = json.loads(self.rfile.read(length) or b'{}').get('prompt', '')
+
+                if random.random() < error_rate:
+                    time.sleep(latency.sample_seconds())
+                    return self.send_json(503, {'error': 'simulated upstream failure'})
+
+                text = build_response(prompt)
+                if self.path == '/generate':
+                    time.sleep(latency.sample_seconds())
+                    return self.send_json(200, {
+                        'text': text,
+                        'usage': {'prompt_tokens': len(prompt) // 4, 'response_tokens': len(text) // 4}
+                    })
+                if self.path == '/stream':
+                    return self.send_stream(text)
+                return self.send_json(404, {'error': 'not found'})
+
+            def send_json(self, code, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self, text):
+                total = latency.sample_seconds()
+                first = first_chunk_latency.sample_seconds() if first_chunk_latency else total / 5
+                chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+                gap = max(0.0, total - first) / max(1, len(chunks) - 1)
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                time.sleep(first)
+                for index, chunk in enumerate(chunks):
+                    if index:
+                        time.sleep(gap)
+                    data = chunk.encode()
+                    self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake LLM server on http://{options['host']}:{options['port']} "
+            f"({len(fixtures)} fixtures, latency {options['latency']})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def load_fixtures(self, directory):
+        if not directory:
+            return [DEFAULT_FIXTURE]
+
+        paths = sorted(Path(directory).glob('*.json'))
+        if not paths:
+            raise CommandError(f"No .json fixtures found in {directory}")
+        return [json.loads(path.read_text()) for path in paths]
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.doctor.models import DoctorNote
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encrypt notes stored in the JSON formats into the binary format. '
+        'Each batch commits on its own, so an interrupted run continues where it stopped when started again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Notes re-encrypted per transaction')
+        parser.add_argument('--after-id', type=int, default=0, help='Only convert notes with a greater id')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the notes that need upgrading')
+
+    def handle(self, *args, **options):
+        notes = DoctorNote.objects.filter(
+            ciphertext__isnull=True,
+            pk__gt=options['after_id']
+        ).select_related(
+            'doctor_patient__doctor', 'doctor_patient__patient'
+        ).order_by('pk')
+
+        if options['dry_run']:
+            self.stdout.write(f"{notes.count()} notes use a JSON format")
+            return
+
+        upgraded = failed = 0
+        last_pk = options['after_id']
+        while True:
+            # Walk by primary key so notes that fail aren't picked up again in this run
+            batch = list(notes.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            with transaction.atomic():
+                for note in batch:
+                    try:
+                        # A failed write would otherwise abort the whole batch transaction
+                        with transaction.atomic():
+                            if note.upgrade_encryption():
+                                upgraded += 1
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"Note {note.pk}: {e}")
+
+            self.stdout.write(f"Upgraded {upgraded} notes so far (last id {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Upgraded {upgraded} notes, {failed} failed"))
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='doctor.doctornote')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
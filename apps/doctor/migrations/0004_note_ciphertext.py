@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0003_note_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctornote',
+            name='ciphertext',
+            field=models.BinaryField(null=True),
+        ),
+    ]
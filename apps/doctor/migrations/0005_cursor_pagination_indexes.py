@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0004_note_ciphertext'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctornote',
+            index=models.Index(fields=['created_at', 'id'], name='doctornote_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctorpatient',
+            index=models.Index(fields=['created_at', 'id'], name='doctorpatient_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+TASK_NAME = 'Reap stuck note jobs'
+
+
+def schedule(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    every_five_minutes, _ = IntervalSchedule.objects.get_or_create(every=5, period='minutes')
+    PeriodicTask.objects.update_or_create(
+        name=TASK_NAME,
+        defaults={'task': 'reap_stuck_note_jobs', 'interval': every_five_minutes, 'queue': 'Note', 'enabled': True},
+    )
+
+
+def unschedule(apps, schema_editor):
+    apps.get_model('django_celery_beat', 'PeriodicTask').objects.filter(name=TASK_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0006_note_job_attempts'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule, unschedule),
+    ]
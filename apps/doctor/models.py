@@ -1,7 +1,7 @@
 from django.db import models
 from django.core.exceptions import ValidationError
 from apps.user.models import User
-from api.utils.encryption import NoteEncryption
+from api.utils.encryption import NoteEncryption, ENVELOPE_VERSION, BINARY_VERSION
 # Create your models here.
 class DoctorPatient(models.Model):
     doctor = models.ForeignKey(
@@ -22,6 +22,10 @@ class DoctorPatient(models.Model):
     class Meta:
         unique_together = ('doctor', 'patient')
         ordering = ['-created_at']
+        indexes = [
+            # Cursor pagination
+            models.Index(fields=['created_at', 'id'], name='doctorpatient_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Dr. {self.doctor.full_name} - {self.patient.full_name}"
@@ -32,7 +36,9 @@ class DoctorNote(models.Model):
         on_delete=models.CASCADE,
         related_name='notes'
     )
+    # Legacy JSON formats, new notes only use `ciphertext`
     content =  models.JSONField(default=dict)
+    ciphertext = models.BinaryField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -40,8 +46,8 @@ class DoctorNote(models.Model):
         if self.doctor_patient.doctor != self.doctor_patient.doctor:
             raise ValidationError("Doctor can only add notes for their patients")
 
-    def encrypt_note(self, raw_content: str):
-        """Encrypt note content for both doctor and patient"""
+    def encrypt_note(self, raw_content: str, save: bool = True):
+        """Encrypt note content once, readable by both doctor and patient"""
         doctor = self.doctor_patient.doctor
         patient = self.doctor_patient.patient
                 
@@ -49,43 +55,79 @@ class DoctorNote(models.Model):
         doctor.generate_encryption_keys()
         patient.generate_encryption_keys()
         
-        # Encrypt for doctor
-        doctor_encrypted = NoteEncryption.encrypt_note(
-            raw_content, 
-            doctor.public_key
-        )
-        
-        # Encrypt for patient
-        patient_encrypted = NoteEncryption.encrypt_note(
-            raw_content, 
-            patient.public_key
-        )
-        
-        self.content = {
-            'doctor': doctor_encrypted,
-            'patient': patient_encrypted
-        }
-        self.save()
+        self.ciphertext = NoteEncryption.encrypt_binary(raw_content, {
+            doctor.id: doctor.public_key,
+            patient.id: patient.public_key,
+        })
+        self.content = {}
+        if save:
+            self.save()
+
+    @property
+    def is_legacy_format(self):
+        return self.ciphertext is None
     
     def decrypt_note(self, user: User) -> str:
         """Decrypt note content for authorized user"""
         if user not in [self.doctor_patient.doctor, self.doctor_patient.patient]:
             raise PermissionError("Unauthorized access to note")
 
-        user_type = 'doctor' if user.user_type == User.UserType.DOCTOR else 'patient'
-        
         try:
-            encrypted_data = self.content.get(user_type)
-            if not encrypted_data:
-                raise ValueError(f"No encrypted data found for {user_type}")
-                
-            return NoteEncryption.decrypt_note(encrypted_data, user.private_key)
+            return self.decrypt_with_key(user, user.private_key)
         except Exception as e:
+            # The note may not have been re-wrapped yet after a key rotation
+            for private_key in user.retired_private_keys():
+                try:
+                    return self.decrypt_with_key(user, private_key)
+                except Exception:
+                    continue
             print(f"Decryption error: {str(e)}")
             raise
+
+    def decrypt_with_key(self, user: User, private_key: bytes) -> str:
+        """Decrypt with the given private key of the user, whichever format the note uses"""
+        if self.ciphertext is not None:
+            return NoteEncryption.decrypt_binary(self.ciphertext, user.id, private_key)
+
+        if self.content.get('version') == ENVELOPE_VERSION:
+            return NoteEncryption.decrypt_envelope(self.content, user.id, private_key)
+
+        user_type = 'doctor' if user.user_type == User.UserType.DOCTOR else 'patient'
+        encrypted_data = self.content.get(user_type)
+        if not encrypted_data:
+            raise ValueError(f"No encrypted data found for {user_type}")
+            
+        return NoteEncryption.decrypt_note(encrypted_data, private_key, user.id)
+
+    def rewrap_key(self, user: User, old_private_key: bytes, save: bool = True):
+        """Make the note readable with the user's new key pair after a key rotation"""
+        if self.ciphertext is not None and NoteEncryption.parse_binary(self.ciphertext)[0] == BINARY_VERSION:
+            self.ciphertext = NoteEncryption.rewrap_binary(
+                self.ciphertext, user.id, old_private_key, user.public_key
+            )
+        else:
+            # Older formats are re-encrypted into the current one instead
+            self.encrypt_note(self.decrypt_with_key(user, old_private_key), save=False)
+        if save:
+            # Keep updated_at, the note itself hasn't changed
+            self.save(update_fields=['content', 'ciphertext'])
+
+    def upgrade_encryption(self, save: bool = True):
+        """Re-encrypt a note stored in a JSON format into the binary format, returns False if it already uses it"""
+        if not self.is_legacy_format:
+            return False
+        self.encrypt_note(self.decrypt_note(self.doctor_patient.doctor), save=False)
+        if save:
+            # Keep updated_at, the note itself hasn't changed
+            self.save(update_fields=['content', 'ciphertext'])
+        return True
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Cursor pagination
+            models.Index(fields=['created_at', 'id'], name='doctornote_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Note for {self.doctor_patient.patient.full_name} by Dr. {self.doctor_patient.doctor.full_name}"
@@ -104,4 +146,35 @@ class ChecklistItem(models.Model):
         ordering = ['created_at']
 
     def __str__(self):
-        return self.task
\ No newline at end of file
+        return self.task
+
+class NoteJob(models.Model):
+    """Tracks background extraction of a note created in async mode"""
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        PROCESSING = 'PROCESSING', 'Processing'
+        COMPLETED = 'COMPLETED', 'Completed'
+        FAILED = 'FAILED', 'Failed'
+
+    note = models.OneToOneField(
+        DoctorNote,
+        on_delete=models.CASCADE,
+        related_name='job'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    progress = models.PositiveSmallIntegerField(default=0)  # Percentage of the pipeline completed
+    attempts = models.PositiveSmallIntegerField(default=0)  # Times a worker claimed the job
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Job {self.id} for note {self.note_id} ({self.status})"
@@ -0,0 +1,163 @@
+from datetime import timedelta
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from core.celery import app
+from apps.doctor.models import NoteJob
+from api.external.services import NoteService
+from api.external.extractors import get_note_extractor
+from api.external.batching import NoteBatcher
+
+logger = get_task_logger(__name__)
+
+
+def _update_job(job_id, **fields):
+    """Queryset update that still bumps updated_at"""
+    return NoteJob.objects.filter(id=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def _update_job_claim(job, **fields):
+    """Update the job only while it is still processing under the same claim"""
+    return NoteJob.objects.filter(
+        id=job.id,
+        status=NoteJob.Status.PROCESSING,
+        attempts=job.attempts
+    ).update(updated_at=timezone.now(), **fields)
+
+
+def _claim_job(job_id):
+    """Move a pending job to processing, returns the job or None if another worker has it"""
+    # Claim the job so duplicate deliveries don't process the note twice
+    claimed = NoteJob.objects.filter(
+        id=job_id,
+        status=NoteJob.Status.PENDING
+    ).update(status=NoteJob.Status.PROCESSING, progress=10, attempts=F('attempts') + 1, updated_at=timezone.now())
+    if not claimed:
+        logger.info(f"Note job {job_id} already claimed or missing")
+        return None
+
+    return NoteJob.objects.select_related(
+        'note__doctor_patient__doctor', 'note__doctor_patient__patient'
+    ).get(id=job_id)
+
+
+def _read_note(job):
+    # The plaintext is never queued, recover it from the stored ciphertext
+    note = job.note
+    return note.decrypt_note(note.doctor_patient.doctor)
+
+
+def _complete_job(job, llm_response):
+    """Save the extraction and mark the job completed in one transaction, returns False if the claim was lost"""
+    _update_job(job.id, progress=60)
+    with transaction.atomic():
+        # Only for the claim this worker holds, a job requeued by the reaper belongs to its next worker
+        completed = _update_job_claim(
+            job,
+            status=NoteJob.Status.COMPLETED,
+            progress=100,
+            completed_at=timezone.now()
+        )
+        if not completed:
+            logger.info(f"Note job {job.id} was requeued while processing, leaving it to the next claim")
+            return False
+        NoteService.apply_extraction(job.note, llm_response)
+    return True
+
+
+
+def _fail_job(job, error):
+    logger.error(f"Note job {job.id} failed: {error}")
+    _update_job_claim(
+        job,
+        status=NoteJob.Status.FAILED,
+        error=str(error),
+        completed_at=timezone.now()
+    )
+
+
+@app.task(name='process_note_job', serializer='json', queue="Note")
+def process_note_job(job_id):
+    """
+    Run LLM extraction for a note created in async mode and persist
+    its checklist items, action plans and reminders
+    """
+    job = _claim_job(job_id)
+    if job is None:
+        return {'message': 'job skipped'}
+
+    try:
+        llm_response = get_note_extractor().process_doctor_note(_read_note(job))
+        _complete_job(job, llm_response)
+    except Exception as e:
+        _fail_job(job, e)
+        return {'message': 'job failed'}
+
+    return {'message': 'job completed'}
+
+
+@app.task(name='flush_note_batch', serializer='json', queue="Note")
+def flush_note_batch():
+    """Extract every note job queued in the current batch window with one LLM call"""
+    job_ids = NoteBatcher.take_batch()
+
+    jobs, contents = [], []
+    for job_id in job_ids:
+        job = _claim_job(job_id)
+        if job is None:
+            continue
+        try:
+            contents.append(_read_note(job))
+            jobs.append(job)
+        except Exception as e:
+            _fail_job(job, e)
+
+    if jobs:
+        try:
+            llm_responses = get_note_extractor().process_doctor_notes(contents)
+        except Exception as e:
+            for job in jobs:
+                _fail_job(job, e)
+            llm_responses = []
+
+        # One failing note must not fail the rest of the batch
+        for job, llm_response in zip(jobs, llm_responses):
+            try:
+                _complete_job(job, llm_response)
+            except Exception as e:
+                _fail_job(job, e)
+
+    # Jobs that arrived while this batch was running
+    NoteBatcher.schedule_flush()
+
+    return {'message': f'processed {len(jobs)} jobs'}
+
+
+@app.task(name='reap_stuck_note_jobs', serializer='json', queue="Note")
+def reap_stuck_note_jobs():
+    """
+    Periodic task for jobs whose worker died while processing them: queue
+    them again, or fail them once they have used up NOTE_JOB_MAX_ATTEMPTS
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.NOTE_JOB_TIMEOUT_SECONDS)
+    stuck = NoteJob.objects.filter(status=NoteJob.Status.PROCESSING, updated_at__lt=cutoff)
+
+    failed = stuck.filter(attempts__gte=settings.NOTE_JOB_MAX_ATTEMPTS).update(
+        status=NoteJob.Status.FAILED,
+        error='Timed out while processing',
+        completed_at=timezone.now(),
+        updated_at=timezone.now()
+    )
+
+    requeued = []
+    for job_id in stuck.values_list('id', flat=True):
+        # Conditional, a worker may still finish the job in the meantime
+        if stuck.filter(id=job_id).update(status=NoteJob.Status.PENDING, progress=0, updated_at=timezone.now()):
+            requeued.append(job_id)
+            transaction.on_commit(lambda job_id=job_id: NoteBatcher.submit(job_id))
+
+    if failed or requeued:
+        logger.warning(f"Requeued {len(requeued)} stuck note jobs, failed {failed}")
+    return {'requeued': len(requeued), 'failed': failed}
@@ -1,3 +1,1244 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import fakeredis
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.management import call_command
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from redis.exceptions import RedisError
+from api.pagination import EstimatedCountPaginator, KeysetPagination
+from api.external.admission import CircuitBreaker, ConcurrencyLimiter, LLMGuard, LLMUnavailable
+from api.external.batching import NoteBatcher
+from api.external.cache import ExtractionCache
+from api.external.extractors import NoteExtractor, RuleBasedExtractor
+from api.external.services import LLMService, NoteDecryptionService, NoteService
+from api.external.streaming import IncrementalExtractionParser
+from api.utils.encryption import NoteEncryption, KeyCache, BINARY_VERSION, FLAG_COMPRESSED, NONCE_SIZE
+from apps.doctor.models import ChecklistItem, DoctorPatient, DoctorNote, NoteJob
+from apps.doctor.tasks import flush_note_batch, process_note_job, reap_stuck_note_jobs
+from apps.patient.models import ActionPlan
+from apps.user.models import User
 
-# Create your tests here.
+
+def create_doctor_patient(prefix=''):
+    doctor = User.objects.create_user(f'{prefix}doctor@example.com', None, user_type=User.UserType.DOCTOR)
+    patient = User.objects.create_user(f'{prefix}patient@example.com', None, user_type=User.UserType.PATIENT)
+    return DoctorPatient.objects.create(doctor=doctor, patient=patient)
+
+
+def give_keys(doctor_patient, suite='x25519'):
+    """Store fresh key pairs on both users without going through the key pool"""
+    for user in (doctor_patient.doctor, doctor_patient.patient):
+        user.private_key, user.public_key = NoteEncryption.generate_key_pair(suite)
+        user.save(update_fields=['private_key', 'public_key'])
+
+
+@override_settings(NOTE_JOB_TIMEOUT_SECONDS=600, NOTE_JOB_MAX_ATTEMPTS=3)
+class ReapStuckNoteJobsTests(TestCase):
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+
+    def create_job(self, status, attempts, age):
+        job = NoteJob.objects.create(
+            note=DoctorNote.objects.create(doctor_patient=self.doctor_patient),
+            status=status,
+            attempts=attempts
+        )
+        NoteJob.objects.filter(id=job.id).update(updated_at=timezone.now() - age)
+        return job
+
+    @mock.patch('apps.doctor.tasks.NoteBatcher.submit')
+    def test_requeues_stuck_jobs(self, submit):
+        stuck = self.create_job(NoteJob.Status.PROCESSING, 1, timedelta(minutes=20))
+        running = self.create_job(NoteJob.Status.PROCESSING, 1, timedelta(minutes=2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_stuck_note_jobs(), {'requeued': 1, 'failed': 0})
+
+        submit.assert_called_once_with(stuck.id)
+        stuck.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stuck.status, NoteJob.Status.PENDING)
+        self.assertEqual(running.status, NoteJob.Status.PROCESSING)
+
+    @mock.patch('apps.doctor.tasks.NoteBatcher.submit')
+    def test_fails_jobs_out_of_attempts(self, submit):
+        job = self.create_job(NoteJob.Status.PROCESSING, 3, timedelta(minutes=20))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_stuck_note_jobs(), {'requeued': 0, 'failed': 1})
+
+        submit.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, NoteJob.Status.FAILED)
+        self.assertIsNotNone(job.completed_at)
+
+    def test_is_scheduled(self):
+        from django_celery_beat.models import PeriodicTask
+        self.assertTrue(PeriodicTask.objects.filter(task='reap_stuck_note_jobs', enabled=True).exists())
+
+
+def extraction():
+    today = timezone.now().date()
+    return {
+        'checklist_items': [{'task': 'Pick up amoxicillin'}],
+        'action_plans': [{
+            'action': 'Take amoxicillin',
+            'frequency': 'DAILY',
+            'start_date': today.isoformat(),
+            'end_date': (today + timedelta(days=10)).isoformat(),
+            'duration_days': 10,
+        }],
+    }
+
+
+@mock.patch('api.external.services.app.send_task')
+@mock.patch('apps.doctor.tasks.get_note_extractor')
+class AsyncNoteJobTests(TestCase):
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+        self.doctor = self.doctor_patient.doctor
+        self.doctor.email_verified = True
+        self.doctor.save(update_fields=['email_verified'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    @mock.patch('api.views.doctor.NoteBatcher.submit')
+    def create_job(self, submit):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/notes/create/', {
+                'doctor_patient_id': self.doctor_patient.id,
+                'content': 'Take amoxicillin daily for 10 days',
+                'async_processing': 'true',
+            })
+        self.assertEqual(response.status_code, 202)
+        job = NoteJob.objects.get(id=response.json()['data']['job']['id'])
+        submit.assert_called_once_with(job.id)
+        return job
+
+    def get_job(self, job):
+        response = self.client.get(f'/api/v1/notes/jobs/{job.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']['job']
+
+    def test_job_lifecycle(self, get_note_extractor, send_task):
+        get_note_extractor.return_value.process_doctor_note.return_value = extraction()
+        job = self.create_job()
+        self.assertEqual(self.get_job(job)['status'], NoteJob.Status.PENDING)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_note_job(job.id), {'message': 'job completed'})
+
+        # The worker reads the note back from its ciphertext
+        get_note_extractor.return_value.process_doctor_note.assert_called_once_with('Take amoxicillin daily for 10 days')
+        data = self.get_job(job)
+        self.assertEqual((data['status'], data['progress']), (NoteJob.Status.COMPLETED, 100))
+        self.assertEqual([item['task'] for item in data['checklist_items']], ['Pick up amoxicillin'])
+        self.assertEqual([plan['action'] for plan in data['action_plans']], ['Take amoxicillin'])
+        send_task.assert_called_once()
+
+        # A duplicate delivery doesn't extract the note again
+        self.assertEqual(process_note_job(job.id), {'message': 'job skipped'})
+        self.assertEqual(job.note.checklist_items.count(), 1)
+
+    def test_failed_extraction_saves_nothing(self, get_note_extractor, send_task):
+        get_note_extractor.return_value.process_doctor_note.return_value = extraction()
+        job = self.create_job()
+
+        # Fails after the checklist items and action plans are inserted
+        with mock.patch(
+            'api.external.services.ReminderService.create_schedule_note_reminders',
+            side_effect=RuntimeError('database went away')
+        ):
+            self.assertEqual(process_note_job(job.id), {'message': 'job failed'})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, NoteJob.Status.FAILED)
+        self.assertEqual(job.error, 'database went away')
+        self.assertFalse(job.note.checklist_items.exists())
+        self.assertFalse(job.note.action_plans.exists())
+
+    def test_requeued_job_is_only_completed_by_its_new_claim(self, get_note_extractor, send_task):
+        job = self.create_job()
+
+        def requeued_while_extracting(content):
+            # The reaper gave up on this worker and queued the job again
+            NoteJob.objects.filter(id=job.id).update(status=NoteJob.Status.PENDING)
+            return extraction()
+
+        get_note_extractor.return_value.process_doctor_note.side_effect = requeued_while_extracting
+        process_note_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, NoteJob.Status.PENDING)
+        self.assertFalse(job.note.checklist_items.exists())
+
+        get_note_extractor.return_value.process_doctor_note.side_effect = None
+        get_note_extractor.return_value.process_doctor_note.return_value = extraction()
+        with self.captureOnCommitCallbacks(execute=True):
+            process_note_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (NoteJob.Status.COMPLETED, 2))
+        self.assertEqual(job.note.checklist_items.count(), 1)
+        self.assertEqual(job.note.action_plans.count(), 1)
+
+    def test_other_doctors_cannot_see_the_job(self, get_note_extractor, send_task):
+        job = self.create_job()
+        other = create_doctor_patient('other-').doctor
+        other.email_verified = True
+        other.save(update_fields=['email_verified'])
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'/api/v1/notes/jobs/{job.id}/').status_code, 404)
+
+
+def plans_extraction(count):
+    response = extraction()
+    response['checklist_items'] = response['checklist_items'] * count
+    response['action_plans'] = [dict(plan, action=f'Take dose {index}') for index in range(count) for plan in response['action_plans']]
+    return response
+
+
+@mock.patch('api.external.services.app.send_task')
+class CreateNoteTests(TestCase):
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+        give_keys(self.doctor_patient)
+        # Warm the key lookups so only the note's own queries are counted
+        NoteService.create_note(self.doctor_patient, 'Warm up')
+
+    def count_queries(self, llm_response):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                note = NoteService.create_note(self.doctor_patient, 'Take amoxicillin daily', llm_response)
+        return note, len(queries)
+
+    def test_queries_do_not_grow_with_the_plans(self, send_task):
+        _, one_plan = self.count_queries(plans_extraction(1))
+        note, ten_plans = self.count_queries(plans_extraction(10))
+        self.assertEqual(one_plan, ten_plans)
+
+        self.assertEqual(note.checklist_items.count(), 10)
+        self.assertEqual(note.action_plans.count(), 10)
+        # The first reminder of every plan is queued
+        self.assertEqual(send_task.call_count, 11)
+        for plan in note.action_plans.all():
+            self.assertEqual(
+                list(plan.reminders.values_list('sequence_number', flat=True)),
+                list(range(1, plan.materialized_count + 1))
+            )
+            self.assertEqual(plan.materialized_count, settings.REMINDER_WINDOW_OCCURRENCES + 1)
+
+    def test_rolls_back_as_a_whole(self, send_task):
+        notes = DoctorNote.objects.count()
+        with mock.patch(
+            'api.external.services.Reminder.objects.bulk_create',
+            side_effect=RuntimeError('database went away')
+        ):
+            with self.assertRaises(RuntimeError):
+                NoteService.create_note(self.doctor_patient, 'Take amoxicillin daily', plans_extraction(3))
+
+        self.assertEqual(DoctorNote.objects.count(), notes)
+        self.assertFalse(ChecklistItem.objects.filter(note__doctor_patient=self.doctor_patient).exists())
+        self.assertFalse(ActionPlan.objects.filter(patient=self.doctor_patient.patient).exists())
+        send_task.assert_not_called()
+
+
+class RuleBasedExtractorTests(SimpleTestCase):
+    def setUp(self):
+        self.extractor = RuleBasedExtractor()
+
+    def test_dosing_instruction(self):
+        result, confidence = self.extractor.extract('Take amoxicillin twice daily for 10 days')
+        self.assertEqual(result['action_plans'], [
+            {'action': 'Take amoxicillin twice daily for 10 days', 'frequency': 'DAILY', 'duration_days': 10}
+        ])
+        self.assertEqual(confidence, 1.0)
+
+    def test_negated_and_stop_instructions_are_left_to_the_llm(self):
+        for note in (
+            'Do not take aspirin daily for 7 days',
+            "Don't use the inhaler daily",
+            'Stop taking metformin twice daily',
+            'Discontinue lisinopril daily for 2 weeks',
+            'Avoid alcohol daily for 2 weeks',
+            'Hold warfarin daily for 3 days',
+        ):
+            with self.subTest(note=note):
+                result, confidence = self.extractor.extract(note)
+                self.assertEqual(result['action_plans'], [])
+                self.assertEqual(confidence, 0.0)
+
+    def test_history_is_left_to_the_llm(self):
+        for note in (
+            'Patient reports headaches daily for 3 weeks',
+            'History of migraines weekly for 2 months',
+            'Has had nausea daily for 5 days',
+        ):
+            with self.subTest(note=note):
+                result, confidence = self.extractor.extract(note)
+                self.assertEqual(result['action_plans'], [])
+                self.assertEqual(confidence, 0.0)
+
+    def test_schedules_without_a_dosing_verb_are_not_plans(self):
+        result, confidence = self.extractor.extract('Headaches daily for 3 weeks')
+        self.assertEqual(result['action_plans'], [])
+        self.assertEqual(confidence, 0.0)
+
+    def test_one_negated_sentence_sends_the_whole_note_to_the_llm(self):
+        result, confidence = self.extractor.extract('Take ibuprofen daily for 5 days. Stop taking aspirin daily.')
+        self.assertEqual(len(result['action_plans']), 1)
+        self.assertLess(confidence, 0.85)
+
+
+@override_settings(RULE_EXTRACTOR_ENABLED=True, RULE_EXTRACTOR_MIN_CONFIDENCE=0.85)
+class NoteExtractorTests(SimpleTestCase):
+    def test_stop_instruction_goes_to_the_llm(self):
+        llm_service = mock.Mock()
+        llm_service.process_doctor_note.return_value = {'checklist_items': [], 'action_plans': []}
+
+        result = NoteExtractor(llm_service).process_doctor_note('Stop taking metformin twice daily for 7 days')
+
+        llm_service.process_doctor_note.assert_called_once()
+        self.assertEqual(result['action_plans'], [])
+
+
+class KeyCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = KeyCache(max_entries=2)
+        self.loader = mock.Mock(side_effect=lambda pem: f'loaded {pem.decode()}')
+
+    def test_hit_loads_once(self):
+        self.assertEqual(self.cache.get_or_load(1, 'public', b'a', self.loader), 'loaded a')
+        self.assertEqual(self.cache.get_or_load(1, 'public', b'a', self.loader), 'loaded a')
+        self.loader.assert_called_once_with(b'a')
+
+    def test_changed_key_is_loaded_again(self):
+        self.cache.get_or_load(1, 'public', b'a', self.loader)
+        self.assertEqual(self.cache.get_or_load(1, 'public', b'b', self.loader), 'loaded b')
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get_or_load(1, 'public', b'a', self.loader)
+        self.cache.get_or_load(2, 'public', b'b', self.loader)
+        self.cache.get_or_load(1, 'public', b'a', self.loader)
+        self.cache.get_or_load(3, 'public', b'c', self.loader)
+
+        self.assertEqual(len(self.cache.entries), 2)
+        self.cache.get_or_load(1, 'public', b'a', self.loader)
+        self.assertEqual(self.loader.call_count, 3)
+        self.cache.get_or_load(2, 'public', b'b', self.loader)
+        self.assertEqual(self.loader.call_count, 4)
+
+    def test_invalidate_drops_every_key_of_the_user(self):
+        self.cache.get_or_load(1, 'public', b'a', self.loader)
+        self.cache.get_or_load(1, 'private', b'b', self.loader)
+        self.cache.get_or_load(2, 'public', b'c', self.loader)
+
+        self.cache.invalidate(1)
+        self.assertEqual([cache_key[0] for cache_key in self.cache.entries], [2])
+
+
+class NoteFormatTests(TestCase):
+    """Notes stay readable by both parties whichever format they were stored in"""
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+        give_keys(self.doctor_patient)
+        self.doctor = self.doctor_patient.doctor
+        self.patient = self.doctor_patient.patient
+
+    def readers(self):
+        return {self.doctor.id: self.doctor.public_key, self.patient.id: self.patient.public_key}
+
+    def legacy_note(self, content):
+        return DoctorNote.objects.create(doctor_patient=self.doctor_patient, content={
+            'doctor': NoteEncryption.encrypt_note(content, self.doctor.public_key),
+            'patient': NoteEncryption.encrypt_note(content, self.patient.public_key),
+        })
+
+    def envelope_note(self, content):
+        return DoctorNote.objects.create(
+            doctor_patient=self.doctor_patient,
+            content=NoteEncryption.encrypt_envelope(content, self.readers())
+        )
+
+    def binary_note(self, content):
+        note = DoctorNote(doctor_patient=self.doctor_patient)
+        note.encrypt_note(content)
+        return note
+
+    def version_3_note(self, content):
+        """Pack a note the way version 3 wrote them, RSA wrapped keys without a suite byte"""
+        data_key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(NONCE_SIZE)
+        return DoctorNote.objects.create(doctor_patient=self.doctor_patient, ciphertext=NoteEncryption.pack_binary(
+            3, 0,
+            {
+                user_id: NoteEncryption.wrap_key_with_suite(data_key, public_key, user_id)
+                for user_id, public_key in self.readers().items()
+            },
+            nonce,
+            AESGCM(data_key).encrypt(nonce, content.encode(), bytes([3, 0]))
+        ))
+
+    def assertReadable(self, note, content):
+        note = DoctorNote.objects.select_related('doctor_patient__doctor', 'doctor_patient__patient').get(id=note.id)
+        self.assertEqual(note.decrypt_note(note.doctor_patient.doctor), content)
+        self.assertEqual(note.decrypt_note(note.doctor_patient.patient), content)
+
+    def test_legacy_note(self):
+        # Notes of this format were written with RSA keys
+        give_keys(self.doctor_patient, 'rsa')
+        self.assertReadable(self.legacy_note('Take amoxicillin daily'), 'Take amoxicillin daily')
+
+    def test_envelope_note(self):
+        note = self.envelope_note('Take amoxicillin daily')
+        self.assertEqual(note.content['version'], 2)
+        self.assertEqual(set(note.content['keys']), {str(self.doctor.id), str(self.patient.id)})
+        self.assertReadable(note, 'Take amoxicillin daily')
+
+    def test_envelope_without_a_key_for_the_reader(self):
+        envelope = NoteEncryption.encrypt_envelope('Take amoxicillin daily', {self.doctor.id: self.doctor.public_key})
+        with self.assertRaises(ValueError):
+            NoteEncryption.decrypt_envelope(envelope, self.patient.id, self.patient.private_key)
+
+    def test_other_users_are_refused(self):
+        other = create_doctor_patient('other-')
+        with self.assertRaises(PermissionError):
+            self.envelope_note('Take amoxicillin daily').decrypt_note(other.doctor)
+
+    def test_binary_note(self):
+        for content in ('Take amoxicillin daily', 'Take amoxicillin daily. ' * 100):
+            with self.subTest(length=len(content)):
+                note = self.binary_note(content)
+                self.assertEqual(bytes(note.ciphertext)[0], BINARY_VERSION)
+                self.assertEqual(note.content, {})
+                self.assertReadable(note, content)
+
+    def test_version_3_note(self):
+        give_keys(self.doctor_patient, 'rsa')
+        note = self.version_3_note('Take amoxicillin daily')
+        self.assertReadable(note, 'Take amoxicillin daily')
+
+        # Rewrapping after a key rotation moves the note to the current version
+        old_private_key = self.doctor.private_key
+        give_keys(self.doctor_patient, 'rsa')
+        note.rewrap_key(self.doctor, old_private_key)
+        self.assertEqual(bytes(note.ciphertext)[0], BINARY_VERSION)
+        self.assertEqual(note.decrypt_note(self.doctor), 'Take amoxicillin daily')
+
+    def test_json_formats_are_upgraded(self):
+        give_keys(self.doctor_patient, 'rsa')
+        for note in (self.legacy_note('Take amoxicillin daily'), self.envelope_note('Take amoxicillin daily')):
+            with self.subTest(format=note.content.get('version', 'legacy')):
+                self.assertTrue(note.upgrade_encryption())
+                self.assertFalse(note.is_legacy_format)
+                self.assertEqual(bytes(note.ciphertext)[0], BINARY_VERSION)
+                self.assertReadable(note, 'Take amoxicillin daily')
+                self.assertFalse(note.upgrade_encryption())
+
+    def test_tampering_is_detected(self):
+        blob = bytearray(self.binary_note('Take amoxicillin daily. ' * 100).ciphertext)
+        self.assertTrue(blob[1] & FLAG_COMPRESSED)
+
+        tampered_tag = bytearray(blob)
+        tampered_tag[-1] ^= 0x01
+        # The flags byte isn't encrypted, but it's authenticated along with the content
+        tampered_header = bytearray(blob)
+        tampered_header[1] ^= FLAG_COMPRESSED
+
+        for tampered in (tampered_tag, tampered_header):
+            with self.assertRaises(ValueError):
+                NoteEncryption.decrypt_binary(bytes(tampered), self.doctor.id, self.doctor.private_key)
+
+    def test_unknown_version_is_refused(self):
+        blob = bytearray(self.binary_note('Take amoxicillin daily').ciphertext)
+        blob[0] = 9
+        with self.assertRaises(ValueError):
+            NoteEncryption.parse_binary(bytes(blob))
+
+    def test_upgrade_command(self):
+        give_keys(self.doctor_patient, 'rsa')
+        legacy = self.legacy_note('Take amoxicillin daily')
+        envelope = self.envelope_note('Walk 30 minutes daily')
+        binary = self.binary_note('Drink water daily')
+        binary_ciphertext = bytes(binary.ciphertext)
+
+        stdout = StringIO()
+        call_command('upgrade_note_encryption', '--dry-run', stdout=stdout)
+        self.assertIn('2 notes use a JSON format', stdout.getvalue())
+
+        stdout = StringIO()
+        call_command('upgrade_note_encryption', '--batch-size', '1', stdout=stdout, stderr=StringIO())
+        self.assertIn('Upgraded 2 notes, 0 failed', stdout.getvalue())
+
+        self.assertFalse(DoctorNote.objects.filter(ciphertext__isnull=True).exists())
+        self.assertReadable(legacy, 'Take amoxicillin daily')
+        self.assertReadable(envelope, 'Walk 30 minutes daily')
+        binary.refresh_from_db()
+        self.assertEqual(bytes(binary.ciphertext), binary_ciphertext)
+
+    def test_upgrade_command_rolls_back_failed_notes_only(self):
+        give_keys(self.doctor_patient, 'rsa')
+        legacy = self.legacy_note('Take amoxicillin daily')
+        broken = self.envelope_note('Walk 30 minutes daily')
+        envelope = self.envelope_note('Drink water daily')
+        upgrade_encryption = DoctorNote.upgrade_encryption
+
+        def fail_half_written(note):
+            if note.pk == broken.pk:
+                DoctorNote.objects.filter(pk=note.pk).update(ciphertext=b'half written')
+                raise RuntimeError('could not write note')
+            return upgrade_encryption(note)
+
+        stdout = StringIO()
+        with mock.patch.object(DoctorNote, 'upgrade_encryption', autospec=True, side_effect=fail_half_written):
+            call_command('upgrade_note_encryption', stdout=stdout, stderr=StringIO())
+        self.assertIn('Upgraded 2 notes, 1 failed', stdout.getvalue())
+
+        broken.refresh_from_db()
+        self.assertIsNone(broken.ciphertext)
+        self.assertReadable(broken, 'Walk 30 minutes daily')
+        self.assertReadable(legacy, 'Take amoxicillin daily')
+        self.assertReadable(envelope, 'Drink water daily')
+
+    @override_settings(NOTE_DECRYPTION_WORKERS=4)
+    def test_pages_are_decrypted_on_the_pool(self):
+        give_keys(self.doctor_patient, 'rsa')
+        contents = ['Take amoxicillin daily', 'Walk 30 minutes daily', 'Drink water daily'] * 3
+        make_note = [self.legacy_note, self.envelope_note, self.binary_note] * 3
+        for create, content in zip(make_note, contents):
+            create(content)
+        notes = list(DoctorNote.objects.order_by('id'))
+
+        threads = set()
+        decrypt = NoteDecryptionService.decrypt
+
+        def record_thread(note, user):
+            threads.add(threading.current_thread().name)
+            return decrypt(note, user)
+
+        with mock.patch.object(NoteDecryptionService, 'decrypt', side_effect=record_thread):
+            decrypted = NoteDecryptionService.decrypt_notes(notes, self.doctor)
+        self.assertEqual(decrypted, [NoteDecryptionService.decrypt(note, self.doctor) for note in notes])
+        self.assertEqual(decrypted, contents)
+        self.assertTrue(all(name.startswith('note-decryption') for name in threads))
+
+    @override_settings(NOTE_DECRYPTION_WORKERS=4)
+    def test_failed_note_does_not_sink_the_page(self):
+        first = self.binary_note('Take amoxicillin daily')
+        broken = self.binary_note('Walk 30 minutes daily')
+        last = self.binary_note('Drink water daily')
+        ciphertext = bytearray(broken.ciphertext)
+        ciphertext[-1] ^= 0x01
+        DoctorNote.objects.filter(id=broken.id).update(ciphertext=bytes(ciphertext))
+
+        notes = DoctorNote.objects.filter(id__in=[first.id, broken.id, last.id]).order_by('id')
+        self.assertEqual(
+            NoteDecryptionService.decrypt_notes(notes, self.patient),
+            ['Take amoxicillin daily', None, 'Drink water daily']
+        )
+
+
+@override_settings(NOTE_COMPRESSION_ENABLED=True, NOTE_COMPRESSION_MIN_BYTES=512, NOTE_COMPRESSION_LEVEL=6)
+class NoteCompressionTests(TestCase):
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+        give_keys(self.doctor_patient)
+        self.doctor = self.doctor_patient.doctor
+        self.readers = {self.doctor.id: self.doctor.public_key}
+
+    def encrypt(self, content):
+        blob = NoteEncryption.encrypt_binary(content, self.readers)
+        return blob, NoteEncryption.parse_binary(blob)[1]
+
+    def test_long_notes_are_compressed(self):
+        content = 'Take amoxicillin 500mg twice daily with food for 10 days. ' * 40
+        blob, flags = self.encrypt(content)
+
+        self.assertTrue(flags & FLAG_COMPRESSED)
+        self.assertLess(len(blob), len(content))
+        self.assertEqual(NoteEncryption.decrypt_binary(blob, self.doctor.id, self.doctor.private_key), content)
+
+    def test_short_notes_are_not_compressed(self):
+        blob, flags = self.encrypt('Take amoxicillin daily')
+        self.assertEqual(flags, 0)
+        self.assertEqual(NoteEncryption.decrypt_binary(blob, self.doctor.id, self.doctor.private_key), 'Take amoxicillin daily')
+
+    def test_incompressible_input_is_stored_as_is(self):
+        plaintext = os.urandom(4096)
+        self.assertEqual(NoteEncryption.compress(plaintext), (plaintext, 0))
+
+    @override_settings(NOTE_COMPRESSION_ENABLED=False)
+    def test_disabled(self):
+        content = 'Take amoxicillin daily. ' * 100
+        blob, flags = self.encrypt(content)
+        self.assertEqual(flags, 0)
+        self.assertEqual(NoteEncryption.decrypt_binary(blob, self.doctor.id, self.doctor.private_key), content)
+
+
+class KeysetPaginationTests(TestCase):
+    ORDERING = ('-created_at', '-id')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user(
+            'doctor@example.com', None, user_type=User.UserType.DOCTOR, email_verified=True
+        )
+        for index in range(7):
+            patient = User.objects.create_user(f'patient{index}@example.com', None, user_type=User.UserType.PATIENT)
+            DoctorPatient.objects.create(doctor=cls.doctor, patient=patient)
+        # Rows created together share a timestamp, the id keeps their order stable
+        now = timezone.now()
+        ids = list(DoctorPatient.objects.order_by('id').values_list('id', flat=True))
+        DoctorPatient.objects.filter(id__in=ids[:2]).update(created_at=now - timedelta(days=1))
+        DoctorPatient.objects.filter(id__in=ids[2:]).update(created_at=now)
+        cls.expected = ids[2:][::-1] + ids[:2][::-1]
+
+    def paginate(self, url='/?page_size=3'):
+        request = Request(APIRequestFactory().get(url))
+        paginator = KeysetPagination(self.ORDERING)
+        rows = paginator.paginate_queryset(DoctorPatient.objects.all(), request)
+        return paginator, [row.id for row in rows]
+
+    def test_cursor_round_trip(self):
+        paginator = KeysetPagination(self.ORDERING)
+        row = DoctorPatient.objects.get(id=self.expected[0])
+
+        cursor = paginator.encode_cursor(row, reverse=True)
+        self.assertEqual(
+            paginator.decode_cursor(DoctorPatient.objects.all(), cursor),
+            ([row.created_at, row.id], True)
+        )
+
+    def test_pages_follow_the_ordering_through_ties(self):
+        paginator, seen = self.paginate()
+        for _ in range(len(self.expected)):
+            if not paginator.get_next_link():
+                break
+            paginator, ids = self.paginate(paginator.get_next_link())
+            seen += ids
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_link(self):
+        first, first_ids = self.paginate()
+        self.assertIsNone(first.get_previous_link())
+        second, _ = self.paginate(first.get_next_link())
+
+        previous, previous_ids = self.paginate(second.get_previous_link())
+        self.assertEqual(previous_ids, first_ids)
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPagination(self.ORDERING)
+
+        def encode(payload):
+            return base64.urlsafe_b64encode(payload.encode()).decode()
+
+        for cursor in (
+            'not a cursor',
+            encode('not json'),
+            encode('{"r":false}'),
+            encode('{"p":[1],"r":false}'),
+            encode('{"p":["yesterday",1],"r":false}'),
+        ):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(NotFound):
+                    paginator.decode_cursor(DoctorPatient.objects.all(), cursor)
+
+    def test_my_patients_newest_first(self):
+        client = APIClient()
+        client.force_authenticate(self.doctor)
+
+        seen = []
+        url = '/api/v1/doctors/my-patients/?pagination=cursor&page_size=3'
+        for _ in range(len(self.expected)):
+            if not url:
+                break
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['data']
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(seen, self.expected)
+
+        response = client.get('/api/v1/doctors/my-patients/', {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PAGINATION_EXACT_COUNT_THRESHOLD=5, PAGINATION_COUNT_CACHE_SECONDS=60)
+@mock.patch('api.pagination.get_redis_client')
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        doctor = User.objects.create_user('doctor@example.com', None, user_type=User.UserType.DOCTOR)
+        for index in range(7):
+            patient = User.objects.create_user(f'patient{index}@example.com', None, user_type=User.UserType.PATIENT)
+            DoctorPatient.objects.create(doctor=doctor, patient=patient)
+        cls.first_four = list(DoctorPatient.objects.order_by('id').values_list('id', flat=True)[:4])
+
+    def paginator(self, queryset=None):
+        return EstimatedCountPaginator(queryset or DoctorPatient.objects.order_by('id'), 3)
+
+    def test_exact_count_below_the_threshold(self, get_redis_client):
+        paginator = self.paginator(DoctorPatient.objects.filter(id__in=self.first_four).order_by('id'))
+        self.assertEqual(paginator.count, 4)
+        self.assertFalse(paginator.count_is_approximate)
+        get_redis_client.assert_not_called()
+
+    def test_count_above_the_threshold_is_cached(self, get_redis_client):
+        redis = get_redis_client.return_value
+        redis.get.return_value = None
+
+        paginator = self.paginator()
+        # Other databases than PostgreSQL fall back to a full count
+        self.assertEqual(paginator.count, 7)
+        self.assertTrue(paginator.count_is_approximate)
+        redis.set.assert_called_once_with(paginator.cache_key(DoctorPatient.objects.order_by()), 7, ex=60)
+
+    def test_cache_hit(self, get_redis_client):
+        redis = get_redis_client.return_value
+        redis.get.return_value = b'1000'
+
+        paginator = self.paginator()
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 1000)
+        self.assertTrue(paginator.count_is_approximate)
+        redis.set.assert_not_called()
+
+    def test_unavailable_cache(self, get_redis_client):
+        get_redis_client.return_value.get.side_effect = RedisError('redis down')
+        get_redis_client.return_value.set.side_effect = RedisError('redis down')
+        self.assertEqual(self.paginator().count, 7)
+
+    def test_pages_past_a_low_estimate(self, get_redis_client):
+        # The cached count is stale, the last page holds rows the estimate doesn't know about
+        get_redis_client.return_value.get.return_value = b'6'
+        paginator = self.paginator()
+
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(len(paginator.page(2)), 3)
+        self.assertEqual(len(paginator.page(3)), 1)
+        self.assertEqual(len(paginator.page(4)), 0)
+        with self.assertRaises(EmptyPage):
+            paginator.page(0)
+        with self.assertRaises(PageNotAnInteger):
+            paginator.page('last')
+
+    def test_pages_past_an_exact_count(self, get_redis_client):
+        paginator = self.paginator(DoctorPatient.objects.filter(id__in=self.first_four).order_by('id'))
+        self.assertEqual(len(paginator.page(2)), 1)
+        with self.assertRaises(EmptyPage):
+            paginator.page(3)
+
+
+@override_settings(LLM_CACHE_ENABLED=True, LLM_CACHE_TTL_SECONDS=3600, LLM_CACHE_MAX_ENTRIES=2)
+class ExtractionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        patcher = mock.patch('api.external.cache.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ExtractionCache('v1')
+
+    def at(self, timestamp):
+        # Only the cache's clock, Redis expires keys by the real one
+        return mock.patch('api.external.cache.time', **{'time.return_value': timestamp})
+
+    def test_hit(self):
+        extraction = {'checklist_items': [{'task': 'Pick up amoxicillin'}], 'action_plans': []}
+        self.cache.set('Take  Amoxicillin daily', extraction)
+
+        # Copies differing in whitespace and case share the entry
+        self.assertEqual(self.cache.get('take amoxicillin DAILY'), extraction)
+        self.assertIsNone(self.cache.get('Take ibuprofen daily'))
+        self.assertIsNone(ExtractionCache('v2').get('Take amoxicillin daily'))
+
+    def test_hit_refreshes_the_entry(self):
+        with self.at(100):
+            self.cache.set('first', {'n': 1})
+        with self.at(200):
+            self.cache.set('second', {'n': 2})
+        with self.at(300):
+            self.cache.get('first')
+        self.assertEqual(self.redis.zscore(self.cache.index_key, self.cache.make_key('first')), 300)
+
+        # The least recently used entry goes, not the oldest one
+        with self.at(400):
+            self.cache.set('third', {'n': 3})
+        self.assertEqual(self.cache.get('first'), {'n': 1})
+        self.assertIsNone(self.cache.get('second'))
+
+    def test_evicts_past_max_entries(self):
+        for index, content in enumerate(('first', 'second', 'third', 'fourth')):
+            with self.at(100 + index):
+                self.cache.set(content, {'n': index})
+
+        self.assertEqual(self.redis.zcard(self.cache.index_key), 2)
+        self.assertIsNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('fourth'), {'n': 3})
+        self.assertFalse(self.redis.exists(self.cache.make_key('first')))
+
+    def test_unavailable_redis_is_a_miss(self):
+        self.server.connected = False
+        self.cache.set('first', {'n': 1})
+        self.assertIsNone(self.cache.get('first'))
+
+
+def llm_extraction(task):
+    return {'checklist_items': [{'task': task}], 'action_plans': []}
+
+
+@override_settings(LLM_ADMISSION_ENABLED=False, LLM_CACHE_ENABLED=False)
+class BatchedExtractionTests(SimpleTestCase):
+    NOTES = ['Buy a thermometer', 'Book a blood test', 'Get a flu shot']
+
+    def setUp(self):
+        self.backend = mock.Mock(model_name='test-model')
+        self.service = LLMService(backend=self.backend)
+
+    def batch_response(self, ids):
+        return json.dumps({'notes': [{'id': note_id, **llm_extraction(f'Task {note_id}')} for note_id in ids]})
+
+    def test_splits_the_batched_response(self):
+        self.backend.generate.return_value = self.batch_response([2, 0, 1])
+
+        results = self.service.process_doctor_notes(self.NOTES)
+
+        self.backend.generate.assert_called_once()
+        prompt = self.backend.generate.call_args.args[0]
+        for index, content in enumerate(self.NOTES):
+            self.assertIn(f'<note id="{index}">\n{content}\n</note>', prompt)
+        self.assertEqual(results, [llm_extraction('Task 0'), llm_extraction('Task 1'), llm_extraction('Task 2')])
+
+    def test_quoted_ids(self):
+        self.backend.generate.return_value = self.batch_response(['0', '1', '2'])
+
+        results = self.service.process_doctor_notes(self.NOTES)
+
+        self.backend.generate.assert_called_once()
+        self.assertEqual(results[1], llm_extraction('Task 1'))
+
+    def test_notes_missing_from_the_response_are_extracted_alone(self):
+        self.backend.generate.side_effect = [
+            self.batch_response([0, 2, 7]),
+            json.dumps(llm_extraction('Alone')),
+        ]
+
+        results = self.service.process_doctor_notes(self.NOTES)
+
+        self.assertEqual(self.backend.generate.call_count, 2)
+        self.assertIn(self.NOTES[1], self.backend.generate.call_args.args[0])
+        self.assertEqual(results, [llm_extraction('Task 0'), llm_extraction('Alone'), llm_extraction('Task 2')])
+
+    def test_unparsable_response_falls_back_to_single_notes(self):
+        self.backend.generate.side_effect = ['Sorry, I cannot help with that'] + [
+            json.dumps(llm_extraction(f'Alone {index}')) for index in range(3)
+        ]
+
+        results = self.service.process_doctor_notes(self.NOTES)
+
+        self.assertEqual(self.backend.generate.call_count, 4)
+        self.assertEqual(results, [llm_extraction(f'Alone {index}') for index in range(3)])
+
+
+@override_settings(LLM_BATCH_ENABLED=True, LLM_BATCH_MAX_SIZE=3, LLM_BATCH_WINDOW_MS=500)
+@mock.patch('api.external.batching.app.send_task')
+class NoteBatcherTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch('api.external.batching.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.doctor_patient = create_doctor_patient()
+        give_keys(self.doctor_patient)
+
+    def create_job(self, content):
+        note = DoctorNote(doctor_patient=self.doctor_patient)
+        note.encrypt_note(content)
+        return NoteJob.objects.create(note=note)
+
+    def test_first_job_of_a_window_schedules_the_flush(self, send_task):
+        NoteBatcher.submit(1)
+        NoteBatcher.submit(2)
+
+        send_task.assert_called_once_with('flush_note_batch', countdown=0.5)
+        self.assertEqual(self.redis.lrange(NoteBatcher.queue_key, 0, -1), [b'1', b'2'])
+
+    def test_full_batch_flushes_straight_away(self, send_task):
+        for job_id in (1, 2, 3):
+            NoteBatcher.submit(job_id)
+        send_task.assert_called_with('flush_note_batch')
+
+    @override_settings(LLM_BATCH_ENABLED=False)
+    def test_disabled(self, send_task):
+        NoteBatcher.submit(1)
+        send_task.assert_called_once_with('process_note_job', args=[1])
+
+    @mock.patch('api.external.services.app.send_task')
+    @mock.patch('apps.doctor.tasks.get_note_extractor')
+    def test_flush(self, get_note_extractor, reminder_send_task, send_task):
+        jobs = [self.create_job(content) for content in ('Buy a thermometer', 'Book a blood test')]
+        for job in jobs:
+            NoteBatcher.submit(job.id)
+        get_note_extractor.return_value.process_doctor_notes.return_value = [
+            llm_extraction('Thermometer'), llm_extraction('Blood test')
+        ]
+
+        self.assertEqual(flush_note_batch(), {'message': 'processed 2 jobs'})
+
+        get_note_extractor.return_value.process_doctor_notes.assert_called_once_with(
+            ['Buy a thermometer', 'Book a blood test']
+        )
+        for job, task in zip(jobs, ('Thermometer', 'Blood test')):
+            job.refresh_from_db()
+            self.assertEqual(job.status, NoteJob.Status.COMPLETED)
+            self.assertEqual(list(job.note.checklist_items.values_list('task', flat=True)), [task])
+        self.assertEqual(self.redis.llen(NoteBatcher.queue_key), 0)
+        self.assertFalse(self.redis.exists(NoteBatcher.flush_key))
+
+    @mock.patch('apps.doctor.tasks.get_note_extractor')
+    def test_unreadable_note_fails_alone(self, get_note_extractor, send_task):
+        readable = self.create_job('Buy a thermometer')
+        unreadable = self.create_job('Book a blood test')
+        DoctorNote.objects.filter(id=unreadable.note_id).update(ciphertext=b'not a note')
+        for job in (readable, unreadable):
+            NoteBatcher.submit(job.id)
+        get_note_extractor.return_value.process_doctor_notes.return_value = [llm_extraction('Thermometer')]
+
+        flush_note_batch()
+
+        get_note_extractor.return_value.process_doctor_notes.assert_called_once_with(['Buy a thermometer'])
+        readable.refresh_from_db()
+        unreadable.refresh_from_db()
+        self.assertEqual(readable.status, NoteJob.Status.COMPLETED)
+        self.assertEqual(unreadable.status, NoteJob.Status.FAILED)
+
+
+class IncrementalExtractionParserTests(SimpleTestCase):
+    ITEMS = [
+        ('checklist_items', {'task': 'Buy a "digital" thermometer {not a brace}'}),
+        ('checklist_items', {'task': 'Back\\slash, caf\u00e9 and ] bracket'}),
+        ('action_plans', {
+            'action': 'Take amoxicillin',
+            'frequency': 'DAILY',
+            'duration_days': 10,
+            'custom_schedule': {'times': ['08:00', '20:00']},
+        }),
+    ]
+
+    def document(self):
+        sections = {'checklist_items': [], 'action_plans': []}
+        for section, item in self.ITEMS:
+            sections[section].append(item)
+        # Models wrap the JSON in a code fence
+        return '```json\n' + json.dumps({'summary': 'A {tricky} "note"', **sections}, indent=2) + '\n```'
+
+    def parse(self, text, chunk_size):
+        parser = IncrementalExtractionParser()
+        items = []
+        for start in range(0, len(text), chunk_size):
+            items += parser.feed(text[start:start + chunk_size])
+        return parser, items
+
+    def test_any_chunking_gives_the_same_items(self):
+        text = self.document()
+        for chunk_size in (1, 2, 3, 7, 16, len(text)):
+            with self.subTest(chunk_size=chunk_size):
+                parser, items = self.parse(text, chunk_size)
+                self.assertTrue(parser.complete)
+                self.assertEqual(items, self.ITEMS)
+
+    def test_items_are_emitted_as_soon_as_they_close(self):
+        text = self.document()
+        first_item_end = text.index('}', text.index('not a brace}') + len('not a brace}')) + 1
+        parser = IncrementalExtractionParser()
+
+        self.assertEqual(parser.feed(text[:first_item_end - 1]), [])
+        self.assertEqual(parser.feed(text[first_item_end - 1:first_item_end]), [self.ITEMS[0]])
+
+    def test_truncated_response(self):
+        text = self.document()
+        parser, items = self.parse(text[:text.index('custom_schedule')], 5)
+        self.assertFalse(parser.complete)
+        self.assertEqual(items, self.ITEMS[:2])
+
+
+@override_settings(LLM_ADMISSION_ENABLED=False, LLM_CACHE_ENABLED=False)
+class StreamDoctorNoteTests(SimpleTestCase):
+    def test_items_with_stamped_dates(self):
+        backend = mock.Mock(model_name='test-model')
+        response = json.dumps({
+            'checklist_items': [{'task': 'Buy a thermometer'}],
+            'action_plans': [{'action': 'Take amoxicillin', 'frequency': 'DAILY', 'duration_days': 10}],
+        })
+        backend.stream.return_value = iter([response[start:start + 4] for start in range(0, len(response), 4)])
+
+        items = list(LLMService(backend=backend).stream_doctor_note('Take amoxicillin'))
+
+        today = timezone.now().date()
+        self.assertEqual([section for section, _ in items], ['checklist_items', 'action_plans'])
+        self.assertEqual(items[1][1]['start_date'], today.isoformat())
+        self.assertEqual(items[1][1]['end_date'], (today + timedelta(days=10)).isoformat())
+
+
+@mock.patch('api.external.services.app.send_task')
+@mock.patch('api.views.doctor.get_note_extractor')
+class CreateNoteStreamViewTests(TestCase):
+    def setUp(self):
+        self.doctor_patient = create_doctor_patient()
+        self.doctor = self.doctor_patient.doctor
+        self.doctor.email_verified = True
+        self.doctor.save(update_fields=['email_verified'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def post(self, content='Take amoxicillin daily for 10 days'):
+        return self.client.post(
+            '/api/v1/notes/create/stream/',
+            {'doctor_patient_id': self.doctor_patient.id, 'content': content},
+            HTTP_ACCEPT='text/event-stream'
+        )
+
+    @staticmethod
+    def events(response):
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+        return events
+
+    def test_events(self, get_note_extractor, send_task):
+        plan = extraction()['action_plans'][0]
+        get_note_extractor.return_value.stream_doctor_note.return_value = iter([
+            ('checklist_items', {'task': 'Pick up amoxicillin'}),
+            ('action_plans', plan),
+        ])
+
+        response = self.post()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.events(response)
+        self.assertEqual([event for event, _ in events], ['checklist_item', 'action_plan', 'note', 'done'])
+        self.assertEqual(events[1][1], plan)
+        note = DoctorNote.objects.get(id=events[2][1]['id'])
+        # Keys were generated with the note
+        self.doctor.refresh_from_db()
+        self.assertEqual(note.decrypt_note(self.doctor), 'Take amoxicillin daily for 10 days')
+        self.assertEqual(note.action_plans.count(), 1)
+
+    def test_error_while_streaming(self, get_note_extractor, send_task):
+        def stream(content):
+            yield 'action_plans', extraction()['action_plans'][0]
+            raise RuntimeError('connection reset')
+
+        get_note_extractor.return_value.stream_doctor_note.side_effect = stream
+
+        events = self.events(self.post())
+
+        self.assertEqual([event for event, _ in events], ['action_plan', 'error', 'done'])
+        self.assertEqual(events[1][1], {'detail': 'connection reset'})
+        self.assertFalse(DoctorNote.objects.exists())
+
+    def test_missing_content(self, get_note_extractor, send_task):
+        response = self.post(content='')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+        get_note_extractor.assert_not_called()
+
+
+class FakeRedisMixin:
+    redis_client_path = 'api.external.admission.get_redis_client'
+
+    def setUp(self):
+        super().setUp()
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        patcher = mock.patch(self.redis_client_path, return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ConcurrencyLimiterTests(FakeRedisMixin, SimpleTestCase):
+    def test_rejects_past_the_limit_without_a_queue(self):
+        limiter = ConcurrencyLimiter(limit=2, max_queue=0, wait_timeout=1)
+        limiter.acquire()
+        limiter.acquire()
+
+        with self.assertRaisesMessage(LLMUnavailable, 'Too many requests'):
+            limiter.acquire()
+        self.assertEqual(self.redis.zcard(limiter.holders_key), 2)
+        self.assertEqual(self.redis.zcard(limiter.waiters_key), 0)
+
+    def test_rejects_past_the_queue_limit(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, wait_timeout=1)
+        limiter.acquire()
+        # Another process is already waiting
+        self.redis.zadd(limiter.waiters_key, {'other': time.time()})
+
+        with self.assertRaisesMessage(LLMUnavailable, 'Too many requests'):
+            limiter.acquire()
+
+    def test_times_out_in_the_queue(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, wait_timeout=0.2)
+        limiter.acquire()
+
+        with self.assertRaisesMessage(LLMUnavailable, 'Timed out'):
+            limiter.acquire()
+        self.assertEqual(self.redis.zcard(limiter.waiters_key), 0)
+
+    def test_released_slot_is_acquired_again(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=0, wait_timeout=0)
+        limiter.release(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+
+    def test_waiter_gets_the_slot_once_released(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, wait_timeout=5)
+        token = limiter.acquire()
+        timer = threading.Timer(0.2, limiter.release, args=[token])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertNotEqual(limiter.acquire(), token)
+
+    def test_expired_lease_frees_its_slot(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=0, wait_timeout=0, lease_seconds=60)
+        self.redis.zadd(limiter.holders_key, {'crashed': time.time() - 120})
+        self.assertTrue(limiter.acquire())
+
+    def test_unavailable_redis_does_not_block_calls(self):
+        self.server.connected = False
+        with ConcurrencyLimiter(limit=1).slot():
+            pass
+
+
+@override_settings(
+    LLM_BREAKER_WINDOW_SECONDS=60, LLM_BREAKER_MIN_CALLS=4, LLM_BREAKER_ERROR_RATE=0.5,
+    LLM_BREAKER_SLOW_CALL_SECONDS=1, LLM_BREAKER_SLOW_CALL_RATE=0.5, LLM_BREAKER_OPEN_SECONDS=30,
+    LLM_REQUEST_TIMEOUT_SECONDS=30, LLM_LEASE_SECONDS=120
+)
+class CircuitBreakerTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Calls are counted in fixed windows, keep every call of a test in the same one
+        patcher = mock.patch('time.time', return_value=1_000_020.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker()
+
+    def record(self, *outcomes):
+        for success, duration in outcomes:
+            self.breaker.record(success, duration)
+
+    def close_after_open_period(self):
+        self.redis.delete(self.breaker.open_key)
+
+    def test_trips_on_the_error_rate(self):
+        self.record((True, 0.1), (True, 0.1), (False, 0.1))
+        self.assertTrue(self.breaker.allow())
+
+        self.record((False, 0.1))
+        self.assertFalse(self.breaker.allow())
+
+    def test_trips_on_slow_calls(self):
+        self.record((True, 0.1), (True, 0.1), (True, 2), (True, 2))
+        self.assertFalse(self.breaker.allow())
+
+    def test_needs_enough_calls(self):
+        self.record((False, 0.1), (False, 0.1), (False, 0.1))
+        self.assertTrue(self.breaker.allow())
+
+    def test_single_half_open_probe(self):
+        self.record(*[(False, 0.1)] * 4)
+        self.close_after_open_period()
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.record((True, 0.1))
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.redis.exists(self.breaker.half_open_key))
+
+    def test_failed_probe_opens_again(self):
+        self.record(*[(False, 0.1)] * 4)
+        self.close_after_open_period()
+        self.assertTrue(self.breaker.allow())
+
+        self.record((False, 0.1))
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.redis.exists(self.breaker.open_key))
+
+    def test_half_open_state_expires(self):
+        self.record(*[(False, 0.1)] * 4)
+        self.assertEqual(self.redis.ttl(self.breaker.half_open_key), 30 + 120)
+
+
+@override_settings(
+    LLM_ADMISSION_ENABLED=True, LLM_MAX_CONCURRENCY=2, LLM_MAX_QUEUE=0, LLM_QUEUE_TIMEOUT_SECONDS=0,
+    LLM_BREAKER_WINDOW_SECONDS=60, LLM_BREAKER_MIN_CALLS=1, LLM_BREAKER_ERROR_RATE=0.5,
+    LLM_BREAKER_OPEN_SECONDS=30
+)
+class LLMGuardTests(FakeRedisMixin, SimpleTestCase):
+    def test_call_holds_a_slot(self):
+        guard = LLMGuard()
+
+        def generate(prompt):
+            self.assertEqual(self.redis.zcard(guard.limiter.holders_key), 1)
+            return f'response to {prompt}'
+
+        self.assertEqual(guard.call(generate, 'prompt'), 'response to prompt')
+        self.assertEqual(self.redis.zcard(guard.limiter.holders_key), 0)
+
+    def test_open_circuit_fails_fast(self):
+        guard = LLMGuard()
+        with self.assertRaises(ConnectionError):
+            guard.call(mock.Mock(side_effect=ConnectionError('LLM down')), 'prompt')
+
+        backend_call = mock.Mock()
+        with self.assertRaises(LLMUnavailable):
+            guard.call(backend_call, 'prompt')
+        backend_call.assert_not_called()
+        self.assertEqual(self.redis.zcard(guard.limiter.holders_key), 0)
+
+
+@override_settings(RULE_EXTRACTOR_ENABLED=True, RULE_EXTRACTOR_MIN_CONFIDENCE=0.85)
+class DegradedExtractionTests(SimpleTestCase):
+    NOTE = 'Take ibuprofen daily for 5 days. Stop taking aspirin daily.'
+
+    def setUp(self):
+        self.llm_service = mock.Mock()
+        self.llm_service.process_doctor_note.side_effect = LLMUnavailable('The AI service is temporarily unavailable')
+        self.llm_service.process_doctor_notes.side_effect = LLMUnavailable('The AI service is temporarily unavailable')
+        self.extractor = NoteExtractor(self.llm_service)
+
+    @override_settings(LLM_DEGRADE_TO_RULES=True)
+    def test_falls_back_to_the_rules(self):
+        result = self.extractor.process_doctor_note(self.NOTE)
+
+        self.llm_service.process_doctor_note.assert_called_once()
+        self.assertEqual([plan['action'] for plan in result['action_plans']], ['Take ibuprofen daily for 5 days'])
+        self.assertIn('start_date', result['action_plans'][0])
+
+        results = self.extractor.process_doctor_notes([self.NOTE])
+        self.assertEqual(results[0]['action_plans'][0]['duration_days'], 5)
+
+    @override_settings(LLM_DEGRADE_TO_RULES=False)
+    def test_fallback_disabled(self):
+        with self.assertRaises(LLMUnavailable):
+            self.extractor.process_doctor_note(self.NOTE)
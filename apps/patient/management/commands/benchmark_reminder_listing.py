@@ -0,0 +1,92 @@
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.doctor.models import DoctorPatient, DoctorNote
+from apps.patient.models import ActionPlan, Reminder
+from apps.user.models import User
+from api.serilizers.patient import ReminderSerializer, FlatReminderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare queries per page and serialization time of the reminder listing representations. '
+        'Test data is created in a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[10, 50], help='Page sizes to measure')
+        parser.add_argument('--plans', type=int, default=10, help='Action plans the reminders are spread over')
+        parser.add_argument('--iterations', type=int, default=20, help='Pages serialized per measurement')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            doctor = self.seed(options['plans'], max(options['page_sizes']))
+            reminders = Reminder.objects.filter(doctor=doctor).order_by('scheduled_for', 'id')
+
+            paths = {
+                'nested': lambda page_size: ReminderSerializer(reminders[:page_size], many=True).data,
+                'nested+related': lambda page_size: ReminderSerializer(
+                    reminders.select_related('action_plan', 'patient')[:page_size], many=True
+                ).data,
+                'flat': lambda page_size: FlatReminderSerializer(
+                    FlatReminderSerializer.select(reminders)[:page_size], many=True
+                ).data,
+            }
+
+            self.stdout.write(f"{'path':<16} {'page size':>10} {'queries':>8} {'ms/page':>9}")
+            for page_size in options['page_sizes']:
+                for name, serialize in paths.items():
+                    with CaptureQueriesContext(connection) as queries:
+                        serialize(page_size)
+
+                    started = time.perf_counter()
+                    for _ in range(options['iterations']):
+                        serialize(page_size)
+                    elapsed = (time.perf_counter() - started) / options['iterations']
+
+                    self.stdout.write(
+                        f"{name:<16} {page_size:>10} {len(queries):>8} {elapsed * 1000:>9.2f}"
+                    )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(plans, reminders_per_plan):
+        suffix = uuid.uuid4().hex[:8]
+        doctor = User.objects.create_user(
+            f'benchmark-doctor-{suffix}@example.com', None, user_type=User.UserType.DOCTOR
+        )
+        now = timezone.now()
+        for index in range(plans):
+            patient = User.objects.create_user(
+                f'benchmark-patient-{suffix}-{index}@example.com', None, user_type=User.UserType.PATIENT
+            )
+            note = DoctorNote.objects.create(
+                doctor_patient=DoctorPatient.objects.create(doctor=doctor, patient=patient)
+            )
+            plan = ActionPlan.objects.create(
+                note=note,
+                patient=patient,
+                action=f'Benchmark action {index}',
+                start_date=now.date(),
+                end_date=now.date() + timedelta(days=reminders_per_plan),
+                duration_days=reminders_per_plan
+            )
+            Reminder.objects.bulk_create([
+                Reminder(
+                    action_plan=plan,
+                    patient=patient,
+                    doctor_patient_id=plan.doctor_patient_id,
+                    doctor_id=plan.doctor_id,
+                    title=plan.action,
+                    description=f'Day {day + 1}',
+                    scheduled_for=now + timedelta(days=day, minutes=index),
+                    sequence_number=day + 1
+                )
+                for day in range(reminders_per_plan)
+            ])
+        return doctor
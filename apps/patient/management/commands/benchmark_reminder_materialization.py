@@ -0,0 +1,87 @@
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.doctor.models import DoctorPatient, DoctorNote
+from apps.patient.models import ActionPlan
+from apps.user.models import User
+from api.external.services import ReminderService
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare creating every reminder of a plan row by row with ReminderService, which bulk inserts "
+        'the reminders of the first REMINDER_WINDOW_OCCURRENCES intervals, and with a window covering the whole plan. '
+        'Test data is created in a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--durations', type=int, nargs='+', default=[7, 30, 365], help='Plan lengths in days')
+        parser.add_argument('--iterations', type=int, default=5, help='Plans scheduled per measurement')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            suffix = uuid.uuid4().hex[:8]
+            doctor_patient = DoctorPatient.objects.create(
+                doctor=User.objects.create_user(
+                    f'benchmark-doctor-{suffix}@example.com', None, user_type=User.UserType.DOCTOR
+                ),
+                patient=User.objects.create_user(
+                    f'benchmark-patient-{suffix}@example.com', None, user_type=User.UserType.PATIENT
+                )
+            )
+            note = DoctorNote.objects.create(doctor_patient=doctor_patient)
+
+            self.stdout.write(f"{'path':<10} {'days':>6} {'queries':>8} {'ms/plan':>9} {'rows/plan':>10}")
+            for days in options['durations']:
+                for name, schedule in (
+                    ('per-row', self.create_per_row),
+                    ('window', ReminderService.create_schedule_plan_reminders),
+                    ('full', self.create_full),
+                ):
+                    queries = elapsed = rows = 0
+                    for _ in range(options['iterations']):
+                        plan = ActionPlan.objects.create(
+                            note=note,
+                            patient=doctor_patient.patient,
+                            action=f'Benchmark {days} days',
+                            start_date=timezone.now().date(),
+                            end_date=timezone.now().date() + timedelta(days=days),
+                            duration_days=days
+                        )
+                        with CaptureQueriesContext(connection) as captured:
+                            started = time.perf_counter()
+                            schedule(plan)
+                            elapsed += time.perf_counter() - started
+                        queries += len(captured)
+                        rows += plan.reminders.count()
+
+                    self.stdout.write(
+                        f"{name:<10} {days:>6} {queries // options['iterations']:>8} "
+                        f"{elapsed / options['iterations'] * 1000:>9.2f} {rows // options['iterations']:>10}"
+                    )
+
+            # Nothing is dispatched, on_commit callbacks are dropped with the rollback
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def create_full(action_plan):
+        """ReminderService with a window as long as the plan, every reminder in one bulk INSERT"""
+        with override_settings(REMINDER_WINDOW_OCCURRENCES=action_plan.duration_days):
+            return ReminderService.create_schedule_plan_reminders(action_plan)
+
+    @staticmethod
+    def create_per_row(action_plan):
+        """The first implementation: one INSERT per occurrence, then re-save and re-read the plan"""
+        action_plan.patient.reminders.filter(completed=False).update(is_active=False)
+        action_plan.patient.action_plans.filter(is_active=True).update(is_active=False)
+        action_plan.first_occurrence_at = timezone.now()
+        for reminder in ReminderService.build_schedule(action_plan, 0, action_plan.duration_days):
+            reminder.save()
+        action_plan.is_active = True
+        action_plan.save()
+        return action_plan.reminders.first()
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0005_cursor_pagination_indexes'),
+        ('patient', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='actionplan',
+            index=models.Index(fields=['created_at', 'id'], name='actionplan_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reminder',
+            index=models.Index(fields=['scheduled_for', 'id'], name='reminder_scheduled_id_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0005_cursor_pagination_indexes'),
+        ('patient', '0003_cursor_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actionplan',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prescribed_action_plans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='actionplan',
+            name='doctor_patient',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='action_plans', to='doctor.doctorpatient'),
+        ),
+        migrations.AddField(
+            model_name='reminder',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prescribed_reminders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='reminder',
+            name='doctor_patient',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='doctor.doctorpatient'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def backfill(model, source_model, source_field, doctor_field, using):
+    """
+    Copy doctor_patient and doctor from the source row, one primary key
+    range per transaction so row locks stay short while the app is running.
+    """
+    source = source_model.objects.using(using).filter(pk=OuterRef(source_field))
+    rows = model.objects.using(using).filter(doctor_patient__isnull=True)
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic(using=using):
+            model.objects.using(using).filter(pk__gte=batch[0], pk__lte=batch[-1], doctor_patient__isnull=True).update(
+                doctor_patient=Subquery(source.values('doctor_patient_id')[:1]),
+                doctor=Subquery(source.values(doctor_field)[:1]),
+            )
+        last_pk = batch[-1]
+
+
+def forwards(apps, schema_editor):
+    using = schema_editor.connection.alias
+    # Action plans first, reminders copy from them
+    backfill(
+        apps.get_model('patient', 'ActionPlan'), apps.get_model('doctor', 'DoctorNote'),
+        'note_id', 'doctor_patient__doctor_id', using
+    )
+    backfill(
+        apps.get_model('patient', 'Reminder'), apps.get_model('patient', 'ActionPlan'),
+        'action_plan_id', 'doctor_id', using
+    )
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('doctor', '0005_cursor_pagination_indexes'),
+        ('patient', '0004_denormalized_doctor'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
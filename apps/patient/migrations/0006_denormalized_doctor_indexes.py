@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:14
+
+from django.db import migrations, models
+from api.utils.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # Built without locking writes to the tables, CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('patient', '0005_backfill_denormalized_doctor'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='actionplan',
+            index=models.Index(fields=['doctor', 'created_at', 'id'], name='actionplan_doctor_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='actionplan',
+            index=models.Index(fields=['doctor_patient', 'created_at', 'id'], name='actionplan_dp_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='reminder',
+            index=models.Index(fields=['doctor', 'scheduled_for', 'id'], name='reminder_doctor_scheduled_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='reminder',
+            index=models.Index(fields=['doctor_patient', 'scheduled_for', 'id'], name='reminder_dp_scheduled_idx'),
+        ),
+    ]
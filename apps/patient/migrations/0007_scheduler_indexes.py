@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from api.utils.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # Built without locking writes to reminders, CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('doctor', '0005_cursor_pagination_indexes'),
+        ('patient', '0006_denormalized_doctor_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='reminder',
+            index=models.Index(fields=['action_plan', 'sequence_number', 'scheduled_for'], name='reminder_plan_sequence_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='reminder',
+            index=models.Index(condition=models.Q(('completed', False), ('is_active', True)), fields=['scheduled_for'], name='reminder_due_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='reminder',
+            index=models.Index(condition=models.Q(('completed', False), ('is_active', True)), fields=['action_plan', 'sequence_number'], name='reminder_plan_pending_idx'),
+        ),
+        # Only dropped once the index that replaces it exists
+        migrations.AlterField(
+            model_name='reminder',
+            name='action_plan',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='patient.actionplan'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:20
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0007_scheduler_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actionplan',
+            name='first_occurrence_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='actionplan',
+            name='materialized_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='actionplan',
+            name='schedule_shift',
+            field=models.DurationField(default=datetime.timedelta),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+TASK_NAME = 'Extend reminder windows'
+
+
+def schedule(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    # Daily plans keep REMINDER_WINDOW_OCCURRENCES days ahead, hourly runs leave plenty of margin
+    every_hour, _ = IntervalSchedule.objects.get_or_create(every=1, period='hours')
+    PeriodicTask.objects.update_or_create(
+        name=TASK_NAME,
+        defaults={'task': 'extend_reminder_windows', 'interval': every_hour, 'queue': 'Reminder', 'enabled': True},
+    )
+
+
+def unschedule(apps, schema_editor):
+    apps.get_model('django_celery_beat', 'PeriodicTask').objects.filter(name=TASK_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0008_lazy_reminder_schedule'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule, unschedule),
+    ]
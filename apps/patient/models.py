@@ -1,5 +1,6 @@
+from datetime import timedelta
 from django.db import models
-from apps.doctor.models import DoctorNote
+from apps.doctor.models import DoctorNote, DoctorPatient
 from apps.user.models import User
 
 # Create your models here.
@@ -20,6 +21,21 @@ class ActionPlan(models.Model):
         on_delete=models.CASCADE,
         related_name='action_plans'
     )
+    # Copied from the note so doctor queries don't join through it, filled in on save
+    doctor_patient = models.ForeignKey(
+        DoctorPatient,
+        on_delete=models.CASCADE,
+        related_name='action_plans',
+        null=True,
+        db_index=False
+    )
+    doctor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='prescribed_action_plans',
+        null=True,
+        db_index=False
+    )
     action = models.CharField(max_length=255)
     frequency = models.CharField(
         max_length=10,
@@ -31,25 +47,93 @@ class ActionPlan(models.Model):
     custom_schedule = models.JSONField(null=True, blank=True)
     duration_days = models.IntegerField(default=0, blank=True)
     is_active = models.BooleanField(default=True)
+    # Schedule rule: occurrence i is at first_occurrence_at + i intervals + schedule_shift.
+    # Only the first materialized_count occurrences have a Reminder row, null for
+    # plans whose reminders were all created up front.
+    first_occurrence_at = models.DateTimeField(null=True, blank=True)
+    schedule_shift = models.DurationField(default=timedelta)
+    materialized_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    INTERVALS = {
+        Frequency.DAILY: timedelta(days=1),
+        Frequency.WEEKLY: timedelta(weeks=1),
+        Frequency.MONTHLY: timedelta(days=30),
+    }
+
     class Meta:
         ordering = ['start_date', 'created_at']
+        indexes = [
+            # Cursor pagination
+            models.Index(fields=['created_at', 'id'], name='actionplan_created_id_idx'),
+            # Doctor and relationship listings, also cover the foreign keys
+            models.Index(fields=['doctor', 'created_at', 'id'], name='actionplan_doctor_created_idx'),
+            models.Index(fields=['doctor_patient', 'created_at', 'id'], name='actionplan_dp_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.action} ({self.frequency})"
 
+    def save(self, *args, **kwargs):
+        if self.doctor_patient_id is None:
+            self.doctor_patient = self.note.doctor_patient
+            self.doctor_id = self.doctor_patient.doctor_id
+        super().save(*args, **kwargs)
+
+    @property
+    def interval(self):
+        """Time between occurrences, None for custom schedules"""
+        return self.INTERVALS.get(self.frequency)
+
+    @property
+    def is_scheduled_lazily(self):
+        return self.first_occurrence_at is not None and self.interval is not None
+
+    def occurrence_at(self, index):
+        """Scheduled time of the occurrence with the zero-based index"""
+        return self.first_occurrence_at + self.interval * index + self.schedule_shift
+
+    def occurrences_before(self, until):
+        """How many occurrences are scheduled before `until`"""
+        elapsed = until - self.first_occurrence_at - self.schedule_shift
+        if elapsed < timedelta(0):
+            return 0
+        return min(self.duration_days, elapsed // self.interval + 1)
+
+    def upcoming_occurrences(self, limit):
+        """(sequence_number, scheduled_for) of the next occurrences that have no Reminder row yet"""
+        if not self.is_active or not self.is_scheduled_lazily:
+            return []
+        stop = min(self.duration_days, self.materialized_count + limit)
+        return [(index + 1, self.occurrence_at(index)) for index in range(self.materialized_count, stop)]
+
 class Reminder(models.Model):
     action_plan = models.ForeignKey(
         'ActionPlan',
         on_delete=models.CASCADE,
-        related_name='reminders'
+        related_name='reminders',
+        db_index=False
     )
     patient = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='reminders'
     )
+    # Copied from the action plan, filled in on save
+    doctor_patient = models.ForeignKey(
+        DoctorPatient,
+        on_delete=models.CASCADE,
+        related_name='reminders',
+        null=True,
+        db_index=False
+    )
+    doctor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='prescribed_reminders',
+        null=True,
+        db_index=False
+    )
     title = models.CharField(max_length=200)
     description = models.TextField()
     scheduled_for = models.DateTimeField()
@@ -61,6 +145,32 @@ class Reminder(models.Model):
 
     class Meta:
         ordering = ['sequence_number', 'scheduled_for']
+        indexes = [
+            # Cursor pagination
+            models.Index(fields=['scheduled_for', 'id'], name='reminder_scheduled_id_idx'),
+            # Doctor and relationship listings, also cover the foreign keys
+            models.Index(fields=['doctor', 'scheduled_for', 'id'], name='reminder_doctor_scheduled_idx'),
+            models.Index(fields=['doctor_patient', 'scheduled_for', 'id'], name='reminder_dp_scheduled_idx'),
+            # A plan's reminders in the model ordering, also covers the action_plan foreign key
+            models.Index(fields=['action_plan', 'sequence_number', 'scheduled_for'], name='reminder_plan_sequence_idx'),
+            # Only pending reminders are scheduled, these stay small as reminders complete
+            models.Index(
+                fields=['scheduled_for'],
+                condition=models.Q(completed=False, is_active=True),
+                name='reminder_due_idx'
+            ),
+            models.Index(
+                fields=['action_plan', 'sequence_number'],
+                condition=models.Q(completed=False, is_active=True),
+                name='reminder_plan_pending_idx'
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.title} - Day {self.sequence_number}"
\ No newline at end of file
+        return f"{self.title} - Day {self.sequence_number}"
+
+    def save(self, *args, **kwargs):
+        if self.doctor_patient_id is None:
+            self.doctor_patient_id = self.action_plan.doctor_patient_id
+            self.doctor_id = self.action_plan.doctor_id
+        super().save(*args, **kwargs)
\ No newline at end of file
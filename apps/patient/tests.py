@@ -1,3 +1,338 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
+from rest_framework.test import APIClient
+from api.external.services import ReminderService
+from api.serilizers.patient import ActionPlanScheduleSerializer
+from apps.doctor.models import DoctorPatient, DoctorNote
+from apps.patient.models import ActionPlan, Reminder
+from apps.user.models import User
+from apps.user.tasks import extend_reminder_windows
 
-# Create your tests here.
+
+class ReminderSchedulerIndexTests(TestCase):
+    """The reminder scheduler's queries are answered from their indexes"""
+    PLANS = 20
+    REMINDERS_PER_PLAN = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        doctor = User.objects.create_user('doctor@example.com', None, user_type=User.UserType.DOCTOR)
+        now = timezone.now()
+        for index in range(cls.PLANS):
+            patient = User.objects.create_user(
+                f'patient{index}@example.com', None, user_type=User.UserType.PATIENT
+            )
+            note = DoctorNote.objects.create(
+                doctor_patient=DoctorPatient.objects.create(doctor=doctor, patient=patient)
+            )
+            plan = ActionPlan.objects.create(
+                note=note,
+                patient=patient,
+                action=f'Action {index}',
+                start_date=now.date(),
+                end_date=now.date() + timedelta(days=cls.REMINDERS_PER_PLAN),
+                duration_days=cls.REMINDERS_PER_PLAN
+            )
+            # Most reminders are done or cancelled, as in a long running deployment
+            Reminder.objects.bulk_create([
+                Reminder(
+                    action_plan=plan,
+                    patient=patient,
+                    doctor_patient_id=plan.doctor_patient_id,
+                    doctor_id=plan.doctor_id,
+                    title=plan.action,
+                    description=plan.action,
+                    scheduled_for=now + timedelta(days=day - cls.REMINDERS_PER_PLAN // 2),
+                    completed=day < cls.REMINDERS_PER_PLAN // 2,
+                    is_active=index % 4 == 0,
+                    sequence_number=day + 1
+                )
+                for day in range(cls.REMINDERS_PER_PLAN)
+            ])
+        cls.plan = plan
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # The seeded table is small enough that a sequential scan would win, ask for the index plan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f"Expected {index_name} in the plan:\n{plan}")
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_due_reminders(self):
+        self.assertUsesIndex(
+            Reminder.objects.filter(completed=False, is_active=True, scheduled_for__lte=timezone.now()),
+            'reminder_due_idx'
+        )
+
+    def test_next_pending_reminder(self):
+        self.assertUsesIndex(
+            Reminder.objects.filter(
+                action_plan=self.plan,
+                completed=False,
+                is_active=True,
+                sequence_number__gt=3
+            ).order_by('sequence_number'),
+            'reminder_plan_pending_idx'
+        )
+
+    def test_last_reminder_of_plan(self):
+        self.assertUsesIndex(
+            Reminder.objects.filter(action_plan=self.plan).order_by('-sequence_number'),
+            'reminder_plan_sequence_idx'
+        )
+
+    def test_plan_reminders_in_model_ordering(self):
+        self.assertUsesIndex(self.plan.reminders.all(), 'reminder_plan_sequence_idx')
+
+
+@override_settings(REMINDER_WINDOW_OCCURRENCES=3)
+@mock.patch('api.external.services.app.send_task')
+class LazyReminderScheduleTests(TestCase):
+    """Plans only keep the next REMINDER_WINDOW_OCCURRENCES intervals as reminders"""
+    START = timezone.make_aware(datetime(2026, 3, 2, 9, 0))
+
+    def setUp(self):
+        doctor = User.objects.create_user('doctor@example.com', None, user_type=User.UserType.DOCTOR)
+        self.patient = User.objects.create_user('patient@example.com', None, user_type=User.UserType.PATIENT)
+        self.note = DoctorNote.objects.create(
+            doctor_patient=DoctorPatient.objects.create(doctor=doctor, patient=self.patient)
+        )
+        self.plan = ActionPlan.objects.create(
+            note=self.note,
+            patient=self.patient,
+            action='Take amoxicillin',
+            frequency=ActionPlan.Frequency.DAILY,
+            start_date=self.START.date(),
+            end_date=self.START.date() + timedelta(days=10),
+            duration_days=10,
+        )
+
+    def start_schedule(self):
+        self.plan.first_occurrence_at = self.START
+        self.plan.save(update_fields=['first_occurrence_at'])
+        return ReminderService.extend_schedule(self.plan, self.START)
+
+    def reminders(self):
+        return list(self.plan.reminders.order_by('sequence_number'))
+
+    def assertFollowsSchedule(self, reminders):
+        self.plan.refresh_from_db()
+        for reminder in reminders:
+            self.assertEqual(reminder.scheduled_for, self.plan.occurrence_at(reminder.sequence_number - 1))
+
+    def test_new_plan_stores_the_start_of_its_schedule(self, send_task):
+        self.plan.start_date = timezone.now().date()
+        with self.captureOnCommitCallbacks(execute=True):
+            created = ReminderService.create_schedule_plan_reminders(self.plan)
+
+        self.plan.refresh_from_db()
+        self.assertTrue(self.plan.is_scheduled_lazily)
+        self.assertLess(len(created), self.plan.duration_days)
+        self.assertEqual(self.plan.materialized_count, len(created))
+        self.assertEqual([reminder.sequence_number for reminder in self.reminders()], list(range(1, len(created) + 1)))
+        send_task.assert_called_once_with('send_reminder_email', args=[created[0].id], eta=created[0].scheduled_for)
+
+    def test_full_schedule_is_bulk_created(self, send_task):
+        queries = {}
+        for days in (10, 60):
+            self.plan.duration_days = days
+            self.plan.end_date = self.START.date() + timedelta(days=days)
+            self.plan.save(update_fields=['duration_days', 'end_date'])
+            Reminder.objects.filter(action_plan=self.plan).delete()
+            ActionPlan.objects.filter(pk=self.plan.pk).update(materialized_count=0, is_active=True)
+            self.plan.refresh_from_db()
+
+            # The window covers the whole plan
+            with override_settings(REMINDER_WINDOW_OCCURRENCES=days):
+                with CaptureQueriesContext(connection) as captured:
+                    created = ReminderService.create_schedule_plan_reminders(self.plan)
+            queries[days] = len(captured)
+
+            self.plan.refresh_from_db()
+            self.assertEqual(self.plan.materialized_count, days)
+            reminders = self.reminders()
+            self.assertEqual([reminder.id for reminder in reminders], [reminder.id for reminder in created])
+            self.assertEqual([reminder.sequence_number for reminder in reminders], list(range(1, days + 1)))
+            self.assertEqual(
+                [reminder.scheduled_for for reminder in reminders],
+                [self.plan.first_occurrence_at + timedelta(days=index) for index in range(days)]
+            )
+        # One INSERT whatever the length of the plan
+        self.assertEqual(queries[10], queries[60])
+
+    def test_initial_window(self, send_task):
+        self.assertEqual(len(self.start_schedule()), 4)
+        self.assertEqual(self.plan.materialized_count, 4)
+        self.assertFollowsSchedule(self.reminders())
+
+    def test_periodic_task_extends_the_window(self, send_task):
+        self.start_schedule()
+
+        with mock.patch('django.utils.timezone.now', return_value=self.START + timedelta(days=2)):
+            self.assertEqual(extend_reminder_windows(), {'created': 2})
+        self.assertEqual(len(self.reminders()), 6)
+        self.assertFollowsSchedule(self.reminders())
+
+        # Nothing is created past the end of the plan
+        with mock.patch('django.utils.timezone.now', return_value=self.START + timedelta(days=30)):
+            extend_reminder_windows()
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.materialized_count, 10)
+        self.assertEqual(len(self.reminders()), 10)
+
+    def test_late_checkin_shifts_the_schedule(self, send_task):
+        self.start_schedule()
+        first, second = self.reminders()[:2]
+        checked_in_at = self.START + timedelta(days=1, hours=2)
+
+        with mock.patch('django.utils.timezone.now', return_value=checked_in_at):
+            self.assertTrue(ReminderService.handle_checkin(first))
+
+        self.plan.refresh_from_db()
+        # The missed day is added at the end, the rest moves by how late the check-in was
+        self.assertEqual(self.plan.duration_days, 11)
+        self.assertEqual(self.plan.schedule_shift, timedelta(days=1, hours=2))
+        self.assertEqual(self.plan.materialized_count, 5)
+        pending = self.reminders()[2:]
+        self.assertFollowsSchedule(pending)
+        self.assertEqual(pending[0].scheduled_for, self.START + timedelta(days=3, hours=2))
+        send_task.assert_called_once_with('send_reminder_email', args=[second.id], eta=mock.ANY)
+
+    def test_inactive_plan(self, send_task):
+        self.start_schedule()
+        first = self.reminders()[0]
+        ActionPlan.objects.filter(pk=self.plan.pk).update(is_active=False)
+        self.plan.refresh_from_db()
+        reminders = self.reminders()
+
+        self.assertEqual(ReminderService.extend_schedule(self.plan, self.START + timedelta(days=5)), [])
+        with mock.patch('django.utils.timezone.now', return_value=self.START + timedelta(days=5)):
+            self.assertEqual(extend_reminder_windows(), {'created': 0})
+            self.assertTrue(ReminderService.handle_checkin(first))
+
+        self.plan.refresh_from_db()
+        self.assertEqual((self.plan.materialized_count, self.plan.duration_days), (4, 10))
+        self.assertEqual(self.plan.schedule_shift, timedelta(0))
+        self.assertEqual(
+            [reminder.scheduled_for for reminder in self.reminders()],
+            [reminder.scheduled_for for reminder in reminders]
+        )
+        send_task.assert_not_called()
+
+        # Nothing is listed as coming up for a cancelled plan
+        self.assertEqual(self.plan.upcoming_occurrences(3), [])
+        self.assertEqual(ActionPlanScheduleSerializer(self.plan).data['upcoming_reminders'], [])
+
+    def test_is_scheduled(self, send_task):
+        self.assertTrue(PeriodicTask.objects.filter(
+            task='extend_reminder_windows', queue='Reminder', enabled=True
+        ).exists())
+
+
+class ReminderViewTests(TestCase):
+    START = timezone.make_aware(datetime(2026, 3, 2, 9, 0))
+
+    def setUp(self):
+        # The route has no patient_id for DoctorPatientPermission, only superusers get through
+        self.doctor = User.objects.create_user(
+            'doctor@example.com', None, user_type=User.UserType.DOCTOR, email_verified=True, is_superuser=True
+        )
+        self.patient = User.objects.create_user(
+            'patient@example.com', None, user_type=User.UserType.PATIENT, first_name='Ada', last_name='Lovelace'
+        )
+        self.doctor_patient = DoctorPatient.objects.create(doctor=self.doctor, patient=self.patient)
+        self.plan = ActionPlan.objects.create(
+            note=DoctorNote.objects.create(doctor_patient=self.doctor_patient),
+            patient=self.patient,
+            action='Take amoxicillin',
+            start_date=self.START.date(),
+            end_date=self.START.date() + timedelta(days=5),
+            duration_days=5,
+            first_occurrence_at=self.START,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def list_reminders(self, url):
+        seen = []
+        for _ in range(10):
+            if not url:
+                break
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['data']
+            seen += data['results']
+            url = data['next']
+        return seen
+
+    def test_flat_view(self):
+        reminders = Reminder.objects.bulk_create(ReminderService.build_schedule(self.plan, 0, 5))
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/reminders/?view=flat&pagination=cursor&page_size=2')
+        self.assertEqual(response.status_code, 200)
+        first = response.json()['data']['results'][0]
+        self.assertEqual(set(first), {
+            'id', 'title', 'description', 'scheduled_for', 'completed', 'completed_at', 'is_active',
+            'sequence_number', 'action_plan_id', 'action', 'frequency', 'patient_id', 'patient_name',
+        })
+        self.assertEqual(
+            (first['action_plan_id'], first['action'], first['frequency'], first['patient_name']),
+            (self.plan.id, 'Take amoxicillin', ActionPlan.Frequency.DAILY, self.patient.full_name)
+        )
+
+        # The cursor moves forward through every page
+        seen = self.list_reminders('/api/v1/reminders/?view=flat&pagination=cursor&page_size=2')
+        self.assertEqual([row['id'] for row in seen], [reminder.id for reminder in reminders])
+        self.assertEqual([row['sequence_number'] for row in seen], [1, 2, 3, 4, 5])
+
+    @mock.patch('api.external.services.app.send_task')
+    def test_doctor_is_denormalized(self, send_task):
+        other = DoctorPatient.objects.create(
+            doctor=User.objects.create_user('other-doctor@example.com', None, user_type=User.UserType.DOCTOR),
+            patient=User.objects.create_user('other-patient@example.com', None, user_type=User.UserType.PATIENT),
+        )
+        other_plan = ActionPlan.objects.create(
+            note=DoctorNote.objects.create(doctor_patient=other),
+            patient=other.patient,
+            action='Walk 30 minutes',
+            start_date=self.START.date(),
+            end_date=self.START.date() + timedelta(days=5),
+            duration_days=5,
+        )
+        # Bulk created reminders
+        created = ReminderService.create_schedule_plan_reminders(self.plan)
+        ReminderService.create_schedule_plan_reminders(other_plan)
+        # Reminder.save
+        extra = Reminder.objects.create(
+            action_plan=self.plan,
+            patient=self.patient,
+            title=self.plan.action,
+            description=self.plan.action,
+            scheduled_for=self.START + timedelta(days=5),
+            sequence_number=6,
+        )
+
+        self.assertEqual(len(created), 5)
+        self.assertEqual(other_plan.doctor_id, other.doctor_id)
+        for reminder in Reminder.objects.filter(id__in=[reminder.id for reminder in created] + [extra.id]):
+            self.assertEqual((reminder.doctor_id, reminder.doctor_patient_id), (self.doctor.id, self.doctor_patient.id))
+        self.assertTrue(Reminder.objects.filter(doctor_id=other.doctor_id).exists())
+
+        seen = self.list_reminders('/api/v1/reminders/?pagination=cursor&page_size=2')
+        self.assertEqual(
+            sorted(row['id'] for row in seen),
+            sorted([reminder.id for reminder in created] + [extra.id])
+        )
@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
-from apps.user.models import User, UserOTP
-from apps.doctor.models import DoctorPatient, DoctorNote, ChecklistItem
+from apps.user.models import User, UserOTP, KeyRotation
+from apps.doctor.models import DoctorPatient, DoctorNote, ChecklistItem, NoteJob
 from apps.patient.models import Reminder, ActionPlan
 
 class CustomUserAdmin(UserAdmin):
@@ -67,7 +67,7 @@ class ActionPlanAdmin(admin.ModelAdmin):
     list_display_links = ('note', 'action')
     list_filter = ('frequency', 'is_active')
     search_fields = ('action', 'note__content')
-    raw_id_fields = ('note',)
+    raw_id_fields = ('note', 'patient', 'doctor_patient', 'doctor')
     date_hierarchy = 'start_date'
     ordering = ('id',)
 
@@ -92,12 +92,31 @@ class DoctorNoteAdmin(admin.ModelAdmin):
     get_patient.short_description = 'Patient'
     get_patient.admin_order_field = 'doctor_patient__patient__email'
 
+class NoteJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'note', 'status', 'progress', 'created_at', 'completed_at')
+    list_display_links = ('id', 'note')
+    list_filter = ('status',)
+    raw_id_fields = ('note',)
+    date_hierarchy = 'created_at'
+    readonly_fields = ('error',)
+    ordering = ('id',)
+
+class KeyRotationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'last_note_id', 'until_note_id', 'rewrapped', 'failed', 'created_at', 'completed_at')
+    list_display_links = ('id', 'user')
+    list_filter = ('status',)
+    search_fields = ('user__email',)
+    raw_id_fields = ('user',)
+    exclude = ('old_public_key', 'old_private_key')
+    readonly_fields = ('error',)
+    ordering = ('-id',)
+
 class ReminderAdmin(admin.ModelAdmin):
     list_display = ('id', 'action_plan', 'get_patient', 'title', 'scheduled_for', 'completed', 'is_active')
     list_display_links = ('action_plan',)
     list_filter = ('completed', 'is_active')
     search_fields = ('title', 'action_plan__note__content', 'patient__email')
-    raw_id_fields = ('action_plan', 'patient')
+    raw_id_fields = ('action_plan', 'patient', 'doctor_patient', 'doctor')
     date_hierarchy = 'scheduled_for'
     ordering = ('id',)
 
@@ -111,5 +130,7 @@ admin.site.register(UserOTP, UserOTPAdmin)
 admin.site.register(DoctorPatient, DoctorPatientAdmin)
 admin.site.register(DoctorNote, DoctorNoteAdmin)
 admin.site.register(ChecklistItem, ChecklistItemAdmin)
+admin.site.register(NoteJob, NoteJobAdmin)
+admin.site.register(KeyRotation, KeyRotationAdmin)
 admin.site.register(ActionPlan, ActionPlanAdmin)
 admin.site.register(Reminder, ReminderAdmin)
\ No newline at end of file
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.celery import app
+from apps.user.models import User, KeyRotation
+from api.external.services import KeyRotationService
+
+
+class Command(BaseCommand):
+    help = "Replace a user's encryption keys and re-wrap their notes for the new key"
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', nargs='?', help='User whose keys are rotated')
+        parser.add_argument('--resume', type=int, metavar='ROTATION_ID', help='Continue a stopped rotation from its checkpoint')
+        parser.add_argument('--batch-size', type=int, default=None, help='Notes re-wrapped per transaction')
+        parser.add_argument('--notes-per-second', type=float, default=None, help='Throttle to keep database load down')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Queue the re-wrapping on the Keys worker')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                rotation = KeyRotation.objects.select_related('user').get(id=options['resume'])
+            except KeyRotation.DoesNotExist:
+                raise CommandError(f"Key rotation {options['resume']} does not exist")
+            if rotation.status == KeyRotation.Status.COMPLETED:
+                raise CommandError(f"Key rotation {rotation.id} already completed")
+        elif options['email']:
+            try:
+                user = User.objects.get(email=options['email'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['email']}")
+            rotation = KeyRotationService.start(user)
+            self.stdout.write(f"Started key rotation {rotation.id} for {user.email}, notes up to id {rotation.until_note_id}")
+        else:
+            raise CommandError("Give a user email or --resume ROTATION_ID")
+
+        if options['run_async']:
+            app.send_task('rotate_note_keys', args=[rotation.id])
+            self.stdout.write(f"Queued key rotation {rotation.id}")
+            return
+
+        KeyRotationService.run(
+            rotation,
+            batch_size=options['batch_size'],
+            notes_per_second=options['notes_per_second'],
+            progress=lambda rotation: self.stdout.write(
+                f"Re-wrapped {rotation.rewrapped} notes, {rotation.failed} failed (last id {rotation.last_note_id})"
+            )
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Key rotation {rotation.id} completed: {rotation.rewrapped} notes re-wrapped, {rotation.failed} failed"
+        ))
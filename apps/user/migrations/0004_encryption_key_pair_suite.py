@@ -0,0 +1,29 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+from django.db import migrations, models
+
+
+def set_pooled_suites(apps, schema_editor):
+    # The pool was filled with NOTE_KEY_SUITE pairs, which may already have been X25519
+    EncryptionKeyPair = apps.get_model('user', 'EncryptionKeyPair')
+    x25519_ids = [
+        pair.id for pair in EncryptionKeyPair.objects.only('id', 'public_key').iterator()
+        if isinstance(serialization.load_pem_public_key(bytes(pair.public_key)), x25519.X25519PublicKey)
+    ]
+    EncryptionKeyPair.objects.filter(id__in=x25519_ids).update(suite='x25519')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_key_rotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptionkeypair',
+            name='suite',
+            field=models.CharField(default='rsa', max_length=10),
+        ),
+        migrations.RunPython(set_pooled_suites, migrations.RunPython.noop),
+    ]
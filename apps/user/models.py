@@ -2,8 +2,13 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import BaseUserManager, PermissionsMixin
-from api.utils.encryption import NoteEncryption
+from api.utils.encryption import NoteEncryption, key_cache
+from api.utils.metrics import KEY_POOL_DEPTH, KEY_POOL_CLAIMS
+from api.utils.redis_client import get_redis_client
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
+from core.celery import app
 
 # Create your models here.
 class CustomUserManager(BaseUserManager):
@@ -103,20 +108,123 @@ class User(AbstractUser, PermissionsMixin):
 
     @property 
     def full_name(self):
-        if not self.first_name and not self.last_name:
-            return self.get_name_from_email
-        return f"{self.first_name} {self.last_name}".strip().title()
+        return self.format_full_name(self.first_name, self.last_name, self.email, self.username)
+
+    @staticmethod
+    def format_full_name(first_name, last_name, email, username):
+        """`full_name` from plain column values, for rows read with values()"""
+        if not first_name and not last_name:
+            if email:
+                return email.split('@')[0].replace('.', ' ').title()
+            return username
+        return f"{first_name} {last_name}".strip().title()
     
     def generate_encryption_keys(self):
         """Generate and store encryption keys for the user"""
         if not self.public_key or not self.private_key:
-            private_pem, public_pem = NoteEncryption.generate_key_pair()
+            # Generating RSA keys takes long, only do it here when the pool is empty
+            private_pem, public_pem = EncryptionKeyPair.claim() or NoteEncryption.generate_key_pair()
             self.private_key = private_pem
             self.public_key = public_pem
-            self.save()
+            self.save(update_fields=['private_key', 'public_key'])
+            key_cache.invalidate(self.id)
         return self.public_key, self.private_key
+
+    def retired_private_keys(self):
+        """Rotated out private keys, kept until every note has been re-wrapped for the new key"""
+        if not hasattr(self, '_retired_private_keys'):
+            self._retired_private_keys = [
+                bytes(key) for key in self.key_rotations.filter(
+                    old_private_key__isnull=False
+                ).order_by('-created_at').values_list('old_private_key', flat=True)
+            ]
+        return self._retired_private_keys
     
     
+class EncryptionKeyPair(models.Model):
+    """Pre-generated key pair waiting to be handed to a user, filled by the refill_key_pool task"""
+    private_key = models.BinaryField()
+    public_key = models.BinaryField()
+    # NOTE_KEY_SUITE the pair was generated for, pairs of other suites are never handed out
+    suite = models.CharField(max_length=10, default='rsa')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    refill_key = 'key_pool:refill_scheduled'
+    # X25519 keys are generated in microseconds, only RSA keys are worth pooling
+    pooled_suites = {'rsa'}
+
+    class Meta:
+        verbose_name = _('Encryption Key Pair')
+        verbose_name_plural = _('Encryption Key Pairs')
+
+    @classmethod
+    def is_pooled(cls):
+        return settings.NOTE_KEY_SUITE in cls.pooled_suites
+
+    @classmethod
+    def claim(cls):
+        """Take a key pair of the NOTE_KEY_SUITE suite out of the pool, returns (private_pem, public_pem) or None when empty"""
+        if not cls.is_pooled():
+            return None
+
+        pairs = cls.objects.filter(suite=settings.NOTE_KEY_SUITE)
+        with transaction.atomic():
+            # Concurrent claims skip rows another transaction has locked instead of waiting
+            pair = pairs.select_for_update(skip_locked=True).order_by('id').first()
+            if pair is not None:
+                pair.delete()
+
+        depth = pairs.count()
+        KEY_POOL_DEPTH.set(depth)
+        KEY_POOL_CLAIMS.labels(result='pooled' if pair else 'empty').inc()
+        if depth < settings.KEY_POOL_LOW_WATER_MARK:
+            cls.request_refill()
+
+        if pair is None:
+            return None
+        return bytes(pair.private_key), bytes(pair.public_key)
+
+    @classmethod
+    def request_refill(cls):
+        """Queue a refill unless one was queued recently"""
+        try:
+            if get_redis_client().set(cls.refill_key, 1, nx=True, ex=60):
+                app.send_task('refill_key_pool')
+        except Exception as e:
+            print(f"Failed to queue key pool refill: {e}")
+
+
+class KeyRotation(models.Model):
+    """Progress of re-wrapping a user's notes after their encryption keys were replaced"""
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        COMPLETED = 'COMPLETED', 'Completed'
+        FAILED = 'FAILED', 'Failed'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='key_rotations')
+    # Notes are decrypted with the old key until they are re-wrapped, cleared once all are
+    old_public_key = models.BinaryField(null=True)
+    old_private_key = models.BinaryField(null=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    # Notes up to this id were encrypted for the old key, later ones already use the new one
+    until_note_id = models.PositiveBigIntegerField(default=0)
+    # Checkpoint: every note up to this id has been handled
+    last_note_id = models.PositiveBigIntegerField(default=0)
+    rewrapped = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Key rotation {self.id} for {self.user.email} ({self.status})"
+
+
 class UserOTP(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     otp_secret = models.CharField(max_length=64, unique=True, editable=False)
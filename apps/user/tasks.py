@@ -1,6 +1,7 @@
 from celery import shared_task
 from django.utils import timezone
-from apps.patient.models import Reminder
+from apps.patient.models import Reminder, ActionPlan
+from django.db.models import F
 from datetime import timedelta
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -9,7 +10,9 @@ from celery.utils.log import get_task_logger
 from core.celery import app
 from api.utils.generate_otp import generate_otp_secret, generate_numeric_otp
 from django.shortcuts import get_object_or_404
-from apps.user.models import User
+from apps.user.models import User, EncryptionKeyPair, KeyRotation
+from api.utils.encryption import NoteEncryption
+from api.utils.metrics import KEY_POOL_DEPTH
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from api.utils.tokens import FlexibleTokenGenerator
@@ -88,8 +91,10 @@ def check_and_send_due_reminders():
     Periodic task that runs every 5 minutes to check and send due reminders
     """
     now = timezone.now()
+    # is_active matches the reminder_due_idx partial index, inactive reminders aren't sent anyway
     due_reminders = Reminder.objects.filter(
         completed=False,
+        is_active=True,
         scheduled_for__lte=now
     ).select_related('patient', 'action_plan')
 
@@ -97,6 +102,29 @@ def check_and_send_due_reminders():
         send_reminder_email.delay(reminder.id)
 
 
+@app.task(name='extend_reminder_windows', serializer='json', queue="Reminder")
+def extend_reminder_windows():
+    """
+    Periodic task creating the reminders of active plans that have come
+    within REMINDER_WINDOW_OCCURRENCES intervals
+    """
+    from api.external.services import ReminderService
+
+    now = timezone.now()
+    plans = ActionPlan.objects.filter(
+        is_active=True,
+        first_occurrence_at__isnull=False,
+        materialized_count__lt=F('duration_days')
+    ).order_by('pk')
+
+    created = 0
+    for plan in plans.iterator(chunk_size=500):
+        created += len(ReminderService.extend_schedule(plan, now))
+
+    logger.info(f"Created {created} reminders")
+    return {'created': created}
+
+
 @app.task(name='send_otp_code_email', serializer='json', queue="Mail")
 def send_otp_code_email(data):
     pk          = data.get('pk')
@@ -165,3 +193,42 @@ def reset_password_email(data):
     
     return{'message':'mail sent successfully'}
 
+@app.task(name='refill_key_pool', serializer='json', queue="Keys")
+def refill_key_pool():
+    """Generate key pairs of the NOTE_KEY_SUITE suite until the pool is back at KEY_POOL_TARGET_SIZE"""
+    suite = settings.NOTE_KEY_SUITE
+    # Pairs left over from a previously configured suite would never be claimed
+    EncryptionKeyPair.objects.exclude(suite=suite).delete()
+    if not EncryptionKeyPair.is_pooled():
+        KEY_POOL_DEPTH.set(0)
+        return {'depth': 0}
+
+    depth = EncryptionKeyPair.objects.filter(suite=suite).count()
+    missing = settings.KEY_POOL_TARGET_SIZE - depth
+
+    # Save in small batches so claims can use the new keys while the rest are generated
+    while missing > 0:
+        batch = [
+            EncryptionKeyPair(private_key=private_pem, public_key=public_pem, suite=suite)
+            for private_pem, public_pem in (NoteEncryption.generate_key_pair(suite) for _ in range(min(missing, 10)))
+        ]
+        EncryptionKeyPair.objects.bulk_create(batch)
+        missing -= len(batch)
+        depth += len(batch)
+        KEY_POOL_DEPTH.set(depth)
+
+    logger.info(f"Key pool holds {depth} {suite} key pairs")
+    return {'depth': depth}
+
+@app.task(name='rotate_note_keys', serializer='json', queue="Keys")
+def rotate_note_keys(rotation_id):
+    """Re-wrap the notes of a started key rotation, resumes from its checkpoint"""
+    from api.external.services import KeyRotationService
+
+    rotation = KeyRotation.objects.select_related('user').get(id=rotation_id)
+    if rotation.status == KeyRotation.Status.COMPLETED:
+        return {'rotation': rotation_id, 'status': rotation.status}
+
+    KeyRotationService.run(rotation)
+    logger.info(f"Key rotation {rotation_id}: {rotation.rewrapped} notes re-wrapped, {rotation.failed} failed")
+    return {'rotation': rotation_id, 'status': rotation.status, 'rewrapped': rotation.rewrapped, 'failed': rotation.failed}
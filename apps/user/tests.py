@@ -1,3 +1,243 @@
-from django.test import TestCase
+import base64
+import threading
+from unittest import mock
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from api.external.services import KeyRotationService
+from apps.doctor.models import DoctorPatient, DoctorNote
+from apps.user.models import User, EncryptionKeyPair, KeyRotation
+from apps.user.tasks import refill_key_pool
 
-# Create your tests here.
+
+@override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'], METRICS_BASIC_AUTH_USER='', METRICS_BASIC_AUTH_PASSWORD='')
+class MetricsAccessTests(TestCase):
+    def test_allowed_network(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'caresync_', response.content)
+
+    def test_other_address_is_refused(self):
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+    @override_settings(METRICS_BASIC_AUTH_USER='prometheus', METRICS_BASIC_AUTH_PASSWORD='secret')
+    def test_basic_auth(self):
+        def get(credentials):
+            return self.client.get(
+                '/metrics/',
+                REMOTE_ADDR='203.0.113.7',
+                HTTP_AUTHORIZATION='Basic ' + base64.b64encode(credentials).decode()
+            )
+
+        self.assertEqual(get(b'prometheus:secret').status_code, 200)
+        response = get(b'prometheus:wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+
+
+def fill_pool(count, suite='rsa'):
+    EncryptionKeyPair.objects.bulk_create([
+        EncryptionKeyPair(private_key=f'private-{index}'.encode(), public_key=f'public-{index}'.encode(), suite=suite)
+        for index in range(count)
+    ])
+
+
+@override_settings(NOTE_KEY_SUITE='rsa', KEY_POOL_LOW_WATER_MARK=2)
+@mock.patch('apps.user.models.EncryptionKeyPair.request_refill')
+class KeyPoolTests(TestCase):
+    def test_claim_takes_the_oldest_pair(self, request_refill):
+        fill_pool(4)
+        self.assertEqual(EncryptionKeyPair.claim(), (b'private-0', b'public-0'))
+        self.assertEqual(EncryptionKeyPair.objects.count(), 3)
+        request_refill.assert_not_called()
+
+    def test_refill_is_requested_below_the_low_water_mark(self, request_refill):
+        fill_pool(2)
+        EncryptionKeyPair.claim()
+        request_refill.assert_called_once()
+
+    def test_empty_pool(self, request_refill):
+        self.assertIsNone(EncryptionKeyPair.claim())
+        request_refill.assert_called_once()
+
+    def test_pairs_of_another_suite_are_not_claimed(self, request_refill):
+        fill_pool(3, suite='x25519')
+        self.assertIsNone(EncryptionKeyPair.claim())
+
+    @override_settings(NOTE_KEY_SUITE='x25519')
+    def test_cheap_suites_skip_the_pool(self, request_refill):
+        fill_pool(3, suite='x25519')
+        self.assertIsNone(EncryptionKeyPair.claim())
+        self.assertEqual(EncryptionKeyPair.objects.count(), 3)
+        request_refill.assert_not_called()
+
+    @override_settings(NOTE_KEY_SUITE='x25519')
+    def test_users_get_a_generated_pair_for_cheap_suites(self, request_refill):
+        fill_pool(3)
+        user = User.objects.create_user('patient@example.com', None, user_type=User.UserType.PATIENT)
+        public_key, _ = user.generate_encryption_keys()
+        self.assertTrue(public_key.startswith(b'-----BEGIN PUBLIC KEY-----'))
+        self.assertEqual(EncryptionKeyPair.objects.count(), 3)
+
+    @mock.patch('apps.user.models.NoteEncryption.generate_key_pair', return_value=(b'generated', b'generated-public'))
+    def test_users_get_a_generated_pair_when_the_pool_is_empty(self, generate_key_pair, request_refill):
+        user = User.objects.create_user('patient@example.com', None, user_type=User.UserType.PATIENT)
+        self.assertEqual(user.generate_encryption_keys(), (b'generated-public', b'generated'))
+        generate_key_pair.assert_called_once()
+
+    @mock.patch('apps.user.models.NoteEncryption.generate_key_pair')
+    def test_users_get_a_pooled_pair(self, generate_key_pair, request_refill):
+        fill_pool(3)
+        user = User.objects.create_user('patient@example.com', None, user_type=User.UserType.PATIENT)
+        self.assertEqual(user.generate_encryption_keys(), (b'public-0', b'private-0'))
+        generate_key_pair.assert_not_called()
+
+
+class KeyPoolRefillTests(TestCase):
+    @mock.patch('apps.user.models.app.send_task')
+    @mock.patch('apps.user.models.get_redis_client')
+    def test_refill_is_queued_once_per_window(self, get_redis_client, send_task):
+        # SET NX succeeds for the first request only
+        get_redis_client.return_value.set.side_effect = [True, None]
+
+        EncryptionKeyPair.request_refill()
+        EncryptionKeyPair.request_refill()
+
+        send_task.assert_called_once_with('refill_key_pool')
+
+    @mock.patch('apps.user.models.app.send_task')
+    @mock.patch('apps.user.models.get_redis_client', side_effect=ConnectionError('redis down'))
+    def test_unavailable_redis_does_not_fail_the_claim(self, get_redis_client, send_task):
+        EncryptionKeyPair.request_refill()
+        send_task.assert_not_called()
+
+
+@override_settings(KEY_POOL_TARGET_SIZE=12)
+@mock.patch('apps.user.tasks.NoteEncryption.generate_key_pair', return_value=(b'generated', b'generated-public'))
+class RefillKeyPoolTests(TestCase):
+    @override_settings(NOTE_KEY_SUITE='rsa')
+    def test_fills_up_to_the_target_size(self, generate_key_pair):
+        fill_pool(5)
+        fill_pool(2, suite='x25519')
+
+        self.assertEqual(refill_key_pool(), {'depth': 12})
+
+        generate_key_pair.assert_called_with('rsa')
+        self.assertEqual(generate_key_pair.call_count, 7)
+        self.assertEqual(EncryptionKeyPair.objects.filter(suite='rsa').count(), 12)
+        self.assertFalse(EncryptionKeyPair.objects.exclude(suite='rsa').exists())
+
+    @override_settings(NOTE_KEY_SUITE='x25519')
+    def test_cheap_suites_are_not_pooled(self, generate_key_pair):
+        fill_pool(5)
+
+        self.assertEqual(refill_key_pool(), {'depth': 0})
+
+        generate_key_pair.assert_not_called()
+        self.assertFalse(EncryptionKeyPair.objects.exists())
+
+
+@override_settings(NOTE_KEY_SUITE='rsa', KEY_POOL_LOW_WATER_MARK=0)
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class ConcurrentKeyPoolClaimTests(TransactionTestCase):
+    def test_concurrent_claims_never_share_a_pair(self):
+        fill_pool(20)
+        claimed = []
+        barrier = threading.Barrier(8)
+
+        def claim():
+            barrier.wait()
+            try:
+                for _ in range(3):
+                    claimed.append(EncryptionKeyPair.claim())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pairs = [pair for pair in claimed if pair is not None]
+        self.assertEqual(len(pairs), 20)
+        self.assertEqual(len(set(pairs)), 20)
+        self.assertEqual(EncryptionKeyPair.objects.count(), 0)
+
+
+@override_settings(NOTE_KEY_SUITE='x25519')
+class KeyRotationTests(TestCase):
+    def setUp(self):
+        doctor = User.objects.create_user('doctor@example.com', None, user_type=User.UserType.DOCTOR)
+        self.patient = User.objects.create_user('patient@example.com', None, user_type=User.UserType.PATIENT)
+        doctor_patient = DoctorPatient.objects.create(doctor=doctor, patient=self.patient)
+        self.notes = []
+        for index in range(5):
+            note = DoctorNote(doctor_patient=doctor_patient)
+            note.encrypt_note(f'Note {index}')
+            self.notes.append(note)
+        self.patient.refresh_from_db()
+        self.old_private_key = bytes(self.patient.private_key)
+
+    def run_rotation(self, rotation, **kwargs):
+        return KeyRotationService.run(rotation, batch_size=2, notes_per_second=10000, **kwargs)
+
+    def assertReadableWithNewKey(self):
+        user = User.objects.get(id=self.patient.id)
+        for index, note in enumerate(self.notes):
+            note = DoctorNote.objects.select_related('doctor_patient__doctor', 'doctor_patient__patient').get(id=note.id)
+            self.assertEqual(note.decrypt_with_key(user, bytes(user.private_key)), f'Note {index}')
+
+    def test_rotation(self):
+        rotation = self.run_rotation(KeyRotationService.start(self.patient))
+
+        self.assertEqual(rotation.status, KeyRotation.Status.COMPLETED)
+        self.assertEqual((rotation.rewrapped, rotation.failed), (5, 0))
+        self.assertIsNone(rotation.old_private_key)
+        self.assertReadableWithNewKey()
+
+    def test_notes_are_read_with_the_retired_key_until_rewrapped(self):
+        KeyRotationService.start(self.patient)
+        user = User.objects.get(id=self.patient.id)
+        self.assertNotEqual(bytes(user.private_key), self.old_private_key)
+        self.assertEqual(user.retired_private_keys(), [self.old_private_key])
+
+        note = DoctorNote.objects.select_related('doctor_patient__doctor', 'doctor_patient__patient').get(id=self.notes[0].id)
+        self.assertEqual(note.decrypt_note(user), 'Note 0')
+
+    def test_resumes_from_the_checkpoint(self):
+        rotation = KeyRotationService.start(self.patient)
+        with self.assertRaises(RuntimeError):
+            self.run_rotation(rotation, progress=mock.Mock(side_effect=RuntimeError('worker stopped')))
+
+        rotation.refresh_from_db()
+        self.assertEqual(rotation.status, KeyRotation.Status.FAILED)
+        self.assertEqual(rotation.last_note_id, self.notes[1].id)
+        self.assertEqual(rotation.rewrapped, 2)
+
+        with mock.patch.object(DoctorNote, 'rewrap_key', autospec=True, side_effect=DoctorNote.rewrap_key) as rewrap_key:
+            rotation = self.run_rotation(KeyRotation.objects.select_related('user').get(id=rotation.id))
+
+        self.assertEqual([call.args[0].id for call in rewrap_key.call_args_list], [note.id for note in self.notes[2:]])
+        self.assertEqual(rotation.status, KeyRotation.Status.COMPLETED)
+        self.assertEqual(rotation.rewrapped, 5)
+        self.assertReadableWithNewKey()
+
+    def test_failed_note_keeps_the_batch(self):
+        failing_id = self.notes[0].id
+
+        def rewrap_key(note, *args, **kwargs):
+            if note.id == failing_id:
+                raise DatabaseError('could not write note')
+            return original(note, *args, **kwargs)
+
+        original = DoctorNote.rewrap_key
+        with mock.patch.object(DoctorNote, 'rewrap_key', autospec=True, side_effect=rewrap_key):
+            rotation = self.run_rotation(KeyRotationService.start(self.patient))
+
+        self.assertEqual(rotation.status, KeyRotation.Status.COMPLETED)
+        self.assertEqual((rotation.rewrapped, rotation.failed), (4, 1))
+        self.assertEqual(rotation.last_note_id, self.notes[-1].id)
+        # The old key is kept while a note still needs it
+        self.assertEqual(bytes(rotation.old_private_key), self.old_private_key)
+        note = DoctorNote.objects.select_related('doctor_patient__doctor', 'doctor_patient__patient').get(id=failing_id)
+        self.assertEqual(note.decrypt_note(User.objects.get(id=self.patient.id)), 'Note 0')
@@ -267,6 +267,77 @@ SWAGGER_SETTINGS = {
 AUTH_USER_MODEL = 'user.User'
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+
+# LLM backend: 'gemini', or 'fake' to use the local stand-in (manage.py run_fake_llm_server)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+LLM_FAKE_SERVER_URL = os.getenv('LLM_FAKE_SERVER_URL', 'http://127.0.0.1:8765')
+LLM_REQUEST_TIMEOUT_SECONDS = int(os.getenv('LLM_REQUEST_TIMEOUT_SECONDS', 30))
+# USD per million tokens, used to estimate the cost of each call
+LLM_INPUT_COST_PER_MILLION_TOKENS = float(os.getenv('LLM_INPUT_COST_PER_MILLION_TOKENS', 0.10))
+LLM_OUTPUT_COST_PER_MILLION_TOKENS = float(os.getenv('LLM_OUTPUT_COST_PER_MILLION_TOKENS', 0.40))
+
+# /metrics/ is served to these addresses or networks, or to anyone with the basic auth credentials when set
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+METRICS_BASIC_AUTH_USER = os.getenv('METRICS_BASIC_AUTH_USER', '')
+METRICS_BASIC_AUTH_PASSWORD = os.getenv('METRICS_BASIC_AUTH_PASSWORD', '')
+
+# LLM admission control, shared by every process through Redis
+LLM_ADMISSION_ENABLED = bool(int(os.getenv('LLM_ADMISSION_ENABLED', 1)))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 32))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', 5))
+LLM_LEASE_SECONDS = int(os.getenv('LLM_LEASE_SECONDS', 120))
+LLM_BREAKER_WINDOW_SECONDS = int(os.getenv('LLM_BREAKER_WINDOW_SECONDS', 60))
+LLM_BREAKER_MIN_CALLS = int(os.getenv('LLM_BREAKER_MIN_CALLS', 10))
+LLM_BREAKER_ERROR_RATE = float(os.getenv('LLM_BREAKER_ERROR_RATE', 0.5))
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('LLM_BREAKER_SLOW_CALL_SECONDS', 10))
+LLM_BREAKER_SLOW_CALL_RATE = float(os.getenv('LLM_BREAKER_SLOW_CALL_RATE', 0.5))
+LLM_BREAKER_OPEN_SECONDS = int(os.getenv('LLM_BREAKER_OPEN_SECONDS', 30))
+# Fall back to the rule-based extraction instead of failing when the LLM is unavailable
+LLM_DEGRADE_TO_RULES = bool(int(os.getenv('LLM_DEGRADE_TO_RULES', 1)))
+
+# Rule-based extraction tried before the LLM
+RULE_EXTRACTOR_ENABLED = bool(int(os.getenv('RULE_EXTRACTOR_ENABLED', 1)))
+RULE_EXTRACTOR_MIN_CONFIDENCE = float(os.getenv('RULE_EXTRACTOR_MIN_CONFIDENCE', 0.85))
+
+# LLM extraction cache
+LLM_CACHE_ENABLED = bool(int(os.getenv('LLM_CACHE_ENABLED', 1)))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', 60 * 60 * 24 * 7))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000))
+
+# Micro-batching of async note extraction
+LLM_BATCH_ENABLED = bool(int(os.getenv('LLM_BATCH_ENABLED', 0)))
+LLM_BATCH_MAX_SIZE = int(os.getenv('LLM_BATCH_MAX_SIZE', 8))
+LLM_BATCH_WINDOW_MS = int(os.getenv('LLM_BATCH_WINDOW_MS', 500))
+
+# Note jobs still processing after this long are assumed lost with their worker and queued again
+NOTE_JOB_TIMEOUT_SECONDS = int(os.getenv('NOTE_JOB_TIMEOUT_SECONDS', 600))
+NOTE_JOB_MAX_ATTEMPTS = int(os.getenv('NOTE_JOB_MAX_ATTEMPTS', 3))
+
+# Key type generated for new users: 'x25519', or 'rsa' (2048-bit)
+NOTE_KEY_SUITE = os.getenv('NOTE_KEY_SUITE', 'x25519')
+# Loaded note encryption keys kept in memory per process
+NOTE_KEY_CACHE_SIZE = int(os.getenv('NOTE_KEY_CACHE_SIZE', 1024))
+# zlib compression of note plaintext before encryption, short notes are stored as is
+NOTE_COMPRESSION_ENABLED = bool(int(os.getenv('NOTE_COMPRESSION_ENABLED', 1)))
+NOTE_COMPRESSION_MIN_BYTES = int(os.getenv('NOTE_COMPRESSION_MIN_BYTES', 512))
+NOTE_COMPRESSION_LEVEL = int(os.getenv('NOTE_COMPRESSION_LEVEL', 6))
+# Threads decrypting notes for list endpoints, 1 decrypts inline
+NOTE_DECRYPTION_WORKERS = int(os.getenv('NOTE_DECRYPTION_WORKERS', 4))
+# Pre-generated RSA key pairs, refilled to the target size once below the low-water mark
+KEY_POOL_TARGET_SIZE = int(os.getenv('KEY_POOL_TARGET_SIZE', 100))
+KEY_POOL_LOW_WATER_MARK = int(os.getenv('KEY_POOL_LOW_WATER_MARK', 20))
+# Key rotation re-wraps notes in batches, throttled to this many notes per second
+KEY_ROTATION_BATCH_SIZE = int(os.getenv('KEY_ROTATION_BATCH_SIZE', 200))
+KEY_ROTATION_NOTES_PER_SECOND = float(os.getenv('KEY_ROTATION_NOTES_PER_SECOND', 500))
+
+# Paginated lists count exactly up to this many rows, larger totals are estimated and cached
+PAGINATION_EXACT_COUNT_THRESHOLD = int(os.getenv('PAGINATION_EXACT_COUNT_THRESHOLD', 10000))
+PAGINATION_COUNT_CACHE_SECONDS = int(os.getenv('PAGINATION_COUNT_CACHE_SECONDS', 60))
+
+# Reminders are stored for the next this many intervals of a plan, later ones are computed from its schedule
+REMINDER_WINDOW_OCCURRENCES = int(os.getenv('REMINDER_WINDOW_OCCURRENCES', 7))
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'caresyncai_redis')
 # REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
@@ -19,10 +19,12 @@ from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from django.conf import settings
 from django.conf.urls.static import static
+from api.utils.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('api.urls')),
+    path('metrics/', metrics_view, name='metrics'),
     
     # API Schema documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),